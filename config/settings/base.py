@@ -295,5 +295,92 @@ AWS_STORAGE_BUCKET_NAME = env("DJANGO_AWS_STORAGE_BUCKET_NAME")
 AWS_S3_REGION_NAME = env("DJANGO_AWS_S3_REGION_NAME")
 AWS_ACCESS_KEY_ID = env("DJANGO_AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = env("DJANGO_AWS_SECRET_ACCESS_KEY")
+# Set to a MinIO or other S3-compatible server to run without AWS
+AWS_S3_ENDPOINT_URL = env("DJANGO_AWS_S3_ENDPOINT_URL", default=None)
+AWS_S3_MAX_POOL_CONNECTIONS = env.int("DJANGO_AWS_S3_MAX_POOL_CONNECTIONS", default=10)
+
+# "s3", or "local" to keep clip audio under CLIPS_STORAGE_LOCAL_ROOT
+CLIPS_STORAGE_BACKEND = env("CLIPS_STORAGE_BACKEND", default="s3")
+CLIPS_STORAGE_LOCAL_ROOT = env("CLIPS_STORAGE_LOCAL_ROOT", default=MEDIA_ROOT)
+CLIPS_STORAGE_LOCAL_URL = env("CLIPS_STORAGE_LOCAL_URL", default=MEDIA_URL)
 
 OPENAI_API_KEY = env("OPENAI_API_KEY")
+OPENAI_TIMEOUT = env.float("OPENAI_TIMEOUT", default=60.0)
+OPENAI_MAX_RETRIES = env.int("OPENAI_MAX_RETRIES", default=5)
+# Keep these under the account's limits, they are shared by every thread
+OPENAI_REQUESTS_PER_MINUTE = env.int("OPENAI_REQUESTS_PER_MINUTE", default=500)
+OPENAI_TOKENS_PER_MINUTE = env.int("OPENAI_TOKENS_PER_MINUTE", default=60000)
+CLIPS_EMBEDDING_MODEL = env("CLIPS_EMBEDDING_MODEL", default="BAAI/bge-large-en-v1.5")
+# Load the embedding model at startup instead of on the first search, for
+# processes that will need it anyway
+CLIPS_PRELOAD_EMBEDDING_MODEL = env.bool(
+    "CLIPS_PRELOAD_EMBEDDING_MODEL",
+    default=False,
+)
+# e.g. http://127.0.0.1:8765 for `manage.py embedding_server`, so processes on
+# a host share one copy of the model instead of each loading their own
+CLIPS_EMBEDDING_SERVER_URL = env("CLIPS_EMBEDDING_SERVER_URL", default=None)
+CLIPS_EMBEDDING_SERVER_TIMEOUT = env.float(
+    "CLIPS_EMBEDDING_SERVER_TIMEOUT",
+    default=10.0,
+)
+# Candidates the HNSW index keeps per search; higher finds more of the true
+# nearest paragraphs, more slowly. IVFFlat lists probed, if that index is used
+CLIPS_HNSW_EF_SEARCH = env.int("CLIPS_HNSW_EF_SEARCH", default=40)
+CLIPS_IVFFLAT_PROBES = env.int("CLIPS_IVFFLAT_PROBES", default=10)
+# How vector search finds paragraphs: "index" searches the vector index,
+# "binary" scans every paragraph's sign bits by Hamming distance, with no
+# index, and re-ranks the best k * CLIPS_BINARY_RERANK_FACTOR exactly
+CLIPS_VECTOR_SEARCH = env("CLIPS_VECTOR_SEARCH", default="index")
+CLIPS_BINARY_RERANK_FACTOR = env.int("CLIPS_BINARY_RERANK_FACTOR", default=10)
+# Hybrid search: candidates taken from each of full-text and vector search,
+# and how much each counts in reciprocal rank fusion
+CLIPS_SEARCH_CANDIDATES = env.int("CLIPS_SEARCH_CANDIDATES", default=100)
+CLIPS_SEARCH_FULLTEXT_WEIGHT = env.float("CLIPS_SEARCH_FULLTEXT_WEIGHT", default=1.0)
+CLIPS_SEARCH_VECTOR_WEIGHT = env.float("CLIPS_SEARCH_VECTOR_WEIGHT", default=1.0)
+CLIPS_SEARCH_RRF_K = env.int("CLIPS_SEARCH_RRF_K", default=60)
+# Threads per process running the vector half of hybrid searches, each with
+# its own database connection kept between searches
+CLIPS_SEARCH_THREADS = env.int("CLIPS_SEARCH_THREADS", default=4)
+# Full-text results are paged by clip, showing each clip's best paragraphs
+CLIPS_SEARCH_CLIPS_PER_PAGE = env.int("CLIPS_SEARCH_CLIPS_PER_PAGE", default=20)
+CLIPS_SEARCH_PARAGRAPHS_PER_CLIP = env.int(
+    "CLIPS_SEARCH_PARAGRAPHS_PER_CLIP",
+    default=5,
+)
+# Most matching paragraphs sorted and grouped into clips for one page
+CLIPS_SEARCH_PAGE_CANDIDATES = env.int("CLIPS_SEARCH_PAGE_CANDIDATES", default=1000)
+# Search query vectors kept in each process, and in the shared cache for this
+# many seconds
+CLIPS_QUERY_EMBEDDING_CACHE_SIZE = env.int(
+    "CLIPS_QUERY_EMBEDDING_CACHE_SIZE",
+    default=1024,
+)
+CLIPS_QUERY_EMBEDDING_CACHE_TTL = env.int(
+    "CLIPS_QUERY_EMBEDDING_CACHE_TTL",
+    default=7 * 24 * 60 * 60,
+)
+# Clips listed per page of a channel
+CLIPS_CHANNEL_CLIPS_PER_PAGE = env.int("CLIPS_CHANNEL_CLIPS_PER_PAGE", default=24)
+# Seconds a rendered clip page is cached; edits retire it sooner
+CLIPS_PAGE_CACHE_TTL = env.int("CLIPS_PAGE_CACHE_TTL", default=24 * 60 * 60)
+# Evicted by `manage.py summary_cache prune`
+CLIPS_SUMMARY_CACHE_MAX_ENTRIES = env.int(
+    "CLIPS_SUMMARY_CACHE_MAX_ENTRIES",
+    default=100000,
+)
+CLIPS_SUMMARY_CACHE_MAX_AGE_DAYS = env.int(
+    "CLIPS_SUMMARY_CACHE_MAX_AGE_DAYS",
+    default=180,
+)
+# Chapters of one clip summarized at once
+CLIPS_SUMMARY_CONCURRENCY = env.int("CLIPS_SUMMARY_CONCURRENCY", default=8)
+
+YOUTUBE_METADATA_CACHE_DIR = env(
+    "YOUTUBE_METADATA_CACHE_DIR",
+    default=str(BASE_DIR / ".cache" / "youtube"),
+)
+YOUTUBE_METADATA_CACHE_TTL = env.int(
+    "YOUTUBE_METADATA_CACHE_TTL",
+    default=24 * 60 * 60,
+)
@@ -1,5 +1,13 @@
 from django.contrib import admin
 
+from .models import Channel
 from .models import Clip
+from .models import IngestJob
+from .models import SummaryCache
+from .models import TranscriptArchive
 
+admin.site.register(Channel)
 admin.site.register(Clip)
+admin.site.register(IngestJob)
+admin.site.register(SummaryCache)
+admin.site.register(TranscriptArchive)
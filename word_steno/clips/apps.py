@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ClipsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "word_steno.clips"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        if settings.CLIPS_PRELOAD_EMBEDDING_MODEL:
+            from .embeddings import preload_model
+
+            preload_model()
@@ -0,0 +1,585 @@
+"""Benchmarks behind ``manage.py benchmark``.
+
+Each benchmark builds its own synthetic input, so none of them need YouTube,
+Deepgram or OpenAI, and returns rows of results for the command to print.
+"""
+
+import gzip
+import json
+import math
+import random
+import resource
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from io import BytesIO
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
+from django.contrib.postgres.search import SearchRank
+from django.contrib.postgres.search import SearchVector
+from django.core.management import call_command
+from django.db import connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .embeddings import nearest
+from .embeddings import nearest_binary
+from .embeddings import preload_model
+from .models import Channel
+from .models import Clip
+from .models import ClipParagraph
+from .models import ClipWords
+from .models import pack_words
+from .persistence import BULK_BATCH_SIZE
+from .persistence import build_paragraphs
+from .persistence import copy_paragraphs
+from .persistence import paragraph_text
+from .persistence import save_page_payload
+from .persistence import save_paragraphs
+from .storage import S3Storage
+from .utils import assign_paragraphs
+
+MB = 1024 * 1024
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def synthetic_audio(size_mb, chunk_size=MB, download_mbps=None):
+    """Yields ``size_mb`` of bytes in chunks, optionally at a download-like rate."""
+    block = bytes(range(256)) * (chunk_size // 256)
+    for _ in range(size_mb * MB // chunk_size):
+        if download_mbps:
+            time.sleep(chunk_size / (download_mbps * MB))
+        yield block
+
+
+def upload(mode, size_mb, endpoint_url, bucket_name, download_mbps=None):
+    """Uploads synthetic audio with the buffered or the streaming path.
+
+    Meant to run in a fresh process per mode, since peak RSS can only grow.
+    """
+    storage = S3Storage(
+        bucket_name,
+        region_name=settings.AWS_S3_REGION_NAME,
+        endpoint_url=endpoint_url or settings.AWS_S3_ENDPOINT_URL,
+        access_key_id=settings.AWS_ACCESS_KEY_ID,
+        secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+    )
+    if storage.endpoint_url:
+        # Local S3 stand-ins start out empty
+        buckets = storage.client.list_buckets()["Buckets"]
+        if bucket_name not in {bucket["Name"] for bucket in buckets}:
+            storage.client.create_bucket(Bucket=bucket_name)
+
+    baseline_rss = peak_rss_mb()
+    started = time.monotonic()
+    chunks = synthetic_audio(size_mb, download_mbps=download_mbps)
+    if mode == "buffered":
+        buffer = BytesIO()
+        for chunk in chunks:
+            buffer.write(chunk)
+        buffer.seek(0)
+        storage.upload(buffer, "clips/benchmark-buffered.mp3")
+    else:
+        storage.stream_upload(chunks, "clips/benchmark-streaming.mp3")
+    return {
+        "mode": mode,
+        "size_mb": size_mb,
+        "seconds": round(time.monotonic() - started, 2),
+        "baseline_rss_mb": round(baseline_rss, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def synthetic_paragraphs(count, sentences_per_paragraph=4):
+    """Returns ``count`` paragraphs shaped like Deepgram's, ten seconds apart."""
+    return [
+        {
+            "start": index * 10.0,
+            "end": index * 10.0 + 9.5,
+            "speaker": index % 3,
+            "sentences": [
+                {
+                    "text": f"This is sentence {sentence} of paragraph {index}.",
+                    "start": index * 10.0 + sentence * 2,
+                    "end": index * 10.0 + sentence * 2 + 1.5,
+                }
+                for sentence in range(sentences_per_paragraph)
+            ],
+        }
+        for index in range(count)
+    ]
+
+
+def persist(mode, paragraph_count):
+    """Saves synthetic paragraphs one row at a time, with bulk_create or with COPY.
+
+    Everything happens in a transaction that is rolled back, so the database is
+    left as it was.
+    """
+    paragraphs_data = synthetic_paragraphs(paragraph_count)
+    with transaction.atomic():
+        clip = Clip.objects.create(title="benchmark")
+        started = time.monotonic()
+        paragraphs = build_paragraphs(paragraphs_data, clip)
+        if mode == "rowwise":
+            for paragraph in paragraphs:
+                # save_base() skips ClipParagraph.save(), whose page version
+                # bump would double the writes of this mode alone
+                paragraph.save_base()
+        else:
+            copy_threshold = 0 if mode == "copy" else math.inf
+            save_paragraphs(paragraphs, copy_threshold=copy_threshold)
+        seconds = time.monotonic() - started
+        transaction.set_rollback(True)
+    return {
+        "mode": mode,
+        "paragraphs": paragraph_count,
+        "seconds": round(seconds, 3),
+        "ms_per_1000": round(seconds * 1000 * 1000 / paragraph_count, 1),
+    }
+
+
+def scan_paragraphs(paragraphs_data, chapters, end):
+    """The previous chapter assignment, scanning all paragraphs per chapter."""
+    for i, chapter in enumerate(chapters):
+        next_chapter_start = end
+        if i + 1 < len(chapters):
+            next_chapter_start = chapters[i + 1]["start"]
+        chapter["paragraphs"] = [
+            p
+            for p in paragraphs_data
+            if chapter["start"] <= p["start"] < next_chapter_start
+        ]
+        chapter["chapter_transcription"] = "\n\n".join(
+            [
+                f"Speaker: {p['speaker']}\n{p['full_transcription']}"
+                for p in chapter["paragraphs"]
+            ],
+        )
+        unique_speakers = {p["speaker"] for p in chapter["paragraphs"]}
+        chapter["speakers"] = ", ".join([f"'{speaker}'" for speaker in unique_speakers])
+    return chapters
+
+
+def chapters(mode, paragraph_count, chapter_count, repeat=5):
+    """Best of ``repeat`` runs of assigning paragraphs to evenly spaced chapters."""
+    paragraphs_data = [
+        {
+            "start": paragraph["start"],
+            "speaker": paragraph["speaker"],
+            "full_transcription": " ".join(s["text"] for s in paragraph["sentences"]),
+        }
+        for paragraph in synthetic_paragraphs(paragraph_count)
+    ]
+    length = paragraph_count * 10
+    assign = scan_paragraphs if mode == "scan" else assign_paragraphs
+
+    timings = []
+    for _ in range(repeat):
+        chapter_list = [
+            {"title": f"Chapter {index}", "start": index * length // chapter_count}
+            for index in range(chapter_count)
+        ]
+        started = time.perf_counter()
+        assign(paragraphs_data, chapter_list, length)
+        timings.append(time.perf_counter() - started)
+    return {
+        "mode": mode,
+        "paragraphs": paragraph_count,
+        "chapters": chapter_count,
+        "ms": round(min(timings) * 1000, 2),
+    }
+
+
+def startup(mode):
+    """Runs the system checks, which import every view.
+
+    In ``eager`` mode the embedding model is loaded first, the way importing
+    the embeddings module used to. Meant to run in a fresh process per mode.
+    """
+    if mode == "eager":
+        preload_model()
+    call_command("check", stdout=StringIO())
+    return {"mode": mode, "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def vector_sizes():
+    """Returns the bytes of stored vectors, of sign bits and of the HNSW index."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT coalesce(sum(pg_column_size(embedding)), 0), "
+            "coalesce(sum(pg_column_size(embedding_bits)), 0), "
+            "coalesce(pg_relation_size(to_regclass(%s)), 0) "
+            "FROM clips_clipparagraph",
+            ["clipparagraph_embedding_hnsw"],
+        )
+        return cursor.fetchone()
+
+
+def search(query_count, k, ef_search_values, rerank_factors):
+    """Recall@k, latency and footprint of index and binary searches against exact.
+
+    ``memory_mb`` is what a mode reads for every query, so what must stay in
+    memory for it to be fast: every vector for exact search, the index for
+    HNSW and every paragraph's sign bits for binary search. Queries are the
+    embeddings of randomly chosen paragraphs, so this needs a database with
+    embedded paragraphs.
+    """
+    queries = list(
+        ClipParagraph.objects.filter(embedding__isnull=False)
+        .order_by("?")
+        .values_list("embedding", flat=True)[:query_count],
+    )
+    paragraphs = ClipParagraph.objects.only("id")
+    vector_bytes, bit_bytes, index_bytes = vector_sizes()
+
+    def run(search_nearest, **kwargs):
+        results, timings = [], []
+        for query in queries:
+            started = time.perf_counter()
+            found = search_nearest(paragraphs, query, k, **kwargs)
+            timings.append(time.perf_counter() - started)
+            results.append({paragraph.id for paragraph in found})
+        return results, timings
+
+    def row(mode, results, timings, expected, index_size, memory_size):  # noqa: PLR0913
+        recall = statistics.fmean(
+            len(found & truth) / len(truth) if truth else 1
+            for found, truth in zip(results, expected, strict=True)
+        )
+        return {
+            "mode": mode,
+            "queries": len(queries),
+            f"recall@{k}": round(recall, 3),
+            "p50_ms": round(percentile(timings, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(timings, 0.99) * 1000, 2),
+            "index_mb": round(index_size / 2**20, 1),
+            "memory_mb": round(memory_size / 2**20, 1),
+        }
+
+    expected, timings = run(nearest, exact=True)
+    rows = [row("exact", expected, timings, expected, 0, vector_bytes)]
+    for ef_search in ef_search_values:
+        results, timings = run(nearest, ef_search=ef_search)
+        rows.append(
+            row(
+                f"ef_search={ef_search}",
+                results,
+                timings,
+                expected,
+                index_bytes,
+                index_bytes,
+            ),
+        )
+    for rerank_factor in rerank_factors:
+        results, timings = run(nearest_binary, rerank_factor=rerank_factor)
+        rows.append(
+            row(
+                f"binary rerank={rerank_factor}x",
+                results,
+                timings,
+                expected,
+                0,
+                bit_bytes,
+            ),
+        )
+    return rows
+
+
+def fulltext(paragraph_count, query_count=20, chunk_size=100_000):
+    """Latency of full-text search computing vectors per row vs the stored column.
+
+    Loads ``paragraph_count`` paragraphs of random words in a transaction that
+    is rolled back afterwards.
+    """
+    rng = random.Random(0)
+    vocabulary = [f"term{index}" for index in range(20000)]
+
+    with transaction.atomic():
+        clip = Clip.objects.create(title="benchmark")
+        for chunk_start in range(0, paragraph_count, chunk_size):
+            copy_paragraphs(
+                ClipParagraph(
+                    clip=clip,
+                    start=index * 10.0,
+                    end=index * 10.0 + 9.5,
+                    speaker="0",
+                    full_transcription=" ".join(rng.choices(vocabulary, k=40)),
+                )
+                for index in range(
+                    chunk_start,
+                    min(chunk_start + chunk_size, paragraph_count),
+                )
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {ClipParagraph._meta.db_table}")  # noqa: SLF001
+
+        terms = rng.sample(vocabulary, query_count)
+        vectors = {
+            "inline": SearchVector("full_transcription", config="english"),
+            "stored": F("search_vector"),
+        }
+        rows = []
+        for mode, vector in vectors.items():
+            timings = []
+            for term in terms:
+                search_query = SearchQuery(term, config="english")
+                started = time.perf_counter()
+                list(
+                    ClipParagraph.objects.annotate(vector=vector)
+                    .annotate(rank=SearchRank(F("vector"), search_query))
+                    .filter(vector=search_query)
+                    .order_by("-rank")
+                    .values_list("id", flat=True)[:20],
+                )
+                timings.append(time.perf_counter() - started)
+            rows.append(
+                {
+                    "mode": mode,
+                    "paragraphs": paragraph_count,
+                    "p50_ms": round(percentile(timings, 0.5) * 1000, 1),
+                    "p99_ms": round(percentile(timings, 0.99) * 1000, 1),
+                },
+            )
+        transaction.set_rollback(True)
+    return rows
+
+
+def fetched_bytes(queryset):
+    """Bytes of column data Postgres sends back for ``queryset``."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        result = cursor.cursor.pgresult
+        return sum(
+            result.get_length(row, column)
+            for row in range(result.ntuples)
+            for column in range(result.nfields)
+        )
+
+
+def synthetic_words(count):
+    """Returns ``count`` words shaped like Deepgram's, a third of a second apart."""
+    return [
+        {
+            "word": f"word{index}",
+            "punctuated_word": f"Word{index}",
+            "start": index / 3,
+            "end": index / 3 + 0.3,
+            "confidence": 0.99,
+            "speaker": index % 3,
+            "speaker_confidence": 0.9,
+        }
+        for index in range(count)
+    ]
+
+
+def projection(clip_count, paragraphs_per_clip=100):
+    """Bytes fetched, peak Python memory and time of the views' queries.
+
+    Each view's queries run twice: loading whole rows, the way they used to,
+    and with the projections they use now. The synthetic clips are saved in a
+    transaction that is rolled back afterwards.
+    """
+    rng = random.Random(0)
+    paragraphs_data = synthetic_paragraphs(paragraphs_per_clip)
+
+    with transaction.atomic():
+        clips = Clip.objects.bulk_create(
+            Clip(
+                url=f"https://www.youtube.com/watch?v=benchmark{index}",
+                video_id=f"benchmark{index}",
+                title=f"Benchmark clip {index}",
+                channel_title="benchmark",
+                length=paragraphs_per_clip * 10,
+                summary="A short summary of the clip.",
+                full_transcription="".join(map(paragraph_text, paragraphs_data)),
+                paragraphs=paragraphs_data,
+            )
+            for index in range(clip_count)
+        )
+        for clip in clips:
+            paragraphs = build_paragraphs(paragraphs_data, clip)
+            for paragraph in paragraphs:
+                paragraph.embedding = [rng.random() for _ in range(1024)]
+            save_paragraphs(paragraphs, copy_threshold=math.inf)
+
+        clip = clips[0]
+        # One hit per clip, like a page of search results
+        hits = [
+            ClipParagraph.objects.filter(clip=hit_clip).order_by("start").first().id
+            for hit_clip in clips[:20]
+        ]
+        save_page_payload(clip.id)
+        views = {
+            "search": (
+                [ClipParagraph.objects.select_related("clip").filter(id__in=hits)],
+                [ClipParagraph.objects.for_results().filter(id__in=hits)],
+            ),
+            "clip": (
+                [
+                    Clip.objects.filter(id=clip.id),
+                    ClipParagraph.objects.filter(clip=clip).order_by("start"),
+                ],
+                [Clip.objects.for_listing("page_payload").filter(id=clip.id)],
+            ),
+            "channels": (
+                [Clip.objects.filter(channel_title="benchmark")],
+                [Clip.objects.for_listing().filter(channel_title="benchmark")],
+            ),
+        }
+
+        rows = []
+        for view, modes in views.items():
+            for mode, querysets in zip(["whole rows", "projected"], modes, strict=True):
+                fetched = sum(map(fetched_bytes, querysets))
+                started = time.perf_counter()
+                for queryset in querysets:
+                    list(queryset.all())
+                seconds = time.perf_counter() - started
+                # Measured apart from the timing, which tracing would slow down
+                tracemalloc.start()
+                for queryset in querysets:
+                    list(queryset.all())
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                rows.append(
+                    {
+                        "view": view,
+                        "mode": mode,
+                        "fetched_kb": round(fetched / 1024),
+                        "peak_python_kb": round(peak / 1024),
+                        "ms": round(seconds * 1000, 1),
+                    },
+                )
+        transaction.set_rollback(True)
+    return rows
+
+
+def words(word_count, slice_seconds=60, lookups=200):
+    """Size of a clip's word timings and latency of reading a time slice.
+
+    Compares the JSON word list, which had to be parsed whole to read any
+    part of it, with :class:`ClipWords`. Compressed sizes stand in for what
+    TOAST would store.
+    """
+    rng = random.Random(0)
+    word_list = synthetic_words(word_count)
+    encoded = json.dumps(word_list).encode()
+    packed = pack_words(word_list)
+    clip_words = ClipWords(**packed)
+    packed_bytes = b"".join(
+        packed[field] for field in ("starts", "ends", "speakers", "offsets", "tokens")
+    )
+    length = word_count / 3
+    slices = [rng.uniform(0, length - slice_seconds) for _ in range(lookups)]
+
+    def json_slice(start):
+        return [
+            word
+            for word in json.loads(encoded)
+            if start <= word["start"] < start + slice_seconds
+        ]
+
+    def packed_slice(start):
+        return clip_words.between(start, start + slice_seconds)
+
+    rows = []
+    for mode, data, read in [
+        ("json", encoded, json_slice),
+        ("packed", packed_bytes, packed_slice),
+    ]:
+        timings = []
+        for start in slices:
+            started = time.perf_counter()
+            read(start)
+            timings.append(time.perf_counter() - started)
+        rows.append(
+            {
+                "mode": mode,
+                "words": word_count,
+                "kb": round(len(data) / 1024),
+                "compressed_kb": round(len(gzip.compress(data)) / 1024),
+                "slice_p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+                "slice_p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+            },
+        )
+    return rows
+
+
+def channels(clip_count, per_page=24, repeat=5):
+    """Latency of a channel's first and last page, by offset vs by cursor.
+
+    Best of ``repeat`` runs each. The channel's clips are saved in a
+    transaction that is rolled back afterwards.
+    """
+    with transaction.atomic():
+        channel = Channel.objects.create(title="benchmark")
+        now = timezone.now()
+        Clip.objects.bulk_create(
+            (
+                Clip(
+                    url=f"https://www.youtube.com/watch?v=benchmark{index}",
+                    video_id=f"benchmark{index}",
+                    title=f"Benchmark clip {index}",
+                    channel=channel,
+                    length=600,
+                    published_at=now - timedelta(hours=index),
+                )
+                for index in range(clip_count)
+            ),
+            batch_size=BULK_BATCH_SIZE,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Clip._meta.db_table}")  # noqa: SLF001
+
+        clips = (
+            Clip.objects.for_listing()
+            .filter(channel=channel)
+            .order_by("-published_at", "-id")
+        )
+        last_page = (clip_count - 1) // per_page
+
+        # Walk the pages once to find the cursor of the last one
+        cursors = [None]
+        while True:
+            _, cursor = channel.clips_page(after=cursors[-1], per_page=per_page)
+            if cursor is None:
+                break
+            cursors.append(cursor)
+
+        pages = {
+            "offset": lambda page: list(
+                clips[page * per_page : (page + 1) * per_page],
+            ),
+            "keyset": lambda page: channel.clips_page(
+                after=cursors[page],
+                per_page=per_page,
+            ),
+        }
+        rows = []
+        for mode, fetch in pages.items():
+            row = {"mode": mode, "clips": clip_count}
+            for name, page in (("first_page_ms", 0), ("last_page_ms", last_page)):
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    fetch(page)
+                    timings.append(time.perf_counter() - started)
+                row[name] = round(min(timings) * 1000, 2)
+            rows.append(row)
+        transaction.set_rollback(True)
+    return rows
@@ -0,0 +1,156 @@
+"""An embedding model shared by every process on a host.
+
+``manage.py embedding_server`` loads the model once and serves it over
+localhost HTTP. Requests that arrive within a few milliseconds of each other
+are encoded as one batch by a :class:`MicroBatcher`. Web workers and commands
+reach it through an :class:`EmbeddingClient`, which falls back to encoding in
+process when the server cannot be reached.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import urljoin
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS_HEADER = "X-Embedding-Dimensions"
+
+
+class MicroBatcher:
+    """Merges concurrent :meth:`submit` calls into batches for one encoder thread.
+
+    A batch is encoded once it holds ``max_batch_size`` texts or ``max_wait``
+    seconds after its first request arrived, whichever comes first.
+    """
+
+    def __init__(self, encode, max_batch_size=64, max_wait=0.005):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.stats = {"requests": 0, "batches": 0, "texts": 0}
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, texts):
+        """Returns a future for the vectors of ``texts``."""
+        future = Future()
+        self.requests.put((list(texts), future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                vectors = self.encode(texts)
+            except Exception as e:
+                logger.exception("Exception: encoding a batch of %d texts.", len(texts))
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["texts"] += len(texts)
+            offset = 0
+            for request_texts, future in batch:
+                future.set_result(vectors[offset : offset + len(request_texts)])
+                offset += len(request_texts)
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):  # noqa: N802
+        if self.path != "/encode":
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        length = int(self.headers["Content-Length"])
+        texts = json.loads(self.rfile.read(length))["texts"]
+        if texts:
+            vectors = self.server.batcher.submit(texts).result()
+            vectors = np.asarray(vectors, dtype=np.float32)
+        else:
+            vectors = np.empty((0, 0), dtype=np.float32)
+
+        # Raw float32 is a fraction of the size of JSON and needs no parsing
+        body = vectors.tobytes()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header(DIMENSIONS_HEADER, str(vectors.shape[1]))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # noqa: N802
+        if self.path != "/health":
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        body = json.dumps(self.server.batcher.stats).encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002
+        logger.debug(format, *args)
+
+
+class EmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, batcher):
+        super().__init__(address, EmbeddingRequestHandler)
+        self.batcher = batcher
+
+
+class EmbeddingClient:
+    """Encodes texts on an embedding server, or with ``fallback`` if it is down."""
+
+    def __init__(self, url, timeout, fallback):
+        self.url = url
+        self.timeout = timeout
+        self.fallback = fallback
+
+    def encode(self, texts):
+        texts = list(texts)
+        request = urllib.request.Request(  # noqa: S310
+            urljoin(self.url, "/encode"),
+            data=json.dumps({"texts": texts}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:  # noqa: S310
+                dimensions = int(response.headers[DIMENSIONS_HEADER])
+                body = response.read()
+        # URLError and socket timeouts are both OSErrors
+        except (OSError, ValueError) as e:
+            logger.warning("Embedding server unavailable (%s), encoding in process", e)
+            return self.fallback(texts)
+        return np.frombuffer(body, dtype=np.float32).reshape(len(texts), dimensions)
@@ -1,71 +1,240 @@
+import functools
 import logging
+import threading
 
 from django.conf import settings
-from openai import OpenAI
-from pgvector.django import L2Distance
-from sentence_transformers import SentenceTransformer
+from django.db import connection
+from django.db import transaction
+from django.db.models import Func
+from django.db.models import IntegerField
+from django.db.models import Value
+from django.db.models.functions import Cast
+from pgvector.django import CosineDistance
 
-model = SentenceTransformer("BAAI/bge-large-en-v1.5")
+from .embedding_service import EmbeddingClient
+from .llm import complete
+from .models import BitStringField
+from .models import ClipParagraph
+from .models import binary_quantize
+from .persistence import BULK_BATCH_SIZE
+from .query_cache import QueryEmbeddingCache
+
+EMBEDDING_BATCH_SIZE = 64
 
 logger = logging.getLogger(__name__)
 
+_model_lock = threading.Lock()
 
-def embed_transcriptions(queryset):
-    for clip_paragraph in queryset:
-        # using full_transcription directly:
-        embedding = model.encode(
-            clip_paragraph.full_transcription,
-            convert_to_tensor=False,
-        )
-        clip_paragraph.embedding = embedding
-        clip_paragraph.save()
 
+def get_model():
+    """Returns the embedding model, loading it on first use.
 
-def search_embeddings(query, transcription, top_n=5):
-    query_embedding = model.encode(query, convert_to_tensor=False)
+    The model takes over a gigabyte of memory, so it is not loaded when this
+    module is imported. Processes that embed text can load it upfront with
+    :func:`preload_model`.
+    """
+    # functools.cache alone would let threads that arrive together each load it
+    with _model_lock:
+        return _load_model()
 
-    return transcription.objects.order_by(
-        L2Distance("embedding", query_embedding),
-    )[:top_n]
 
+@functools.cache
+def _load_model():
+    # Importing sentence_transformers imports torch, which is slow too
+    from sentence_transformers import SentenceTransformer
 
-def generate_summary_with_prompt(aggregated_text, speakers, topic):
-    try:
-        client = OpenAI(
-            # This is the default and can be omitted
-            api_key=settings.OPENAI_API_KEY,
-        )
+    logger.info("Loading %s", settings.CLIPS_EMBEDDING_MODEL)
+    return SentenceTransformer(settings.CLIPS_EMBEDDING_MODEL)
 
-        custom_prompt = (
-            f"I have a podcast transcript with speakers {speakers} discussing {topic}. "
-            "Each offers unique perspectives.\n\n"
-            "I need a summary of their views on {topic}, clearly differentiating speakers. "
-            "Format the response as:\n\n"
-            "**On Topic: {topic}:**\n"
-            "  - **Speaker 1 ([Name]):** [Summary of views on Topic]\n"
-            "  - **Speaker 2 ([Name]):** [Summary of views on Topic]\n"
-            "  - [Continue for each speaker]\n\n"
-            "Summaries should be neutral, highlighting differences in opinions. "
-            "Include any direct responses or contradictions.\n\n"
-            "The full topic transcription is below:\n\n"
-        )
 
-        # Combine the prompt with the aggregated text
-        prompt_text = f"{custom_prompt} {aggregated_text}"
+def preload_model():
+    get_model()
 
-        chat_completion = client.chat.completions.create(
-            model="gpt-3.5-turbo-0125",
-            messages=[
-                {"role": "user", "content": prompt_text},
-            ],
-        )
 
-        return {
-            "summary": chat_completion.choices[0].message.content,
-            "prompt": prompt_text,
-        }
-    except Exception as e:
-        logging.exception(
-            "Exception: generating summary: Generating summary with prompt",
+def encode_locally(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    # Unit vectors, so cosine distance and inner product rank the same way
+    return get_model().encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    )
+
+
+@functools.cache
+def get_client():
+    return EmbeddingClient(
+        settings.CLIPS_EMBEDDING_SERVER_URL,
+        settings.CLIPS_EMBEDDING_SERVER_TIMEOUT,
+        fallback=encode_locally,
+    )
+
+
+def encode(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    """Returns a vector per text, from the embedding server if one is configured.
+
+    Without ``CLIPS_EMBEDDING_SERVER_URL``, or when the server does not answer,
+    the model is loaded and run in this process.
+    """
+    if settings.CLIPS_EMBEDDING_SERVER_URL:
+        return get_client().encode(texts)
+    return encode_locally(texts, batch_size=batch_size)
+
+
+def encode_batched(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    """Encodes ``texts`` in batches of similar length and returns their vectors.
+
+    Sorting by length first means each batch is padded to about the length of
+    its own texts rather than to the longest text overall.
+    """
+    order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+    embeddings = [None] * len(texts)
+    for batch_start in range(0, len(order), batch_size):
+        batch = order[batch_start : batch_start + batch_size]
+        vectors = encode([texts[index] for index in batch], batch_size=batch_size)
+        for index, vector in zip(batch, vectors, strict=True):
+            embeddings[index] = vector
+    return embeddings
+
+
+def embed_transcriptions(queryset, batch_size=EMBEDDING_BATCH_SIZE):
+    """Embeds the paragraphs' transcriptions and saves them with one bulk update."""
+    paragraphs = list(queryset)
+    embeddings = encode_batched(
+        [paragraph.full_transcription for paragraph in paragraphs],
+        batch_size=batch_size,
+    )
+    for paragraph, embedding in zip(paragraphs, embeddings, strict=True):
+        paragraph.embedding = embedding
+    ClipParagraph.objects.bulk_update(
+        paragraphs,
+        ["embedding"],
+        batch_size=BULK_BATCH_SIZE,
+    )
+    return len(paragraphs)
+
+
+@functools.cache
+def get_query_cache():
+    return QueryEmbeddingCache(
+        encode,
+        settings.CLIPS_EMBEDDING_MODEL,
+        max_entries=settings.CLIPS_QUERY_EMBEDDING_CACHE_SIZE,
+        timeout=settings.CLIPS_QUERY_EMBEDDING_CACHE_TTL,
+    )
+
+
+def nearest(queryset, embedding, top_n, ef_search=None, *, exact=False):
+    """Returns the ``top_n`` rows of ``queryset`` closest to ``embedding``.
+
+    Searches the HNSW index, or the IVFFlat one ``manage.py vector_index``
+    can add, if the planner prefers it. A higher ``ef_search`` finds more of the
+    true nearest neighbours at the cost of latency; it is raised to ``top_n``
+    when lower, since an HNSW scan returns at most ``ef_search`` rows.
+    ``exact`` scans every row instead, which is what the index is measured
+    against.
+    """
+    ef_search = max(ef_search or settings.CLIPS_HNSW_EF_SEARCH, top_n)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if exact:
+            cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+        else:
+            # set_config(..., true) is SET LOCAL, which cannot take parameters
+            cursor.execute(
+                "SELECT set_config('hnsw.ef_search', %s, true), "
+                "set_config('ivfflat.probes', %s, true)",
+                [
+                    str(ef_search),
+                    str(settings.CLIPS_IVFFLAT_PROBES),
+                ],
+            )
+        return list(
+            queryset.order_by(CosineDistance("embedding", embedding))[:top_n],
         )
-        return e
+
+
+class HammingDistance(Func):
+    """The number of bits that differ between two bit strings of equal length."""
+
+    template = "bit_count(%(expressions)s)"
+    arg_joiner = " # "
+    output_field = IntegerField()
+
+
+def nearest_binary(queryset, embedding, top_n, rerank_factor=None):
+    """Returns the ``top_n`` rows of ``queryset`` closest to ``embedding``.
+
+    Ranks every row by the Hamming distance between its ``embedding_bits`` and
+    the query's sign bits, which reads 128 bytes a row rather than a 4 KB
+    vector and needs no index in memory. The best
+    ``top_n * rerank_factor`` are then re-ranked exactly by cosine distance
+    on their full vectors.
+
+    The first pass is a sequential scan, so unlike the HNSW search its cost
+    grows with the table. It needs far less memory, but is no faster until
+    the bits get an index of their own: HNSW with ``bit_hamming_ops`` needs
+    pgvector 0.7 on the server and a pgvector-python release newer than the
+    pinned 0.2.5.
+    """
+    rerank_factor = rerank_factor or settings.CLIPS_BINARY_RERANK_FACTOR
+    query_bits = Cast(
+        Value(binary_quantize(embedding)),
+        BitStringField(length=len(embedding)),
+    )
+    candidate_ids = list(
+        queryset.filter(embedding_bits__isnull=False)
+        .order_by(HammingDistance("embedding_bits", query_bits))
+        .values_list("id", flat=True)[: top_n * rerank_factor],
+    )
+    return nearest(
+        queryset.filter(id__in=candidate_ids),
+        embedding,
+        top_n,
+        exact=True,
+    )
+
+
+def search_vectors(queryset, embedding, top_n, ef_search=None):
+    """Searches the way ``CLIPS_VECTOR_SEARCH`` says, the vector index or sign bits."""
+    if settings.CLIPS_VECTOR_SEARCH == "binary":
+        return nearest_binary(queryset, embedding, top_n)
+    return nearest(queryset, embedding, top_n, ef_search=ef_search)
+
+
+def search_embeddings(query, transcription, top_n=5, ef_search=None):
+    query_embedding = get_query_cache().get(query)
+    return search_vectors(
+        # The results page shows each hit's whole clip transcription
+        transcription.objects.for_results("clip__full_transcription"),
+        query_embedding,
+        top_n,
+        ef_search=ef_search,
+    )
+
+
+def build_summary_prompt(aggregated_text, speakers, topic):
+    custom_prompt = (
+        f"I have a podcast transcript with speakers {speakers} discussing {topic}. "
+        "Each offers unique perspectives.\n\n"
+        "I need a summary of their views on {topic}, clearly differentiating speakers. "
+        "Format the response as:\n\n"
+        "**On Topic: {topic}:**\n"
+        "  - **Speaker 1 ([Name]):** [Summary of views on Topic]\n"
+        "  - **Speaker 2 ([Name]):** [Summary of views on Topic]\n"
+        "  - [Continue for each speaker]\n\n"
+        "Summaries should be neutral, highlighting differences in opinions. "
+        "Include any direct responses or contradictions.\n\n"
+        "The full topic transcription is below:\n\n"
+    )
+
+    # Combine the prompt with the aggregated text
+    return f"{custom_prompt} {aggregated_text}"
+
+
+def generate_summary_with_prompt(aggregated_text, speakers, topic):
+    """Summarizes a chapter, raising :class:`openai.OpenAIError` on failure."""
+    prompt_text = build_summary_prompt(aggregated_text, speakers, topic)
+    return {
+        "summary": complete(prompt_text),
+        "prompt": prompt_text,
+    }
@@ -0,0 +1,361 @@
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import DatabaseError
+from django.db import IntegrityError
+from django.db import connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .embeddings import build_summary_prompt
+from .embeddings import generate_summary_with_prompt
+from .models import Channel
+from .models import Chapter
+from .models import Clip
+from .models import ClipParagraph
+from .models import ClipWords
+from .models import IngestJob
+from .models import TranscriptArchive
+from .persistence import kept_paragraph_fields
+from .persistence import save_page_payload
+from .utils import DEEPGRAM_OPTIONS
+from .utils import download_audio
+from .utils import extract_chapters
+from .utils import extract_paragraphs
+from .utils import extract_youtube_video_id
+from .utils import transcribe_audio
+from .youtube import VideoUnavailableError
+from .youtube import get_video_metadata
+
+TWO_HOURS = 2 * 60 * 60
+MAX_ATTEMPTS = 3
+# Wait before retrying a failed attempt, doubled for each attempt made
+RETRY_BACKOFF = timedelta(minutes=1)
+# A worker touches its running job this often, however long a stage takes.
+# A running job that has not been touched for STALE_JOB_TIMEOUT is assumed to
+# belong to a worker that died, and is handed out again.
+HEARTBEAT_INTERVAL = timedelta(minutes=1)
+STALE_JOB_TIMEOUT = timedelta(minutes=10)
+
+logger = logging.getLogger(__name__)
+
+
+class IngestError(Exception):
+    """Raised when a video cannot be ingested, with a message fit for users."""
+
+
+def fetch_video(video_url):
+    try:
+        metadata = get_video_metadata(extract_youtube_video_id(video_url))
+    except VideoUnavailableError as e:
+        raise IngestError(str(e)) from e
+    if metadata.length > TWO_HOURS:
+        msg = "Youtube Video is greater than 2 hours. Please use a shorter video."
+        raise IngestError(msg)
+    return metadata
+
+
+def get_or_create_clip(metadata, video_url):
+    channel = None
+    if metadata.channel_title:
+        channel, _ = Channel.objects.get_or_create(title=metadata.channel_title)
+    # Leave out the transcription of a clip that already exists
+    clip, created = Clip.objects.light().get_or_create(
+        video_id=metadata.video_id,
+        defaults={
+            "url": video_url,
+            "title": metadata.title,
+            "length": metadata.length,
+            "channel_title": metadata.channel_title,
+            "channel": channel,
+            "description": metadata.description,
+            "published_at": metadata.publish_date,
+        },
+    )
+    return clip, created
+
+
+def is_ingested(clip):
+    # Ask the database rather than loading the paragraphs to test them
+    return Clip.objects.ingested().filter(pk=clip.pk).exists()
+
+
+def save_transcription(clip, data, on_stage=None, summarize=None):
+    """Stores a Deepgram response on the clip and derives paragraphs and chapters."""
+    on_stage = on_stage or (lambda stage: None)
+
+    deepgram_object = data["results"]["channels"][0]["alternatives"][0]
+    paragraphs_data = deepgram_object["paragraphs"]["paragraphs"]
+
+    on_stage(IngestJob.Stage.PARAGRAPHS)
+    with transaction.atomic():
+        # A retried job may have saved part of its output before failing, and
+        # a reprocessed clip has speaker renames and embeddings worth keeping
+        kept = kept_paragraph_fields(clip)
+        ClipParagraph.objects.filter(clip=clip).delete()
+        Chapter.objects.filter(clip=clip).delete()
+
+        clip.full_transcription = deepgram_object["paragraphs"]["transcript"]
+        clip.summary = data["results"]["summary"]["short"]
+        clip.paragraphs = paragraphs_data
+        clip.save()
+        ClipWords.store(clip, deepgram_object["words"])
+
+        # Save Paragraphs in ClipParagraph model
+        extracted_paragraphs = extract_paragraphs(paragraphs_data, clip, kept)
+        save_page_payload(clip.id)
+
+    # Save Chapters in Chapters model
+    on_stage(IngestJob.Stage.CHAPTERS)
+    extract_chapters(
+        extracted_paragraphs,
+        clip,
+        summarize=summarize or generate_summary_with_prompt,
+    )
+
+
+def upload_clip_audio(clip, metadata, audio=None):
+    """Downloads the audio, uploads it to S3 and returns the object name."""
+    video_details = download_audio(metadata, audio)
+    clip.storage_path = video_details["storage_path"]
+    clip.save(update_fields=["storage_path", "updated_at"])
+    return video_details["object_name"]
+
+
+def transcribe_clip_audio(video_id, object_name):
+    """Returns the Deepgram response for the audio, transcribing it at most once."""
+    archive = TranscriptArchive.objects.filter(
+        video_id=video_id,
+        options_key=TranscriptArchive.options_key_for(DEEPGRAM_OPTIONS),
+    ).first()
+    if archive is not None:
+        return archive.load()
+
+    transcribed_audio = transcribe_audio(object_name)
+    if transcribed_audio is None:
+        msg = "The audio could not be transcribed."
+        raise IngestError(msg)
+
+    response_json = transcribed_audio.to_json()
+    TranscriptArchive.store(video_id, DEEPGRAM_OPTIONS, response_json)
+    return json.loads(response_json)
+
+
+def ingest_video(video_url, on_stage=None, on_clip=None):
+    """Runs the whole pipeline for one video and returns its clip.
+
+    ``on_stage`` is called with each :class:`IngestJob.Stage` as it starts and
+    ``on_clip`` with the clip once it exists, so callers can report progress.
+    """
+    on_stage = on_stage or (lambda stage: None)
+
+    on_stage(IngestJob.Stage.METADATA)
+    metadata = fetch_video(video_url)
+    clip, created = get_or_create_clip(metadata, video_url)
+    if on_clip:
+        on_clip(clip)
+    if not created and is_ingested(clip):
+        return clip
+
+    # Download & Upload Audio to S3
+    on_stage(IngestJob.Stage.DOWNLOAD)
+    object_name = upload_clip_audio(clip, metadata)
+
+    # Transcribe audio file from S3
+    on_stage(IngestJob.Stage.TRANSCRIBE)
+    data = transcribe_clip_audio(clip.video_id, object_name)
+
+    save_transcription(clip, data, on_stage)
+    return clip
+
+
+def reuse_summaries(chapters):
+    """Returns a summarizer that only reuses the summaries of ``chapters``.
+
+    A summary is reused when its chapter's title and transcript are unchanged;
+    renamed speakers do not make it stale. Other chapters get no summary, and
+    an error saying so.
+    """
+    summaries = {
+        (chapter.chapter_transcription, chapter.title): chapter
+        for chapter in chapters
+        if chapter.summary
+    }
+
+    def summarize(aggregated_text, speakers, topic):
+        chapter = summaries.get((aggregated_text, topic))
+        if chapter is not None:
+            return {"summary": chapter.summary, "prompt": chapter.prompt}
+        logger.warning("No summary to reuse for chapter %r, leaving it empty", topic)
+        return {
+            "summary": "",
+            "prompt": build_summary_prompt(aggregated_text, speakers, topic),
+            "error": "The chapter changed when the clip was reprocessed; "
+            "reprocess it with --summarize-missing to summarize it again.",
+        }
+
+    return summarize
+
+
+def reprocess_clip(clip_id, *, summarize_missing=False):
+    """Rebuilds a clip's derived rows from its archived transcript.
+
+    Paragraphs that come out unchanged keep their speaker names and
+    embeddings. Makes no external calls unless ``summarize_missing`` is set,
+    in which case chapters whose summary cannot be reused are summarized
+    again; otherwise they are saved with a ``summary_error``. Returns whether
+    an archive was found.
+    """
+    # save_transcription() replaces every heavy field without reading it
+    clip = Clip.objects.light().get(id=clip_id)
+    archive = (
+        TranscriptArchive.objects.filter(video_id=clip.video_id)
+        .order_by("-created_at")
+        .first()
+    )
+    if archive is None:
+        return False
+
+    reuse = reuse_summaries(Chapter.objects.filter(clip=clip))
+    summarize = reuse
+    if summarize_missing:
+
+        def summarize(aggregated_text, speakers, topic):
+            reused = reuse(aggregated_text, speakers, topic)
+            if reused["summary"]:
+                return reused
+            return generate_summary_with_prompt(aggregated_text, speakers, topic)
+
+    save_transcription(clip, archive.load(), summarize=summarize)
+    return True
+
+
+def enqueue(video_url):
+    """Returns the active job for the video, queueing a new one if there is none."""
+    video_id = extract_youtube_video_id(video_url)
+    active = IngestJob.objects.filter(
+        video_id=video_id,
+        status__in=IngestJob.ACTIVE_STATUSES,
+    )
+    job = active.order_by("-created_at").first()
+    if job is not None:
+        return job
+    try:
+        with transaction.atomic():
+            return IngestJob.objects.create(video_url=video_url, video_id=video_id)
+    except IntegrityError:
+        # Another request queued the video between the check and the insert
+        return active.get()
+
+
+def claim_next_job():
+    """Locks the oldest runnable job and marks it as running.
+
+    ``SKIP LOCKED`` lets any number of workers poll the table at once without
+    blocking on, or double-claiming, a job another worker is taking.
+    """
+    now = timezone.now()
+    stale = Q(
+        status=IngestJob.Status.RUNNING,
+        updated_at__lt=now - STALE_JOB_TIMEOUT,
+    )
+    with transaction.atomic():
+        # A job whose worker died on every attempt, say killed for running
+        # out of memory, would otherwise be handed out forever
+        IngestJob.objects.filter(stale, attempts__gte=MAX_ATTEMPTS).update(
+            status=IngestJob.Status.FAILED,
+            error="The worker stopped responding on every attempt.",
+            finished_at=now,
+        )
+        job = (
+            IngestJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                (
+                    Q(status=IngestJob.Status.PENDING)
+                    & (Q(run_after__isnull=True) | Q(run_after__lte=now))
+                )
+                | stale,
+            )
+            .order_by("created_at")
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = IngestJob.Status.RUNNING
+        job.attempts += 1
+        job.started_at = timezone.now()
+        job.save(update_fields=["status", "attempts", "started_at", "updated_at"])
+    return job
+
+
+@contextmanager
+def heartbeat(job, interval=HEARTBEAT_INTERVAL):
+    """Touches the job's ``updated_at`` every ``interval`` until the block exits.
+
+    Downloading or transcribing a long video can take longer than
+    ``STALE_JOB_TIMEOUT`` within one stage, and the job must not look
+    abandoned meanwhile.
+    """
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(interval.total_seconds()):
+                try:
+                    IngestJob.objects.filter(
+                        id=job.id,
+                        status=IngestJob.Status.RUNNING,
+                    ).update(updated_at=timezone.now())
+                except DatabaseError:
+                    logger.warning("Could not record a heartbeat for job %s", job.id)
+        finally:
+            # The thread has its own database connection
+            connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_job(job):
+    def on_stage(stage):
+        job.stage = stage
+        job.save(update_fields=["stage", "updated_at"])
+
+    def on_clip(clip):
+        job.clip = clip
+        job.save(update_fields=["clip", "updated_at"])
+
+    try:
+        with heartbeat(job):
+            ingest_video(job.video_url, on_stage=on_stage, on_clip=on_clip)
+    except IngestError as e:
+        job.status = IngestJob.Status.FAILED
+        job.error = str(e)
+    except Exception as e:
+        logger.exception("Exception: ingest job %s: processing the clip.", job.id)
+        job.error = f"An error occurred: {e}"
+        if job.attempts < MAX_ATTEMPTS:
+            job.status = IngestJob.Status.PENDING
+            job.stage = IngestJob.Stage.QUEUED
+            job.run_after = timezone.now() + RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        else:
+            job.status = IngestJob.Status.FAILED
+    else:
+        job.status = IngestJob.Status.SUCCEEDED
+        job.stage = IngestJob.Stage.DONE
+        job.error = ""
+
+    if job.status != IngestJob.Status.PENDING:
+        job.finished_at = timezone.now()
+    job.save()
+    return job
@@ -0,0 +1,162 @@
+"""The OpenAI client shared by every thread in the process.
+
+Requests go through one client, so HTTPS connections are reused, and through
+one :class:`RateLimiter`, so concurrent callers stay under the account's
+request and token limits together. Transient failures are retried here with
+jittered exponential backoff.
+"""
+
+import functools
+import logging
+import random
+import threading
+import time
+
+import openai
+from django.conf import settings
+
+from .models import SummaryCache
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MODEL = "gpt-3.5-turbo-0125"
+# Room left in the token budget for the completion, which is not known upfront
+COMPLETION_TOKENS = 500
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, safe to share by threads."""
+
+    def __init__(
+        self,
+        requests_per_minute,
+        tokens_per_minute,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.capacity = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.available = dict(self.capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        elapsed = now - self.updated
+        self.updated = now
+        for name, capacity in self.capacity.items():
+            self.available[name] = min(
+                capacity,
+                self.available[name] + elapsed * capacity / 60,
+            )
+
+    def acquire(self, tokens=0):
+        """Blocks until one more request of ``tokens`` tokens fits in the limits."""
+        # A request bigger than the whole budget would otherwise wait forever
+        needed = {"requests": 1, "tokens": min(tokens, self.capacity["tokens"])}
+        while True:
+            with self.lock:
+                self._refill()
+                missing = {name: needed[name] - self.available[name] for name in needed}
+                if all(amount <= 0 for amount in missing.values()):
+                    for name in needed:
+                        self.available[name] -= needed[name]
+                    return
+                wait = max(
+                    missing[name] * 60 / self.capacity[name]
+                    for name in needed
+                    if missing[name] > 0
+                )
+            self.sleep(wait)
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4
+
+
+def backoff(attempt):
+    """Full jitter: a random wait of up to ``BACKOFF_BASE * 2 ** attempt``."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))  # noqa: S311
+
+
+@functools.cache
+def get_client():
+    return openai.OpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        timeout=settings.OPENAI_TIMEOUT,
+        # Retries happen in complete(), behind the rate limiter
+        max_retries=0,
+    )
+
+
+@functools.cache
+def get_rate_limiter():
+    return RateLimiter(
+        settings.OPENAI_REQUESTS_PER_MINUTE,
+        settings.OPENAI_TOKENS_PER_MINUTE,
+    )
+
+
+def request_completion(prompt, model=SUMMARY_MODEL):
+    """Asks the model, retrying transient failures.
+
+    Raises the last :class:`openai.OpenAIError` once ``OPENAI_MAX_RETRIES``
+    retries have failed, or straight away for errors that retrying cannot fix.
+    """
+    client = get_client()
+    rate_limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        rate_limiter.acquire(estimate_tokens(prompt) + COMPLETION_TOKENS)
+        try:
+            chat_completion = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+            )
+        except RETRYABLE_ERRORS as e:
+            if attempt >= settings.OPENAI_MAX_RETRIES:
+                raise
+            delay = backoff(attempt)
+            logger.warning(
+                "OpenAI request failed (%s), retrying in %.1fs",
+                e.__class__.__name__,
+                delay,
+            )
+            time.sleep(delay)
+            attempt += 1
+        else:
+            return chat_completion.choices[0].message.content
+
+
+def complete(prompt, model=SUMMARY_MODEL, *, use_cache=True):
+    """Returns the model's reply to ``prompt``.
+
+    Replies are kept in :class:`SummaryCache`, so a prompt the same model has
+    already answered costs a database lookup instead of a request.
+    """
+    if use_cache:
+        cached = SummaryCache.lookup(model, prompt)
+        if cached is not None:
+            logger.debug("Summary cache hit for %s", model)
+            return cached
+
+    started = time.monotonic()
+    reply = request_completion(prompt, model)
+    if use_cache:
+        SummaryCache.store(
+            model,
+            prompt,
+            reply,
+            tokens=estimate_tokens(prompt) + estimate_tokens(reply or ""),
+            latency=time.monotonic() - started,
+        )
+    return reply
@@ -0,0 +1,228 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from word_steno.clips import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Benchmark clip pipeline components against synthetic data"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+        upload = subparsers.add_parser(
+            "upload",
+            help="Peak RSS and wall time of buffered vs streaming S3 uploads",
+        )
+        upload.add_argument("--size-mb", type=int, default=256)
+        upload.add_argument(
+            "--endpoint-url",
+            help="A local S3 stand-in, e.g. http://localhost:9000 for MinIO",
+        )
+        upload.add_argument("--bucket", default=settings.AWS_STORAGE_BUCKET_NAME)
+        upload.add_argument(
+            "--download-mbps",
+            type=float,
+            help="Throttle the synthetic download to this many MB/s",
+        )
+        # Set when the benchmark re-runs itself to measure one mode per process
+        upload.add_argument(
+            "--mode",
+            choices=["buffered", "streaming"],
+            help=argparse.SUPPRESS,
+        )
+
+        persist = subparsers.add_parser(
+            "persist",
+            help="Time to save paragraphs row by row, with bulk_create and with COPY",
+        )
+        persist.add_argument("--paragraphs", type=int, default=5000)
+
+        chapters = subparsers.add_parser(
+            "chapters",
+            help="Assigning paragraphs to chapters by scanning vs by bisection",
+        )
+        chapters.add_argument("--paragraphs", type=int, default=5000)
+        chapters.add_argument("--chapters", type=int, default=200)
+
+        startup = subparsers.add_parser(
+            "startup",
+            help="Wall time and peak RSS of manage.py check, lazy vs eager model",
+        )
+        startup.add_argument(
+            "--mode",
+            choices=["eager", "lazy"],
+            help=argparse.SUPPRESS,
+        )
+
+        search = subparsers.add_parser(
+            "search",
+            help="Recall@k, latency and size of index and binary vs exact search",
+        )
+        search.add_argument("--queries", type=int, default=100)
+        search.add_argument("-k", type=int, default=10)
+        search.add_argument(
+            "--ef-search",
+            type=int,
+            nargs="+",
+            default=[20, 40, 100, 200],
+        )
+        search.add_argument(
+            "--rerank-factor",
+            type=int,
+            nargs="+",
+            default=[4, 10, 40],
+        )
+
+        fulltext = subparsers.add_parser(
+            "fulltext",
+            help="Full-text search latency, per-row vectors vs the stored column",
+        )
+        fulltext.add_argument("--paragraphs", type=int, default=1_000_000)
+        fulltext.add_argument("--queries", type=int, default=20)
+
+        projection = subparsers.add_parser(
+            "projection",
+            help="Bytes fetched and peak memory of the views' queries, whole vs lean",
+        )
+        projection.add_argument("--clips", type=int, default=20)
+        projection.add_argument("--paragraphs", type=int, default=100)
+
+        channels = subparsers.add_parser(
+            "channels",
+            help="First and last page latency of a channel, offset vs keyset",
+        )
+        channels.add_argument("--clips", type=int, default=10000)
+        channels.add_argument("--per-page", type=int, default=24)
+
+        words = subparsers.add_parser(
+            "words",
+            help="Size and time-slice latency of word timings, JSON vs packed",
+        )
+        words.add_argument("--words", type=int, default=20000)
+        words.add_argument("--slice-seconds", type=float, default=60)
+
+    def handle(self, *args, **options):
+        getattr(self, f"benchmark_{options['benchmark']}")(options)
+
+    def benchmark_upload(self, options):
+        if options["mode"]:
+            result = benchmarks.upload(
+                options["mode"],
+                options["size_mb"],
+                options["endpoint_url"],
+                options["bucket"],
+                options["download_mbps"],
+            )
+            self.stdout.write(json.dumps(result))
+            return
+
+        argv = ["upload", "--size-mb", str(options["size_mb"])]
+        argv += ["--bucket", options["bucket"]]
+        if options["endpoint_url"]:
+            argv += ["--endpoint-url", options["endpoint_url"]]
+        if options["download_mbps"]:
+            argv += ["--download-mbps", str(options["download_mbps"])]
+        self.write_table(
+            [
+                self.run_in_subprocess([*argv, "--mode", mode])
+                for mode in ("buffered", "streaming")
+            ],
+        )
+
+    def benchmark_persist(self, options):
+        self.write_table(
+            [
+                benchmarks.persist(mode, options["paragraphs"])
+                for mode in ("rowwise", "bulk", "copy")
+            ],
+        )
+
+    def benchmark_chapters(self, options):
+        self.write_table(
+            [
+                benchmarks.chapters(mode, options["paragraphs"], options["chapters"])
+                for mode in ("scan", "bisect")
+            ],
+        )
+
+    def benchmark_startup(self, options):
+        if options["mode"]:
+            self.stdout.write(json.dumps(benchmarks.startup(options["mode"])))
+            return
+
+        rows = []
+        for mode in ("eager", "lazy"):
+            started = time.monotonic()
+            result = self.run_in_subprocess(["startup", "--mode", mode])
+            rows.append(
+                {
+                    "mode": mode,
+                    "seconds": round(time.monotonic() - started, 2),
+                    "peak_rss_mb": result["peak_rss_mb"],
+                },
+            )
+        self.write_table(rows)
+
+    def benchmark_search(self, options):
+        self.write_table(
+            benchmarks.search(
+                options["queries"],
+                options["k"],
+                options["ef_search"],
+                options["rerank_factor"],
+            ),
+        )
+
+    def benchmark_fulltext(self, options):
+        self.write_table(
+            benchmarks.fulltext(options["paragraphs"], options["queries"]),
+        )
+
+    def benchmark_projection(self, options):
+        self.write_table(
+            benchmarks.projection(options["clips"], options["paragraphs"]),
+        )
+
+    def benchmark_channels(self, options):
+        self.write_table(
+            benchmarks.channels(options["clips"], options["per_page"]),
+        )
+
+    def benchmark_words(self, options):
+        self.write_table(
+            benchmarks.words(options["words"], options["slice_seconds"]),
+        )
+
+    def run_in_subprocess(self, argv):
+        manage_py = Path(settings.BASE_DIR) / "manage.py"
+        completed = subprocess.run(
+            [sys.executable, manage_py, "benchmark", *argv],  # noqa: S603
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def write_table(self, rows):
+        columns = list(rows[0])
+        widths = [
+            max(len(column), *(len(str(row[column])) for row in rows))
+            for column in columns
+        ]
+        self.stdout.write(
+            "  ".join(c.ljust(w) for c, w in zip(columns, widths, strict=True)),
+        )
+        for row in rows:
+            self.stdout.write(
+                "  ".join(
+                    str(row[c]).ljust(w) for c, w in zip(columns, widths, strict=True)
+                ),
+            )
@@ -1,20 +1,22 @@
-import json
-import logging
+import threading
+import time
 from pathlib import Path
 
-import yt_dlp
 from django.core.management.base import BaseCommand
-from pytube import YouTube
 
+from word_steno.clips.ingest import IngestError
+from word_steno.clips.ingest import fetch_video
+from word_steno.clips.ingest import get_or_create_clip
+from word_steno.clips.ingest import save_transcription
+from word_steno.clips.ingest import transcribe_clip_audio
+from word_steno.clips.ingest import upload_clip_audio
 from word_steno.clips.models import Clip
-from word_steno.clips.utils import download_audio
-from word_steno.clips.utils import extract_chapters
-from word_steno.clips.utils import extract_paragraphs
-from word_steno.clips.utils import extract_youtube_video_id
-from word_steno.clips.utils import get_description
-from word_steno.clips.utils import transcribe_audio
-
-TWO_HOURS = 2 * 60 * 60
+from word_steno.clips.pipeline import Stage
+from word_steno.clips.pipeline import limited
+from word_steno.clips.pipeline import run_pipeline
+from word_steno.clips.storage import get_storage
+from word_steno.clips.utils import buffer_audio
+from word_steno.clips.utils import find_stored_audio
 
 
 class Command(BaseCommand):
@@ -26,102 +28,124 @@ class Command(BaseCommand):
             type=str,
             help="Path to the file containing video IDs",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Threads per pipeline stage",
+        )
+        parser.add_argument(
+            "--queue-size",
+            type=int,
+            default=4,
+            help="Videos that may wait between two stages",
+        )
+        parser.add_argument(
+            "--youtube-concurrency",
+            type=int,
+            help="Concurrent YouTube requests (defaults to --workers)",
+        )
+        parser.add_argument(
+            "--deepgram-concurrency",
+            type=int,
+            help="Concurrent Deepgram transcriptions (defaults to --workers)",
+        )
+        parser.add_argument(
+            "--openai-concurrency",
+            type=int,
+            help="Videos summarized with OpenAI at once (defaults to --workers)",
+        )
+
+    def probe(self, video_id):
+        video_url = f"https://www.youtube.com/watch?v={video_id}"
+        metadata = fetch_video(video_url)
+        clip, _ = get_or_create_clip(metadata, video_url)
+        return {"clip": clip, "metadata": metadata}
+
+    def download(self, item):
+        if find_stored_audio(get_storage(), item["metadata"]) is None:
+            item["audio"] = buffer_audio(item["metadata"])
+        return item
+
+    def upload(self, item):
+        audio = item.pop("audio", None)
+        try:
+            item["object_name"] = upload_clip_audio(
+                item["clip"],
+                item.pop("metadata"),
+                audio,
+            )
+        finally:
+            if audio is not None:
+                audio.close()
+        return item
+
+    def transcribe(self, item):
+        item["transcription"] = transcribe_clip_audio(
+            item["clip"].video_id,
+            item["object_name"],
+        )
+        return item
+
+    def persist(self, item):
+        save_transcription(item["clip"], item["transcription"])
+        self.stdout.write(self.style.SUCCESS(f"Ingested {item['clip'].video_id}"))
+        return item["clip"]
+
+    def on_error(self, stage, item, error):
+        video_id = item if isinstance(item, str) else item["clip"].video_id
+        message = (
+            str(error)
+            if isinstance(error, IngestError)
+            else f"An error occurred in {stage}: {error!s}"
+        )
+        self.stdout.write(self.style.ERROR(f"{video_id}: {message}"))
 
     def handle(self, *args, **options):
         video_ids_file = Path(options["video_ids_file"])
+        workers = options["workers"]
+        youtube = threading.BoundedSemaphore(options["youtube_concurrency"] or workers)
+        deepgram = threading.BoundedSemaphore(
+            options["deepgram_concurrency"] or workers,
+        )
+        openai = threading.BoundedSemaphore(options["openai_concurrency"] or workers)
 
-        # Function to check if a YouTube video exists
-        def check_video_exists(video_id):
-            with yt_dlp.YoutubeDL({"quiet": True, "ignoreerrors": True}) as ydl:
-                info_dict = ydl.extract_info(
-                    f"https://www.youtube.com/watch?v={video_id}",
-                    download=False,
-                )
-                if info_dict:
-                    return True
-
-                self.stdout.write(
-                    self.style.ERROR(
-                        f"Video {video_id} does not exist or is unavailable.",
-                    ),
-                )
-                return False
-
-        # Function to download YouTube video as audio
-        def download(video_id):
-            try:
-                video_url = f"https://www.youtube.com/watch?v={video_id}"
-
-                if not video_url:
-                    self.stdout.write(self.style.ERROR("No URL provided"))
-                    return
-
-                # Initialize video url
-                yt = YouTube(video_url)
-                if yt.length > TWO_HOURS:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            "Youtube Video is greater than 2 hours. Please use a shorter video.",
-                        ),
-                    )
-                    return
-
-                # Check if the Clip with this video_id already exists
-                video_id = extract_youtube_video_id(video_url)
-                clip, created = Clip.objects.get_or_create(
-                    video_id=video_id,
-                    defaults={
-                        "url": video_url,
-                        "title": yt.title,
-                        "length": yt.length,
-                        "channel_title": yt.author,
-                        "description": get_description(video_url),
-                        "published_at": yt.publish_date,
-                    },
-                )
-
-                if not created:
-                    self.stdout.write(
-                        self.style.ERROR("Youtube Video is already uploaded."),
-                    )
-                    return
-
-                # Download & Upload Audio to S3
-                video_details = download_audio(yt)
-
-                # Transcribe audio file from S3
-                transcribed_audio = transcribe_audio(video_details["object_name"])
-
-                # modify transcribed data to json format
-                data = transcribed_audio.to_json()
-                data = json.loads(data)
-                deepgram_object = data["results"]["channels"][0]["alternatives"][0]
-                paragraphs_data = deepgram_object["paragraphs"]["paragraphs"]
-
-                # Save transcribed data to clip model
-                clip.storage_path = video_details["storage_path"]
-                clip.full_transcription = deepgram_object["paragraphs"]["transcript"]
-                clip.summary = data["results"]["summary"]["short"]
-                clip.paragraphs = paragraphs_data
-                clip.words = deepgram_object["words"]
-
-                clip.save()
-
-                # Save Paragraphs in ClipParagraph model
-                extracted_paragraphs = extract_paragraphs(paragraphs_data, clip)
-
-                # Save Chapters in Chapters model
-                extract_chapters(extracted_paragraphs, clip)
-
-            except Exception as e:
-                logging.exception(
-                    "Exception: download POST: downloading, transcribing and saving the clip.",
-                )
-                self.stdout.write(self.style.ERROR(f"An error occurred: {e!s}"))
-
-        # Main script logic
         with video_ids_file.open() as file:
-            for line in file:
-                video_id = line.strip()
-                if video_id and check_video_exists(video_id):
-                    download(video_id)
+            video_ids = list(dict.fromkeys(line.strip() for line in file))
+        video_ids = [video_id for video_id in video_ids if video_id]
+
+        # Skip everything that is already ingested before making any request
+        ingested = set(
+            Clip.objects.filter(
+                video_id__in=video_ids,
+                paragraphs__isnull=False,
+            ).values_list("video_id", flat=True),
+        )
+        if ingested:
+            self.stdout.write(f"Skipping {len(ingested)} already uploaded videos.")
+        video_ids = [video_id for video_id in video_ids if video_id not in ingested]
+
+        stages = [
+            Stage("probe", limited(youtube, self.probe), workers),
+            # The upload has its own stage, so S3 does not hold YouTube slots
+            Stage("download", limited(youtube, self.download), workers),
+            Stage("upload", self.upload, workers),
+            Stage("transcribe", limited(deepgram, self.transcribe), workers),
+            Stage("persist", limited(openai, self.persist), workers),
+        ]
+        started = time.monotonic()
+        clips, stats = run_pipeline(
+            video_ids,
+            stages,
+            queue_size=options["queue_size"],
+            on_error=self.on_error,
+        )
+        elapsed = time.monotonic() - started
+
+        throughput = len(clips) / elapsed * 3600 if elapsed else 0
+        self.stdout.write(
+            f"{len(clips)}/{len(video_ids)} videos in {elapsed:.1f}s "
+            f"({throughput:.1f} videos/hour)",
+        )
+        for stage_stats in stats:
+            self.stdout.write(f"  {stage_stats.summary()}")
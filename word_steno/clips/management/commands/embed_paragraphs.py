@@ -0,0 +1,102 @@
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from word_steno.clips.embeddings import EMBEDDING_BATCH_SIZE
+from word_steno.clips.embeddings import embed_transcriptions
+from word_steno.clips.embeddings import preload_model
+from word_steno.clips.models import ClipParagraph
+
+
+class Command(BaseCommand):
+    help = "Embed every paragraph that has no embedding yet, resuming where it stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Paragraphs fetched and saved at a time",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=EMBEDDING_BATCH_SIZE,
+            help="Paragraphs encoded at a time",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            type=Path,
+            default=Path(settings.BASE_DIR) / ".cache" / "embed_paragraphs.json",
+            help="File recording the last embedded paragraph id, where a run starts",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and start from the first paragraph",
+        )
+
+    def read_checkpoint(self, path):
+        try:
+            return json.loads(path.read_text())["last_id"]
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, path, last_id):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so an interrupted run never leaves a partial file
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"last_id": last_id}))
+        tmp_path.replace(path)
+
+    def handle(self, *args, **options):
+        checkpoint = options["checkpoint"]
+        resume_id = 0 if options["restart"] else self.read_checkpoint(checkpoint)
+        passes = [(resume_id, None)]
+        if resume_id:
+            self.stdout.write(f"Resuming after paragraph {resume_id}.")
+            # The checkpoint is only a hint: paragraphs below it can still lack
+            # an embedding, e.g. after a failed batch, so finish with those
+            passes.append((0, resume_id))
+
+        # Keep the model's load time out of the throughput figures. With an
+        # embedding server the model is loaded only if the server fails.
+        if not settings.CLIPS_EMBEDDING_SERVER_URL:
+            preload_model()
+        embedded = 0
+        started = time.monotonic()
+        for after, up_to in passes:
+            last_id = after
+            paragraphs = ClipParagraph.objects.filter(embedding__isnull=True)
+            if up_to is not None:
+                paragraphs = paragraphs.filter(id__lte=up_to)
+            while True:
+                # Keyset pagination: each chunk starts after the last id seen,
+                # so no chunk costs more than the first however far the
+                # backfill is, and a paragraph that fails is not retried forever
+                chunk = list(
+                    paragraphs.filter(id__gt=last_id)
+                    .order_by("id")
+                    .only("id", "full_transcription")[: options["chunk_size"]],
+                )
+                if not chunk:
+                    break
+
+                embedded += embed_transcriptions(
+                    chunk,
+                    batch_size=options["batch_size"],
+                )
+                last_id = chunk[-1].id
+                if up_to is None:
+                    self.write_checkpoint(checkpoint, last_id)
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"Embedded {embedded} paragraphs, up to id {last_id} "
+                    f"({embedded / elapsed:.1f}/s)",
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"Done, embedded {embedded} paragraphs."))
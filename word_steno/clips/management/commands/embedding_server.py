@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from word_steno.clips.embedding_service import EmbeddingServer
+from word_steno.clips.embedding_service import MicroBatcher
+from word_steno.clips.embeddings import EMBEDDING_BATCH_SIZE
+from word_steno.clips.embeddings import encode_locally
+from word_steno.clips.embeddings import preload_model
+
+
+class Command(BaseCommand):
+    help = "Serve the embedding model over localhost HTTP, batching requests"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--max-batch-size",
+            type=int,
+            default=EMBEDDING_BATCH_SIZE,
+            help="Texts encoded together at most",
+        )
+        parser.add_argument(
+            "--max-wait-ms",
+            type=float,
+            default=5.0,
+            help="How long a request may wait for others to batch with",
+        )
+
+    def handle(self, *args, **options):
+        preload_model()
+        max_batch_size = options["max_batch_size"]
+        batcher = MicroBatcher(
+            lambda texts: encode_locally(texts, batch_size=max_batch_size),
+            max_batch_size=max_batch_size,
+            max_wait=options["max_wait_ms"] / 1000,
+        )
+        server = EmbeddingServer((options["host"], options["port"]), batcher)
+        self.stdout.write(
+            f"Serving embeddings on http://{options['host']}:{options['port']}",
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
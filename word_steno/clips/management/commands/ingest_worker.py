@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from word_steno.clips.ingest import claim_next_job
+from word_steno.clips.ingest import run_job
+from word_steno.clips.models import IngestJob
+
+
+class Command(BaseCommand):
+    help = "Process queued ingestion jobs submitted through the download page"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait before checking an empty queue again",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit as soon as the queue is empty",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = claim_next_job()
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+
+            self.stdout.write(f"Processing {job.video_url} (attempt {job.attempts})")
+            job = run_job(job)
+            if job.status == IngestJob.Status.SUCCEEDED:
+                self.stdout.write(self.style.SUCCESS(f"Ingested {job.video_url}"))
+            else:
+                self.stdout.write(self.style.ERROR(f"{job.video_url}: {job.error}"))
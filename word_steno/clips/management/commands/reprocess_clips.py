@@ -0,0 +1,85 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connections
+
+from word_steno.clips.ingest import reprocess_clip
+from word_steno.clips.models import Clip
+from word_steno.clips.models import TranscriptArchive
+
+
+def _reprocess(clip_id, summarize_missing):
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    try:
+        return clip_id, reprocess_clip(clip_id, summarize_missing=summarize_missing)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild paragraphs and chapters from archived transcriptions, "
+        "without transcribing anything again"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "video_ids",
+            nargs="*",
+            help="Videos to reprocess",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Reprocess every clip with an archived transcription",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Processes to reprocess clips with",
+        )
+        parser.add_argument(
+            "--summarize-missing",
+            action="store_true",
+            help="Ask OpenAI for chapter summaries that cannot be reused",
+        )
+
+    def handle(self, *args, **options):
+        if options["all"] == bool(options["video_ids"]):
+            msg = "Pass either video ids or --all."
+            raise CommandError(msg)
+
+        archived = TranscriptArchive.objects.values("video_id")
+        clips = Clip.objects.filter(video_id__in=archived)
+        if not options["all"]:
+            clips = clips.filter(video_id__in=options["video_ids"])
+        clip_ids = list(clips.order_by("id").values_list("id", flat=True))
+
+        summarize_missing = options["summarize_missing"]
+        if options["workers"] > 1:
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options["workers"],
+                mp_context=multiprocessing.get_context("fork"),
+            ) as executor:
+                results = list(
+                    executor.map(
+                        _reprocess,
+                        clip_ids,
+                        [summarize_missing] * len(clip_ids),
+                    ),
+                )
+        else:
+            results = [
+                (clip_id, reprocess_clip(clip_id, summarize_missing=summarize_missing))
+                for clip_id in clip_ids
+            ]
+
+        reprocessed = sum(found for _, found in results)
+        self.stdout.write(
+            self.style.SUCCESS(f"Reprocessed {reprocessed}/{len(clip_ids)} clips."),
+        )
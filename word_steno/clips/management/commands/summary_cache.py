@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import Sum
+
+from word_steno.clips.models import SummaryCache
+
+
+class Command(BaseCommand):
+    help = "Report on or evict entries of the LLM summary cache"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="action", required=True)
+        subparsers.add_parser(
+            "stats",
+            help="Hits, misses and the requests, tokens and time they saved",
+        )
+        prune = subparsers.add_parser("prune", help="Evict old and excess entries")
+        prune.add_argument(
+            "--max-entries",
+            type=int,
+            default=settings.CLIPS_SUMMARY_CACHE_MAX_ENTRIES,
+        )
+        prune.add_argument(
+            "--max-age-days",
+            type=int,
+            default=settings.CLIPS_SUMMARY_CACHE_MAX_AGE_DAYS,
+        )
+
+    def handle(self, *args, **options):
+        getattr(self, options["action"])(options)
+
+    def stats(self, options):
+        totals = SummaryCache.objects.aggregate(
+            entries=Count("id"),
+            hits=Sum("hit_count", default=0),
+            saved_tokens=Sum(F("hit_count") * F("tokens"), default=0),
+            saved_seconds=Sum(F("hit_count") * F("latency"), default=0),
+        )
+        # Every entry was created by a miss; misses of evicted entries are lost
+        lookups = totals["hits"] + totals["entries"]
+        hit_ratio = totals["hits"] / lookups if lookups else 0
+        self.stdout.write(f"Entries:        {totals['entries']}")
+        self.stdout.write(f"Hits:           {totals['hits']}")
+        self.stdout.write(f"Misses:         {totals['entries']}")
+        self.stdout.write(f"Hit ratio:      {hit_ratio:.1%}")
+        self.stdout.write(f"Tokens saved:   ~{totals['saved_tokens']}")
+        self.stdout.write(f"Latency saved:  {totals['saved_seconds']:.1f}s")
+
+    def prune(self, options):
+        deleted = SummaryCache.prune(
+            options["max_entries"],
+            timedelta(days=options["max_age_days"]),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Evicted {deleted} entries."))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from pgvector.django import IvfflatIndex
+
+from word_steno.clips.models import ClipParagraph
+
+IVFFLAT_INDEX = "clipparagraph_embedding_ivfflat"
+
+
+class Command(BaseCommand):
+    # The HNSW index is declared on ClipParagraph, so only migrations may touch
+    # it; this command manages an index the models know nothing about
+    help = (
+        "Create or drop an IVFFlat paragraph embedding index next to the HNSW "
+        "one, to compare the two; it builds faster but finds fewer neighbours"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["create", "drop"])
+        parser.add_argument(
+            "--lists",
+            type=int,
+            help="IVFFlat lists (defaults to one per 1,000 embedded paragraphs)",
+        )
+
+    def handle(self, *args, **options):
+        lists = options["lists"] or max(
+            1,
+            ClipParagraph.objects.filter(embedding__isnull=False).count() // 1000,
+        )
+        ivfflat = IvfflatIndex(
+            name=IVFFLAT_INDEX,
+            fields=["embedding"],
+            lists=lists,
+            opclasses=["vector_cosine_ops"],
+        )
+
+        with connection.cursor() as cursor:
+            existing = connection.introspection.get_constraints(
+                cursor,
+                ClipParagraph._meta.db_table,  # noqa: SLF001
+            )
+        create = options["action"] == "create"
+        with connection.schema_editor(atomic=False) as schema_editor:
+            if create and IVFFLAT_INDEX not in existing:
+                self.stdout.write(f"Building {IVFFLAT_INDEX} with {lists} lists...")
+                schema_editor.add_index(ClipParagraph, ivfflat, concurrently=True)
+            elif not create and IVFFLAT_INDEX in existing:
+                schema_editor.remove_index(ClipParagraph, ivfflat, concurrently=True)
+        state = "exists" if create else "is gone"
+        self.stdout.write(self.style.SUCCESS(f"{IVFFLAT_INDEX} {state}."))
@@ -0,0 +1,41 @@
+import threading
+
+
+class CacheStats:
+    """Counts a cache's lookups in this process and the time its hits saved.
+
+    ``hits`` names a counter per place a lookup can be found, and ``work``
+    what a miss costs, e.g. ``"render"`` for ``render_seconds``.
+    """
+
+    def __init__(self, work, hits=("hits",)):
+        self.hits = hits
+        self.seconds = f"{work}_seconds"
+        self.mean_ms = f"mean_{work}_ms"
+        self.saved = f"{work}_seconds_saved"
+        self.lock = threading.Lock()
+        self.counts = {**dict.fromkeys(hits, 0), "misses": 0, self.seconds: 0.0}
+
+    def hit(self, name="hits"):
+        with self.lock:
+            self.counts[name] += 1
+
+    def miss(self, seconds):
+        with self.lock:
+            self.counts["misses"] += 1
+            self.counts[self.seconds] += seconds
+
+    def summary(self):
+        with self.lock:
+            counts = dict(self.counts)
+        hits = sum(counts[name] for name in self.hits)
+        lookups = hits + counts["misses"]
+        mean = 0
+        if counts["misses"]:
+            mean = counts[self.seconds] / counts["misses"]
+        return {
+            **counts,
+            "hit_ratio": hits / lookups if lookups else 0,
+            self.mean_ms: mean * 1000,
+            self.saved: hits * mean,
+        }
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clips', '0007_ingestjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('video_id', models.CharField(max_length=255)),
+                ('options_key', models.CharField(max_length=64)),
+                ('options', models.JSONField()),
+                ('payload', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='transcriptarchive',
+            constraint=models.UniqueConstraint(fields=('video_id', 'options_key'), name='unique_transcript_per_video_and_options'),
+        ),
+    ]
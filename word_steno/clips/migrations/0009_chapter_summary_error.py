@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clips', '0008_transcriptarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='summary_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
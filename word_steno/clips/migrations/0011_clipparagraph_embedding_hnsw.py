@@ -0,0 +1,22 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:46
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+import pgvector.django
+
+
+class Migration(migrations.Migration):
+    # Building the index can take a while on a large corpus; do not block
+    # ingestion while it runs
+    atomic = False
+
+    dependencies = [
+        ('clips', '0010_summarycache'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='clipparagraph',
+            index=pgvector.django.HnswIndex(ef_construction=64, fields=['embedding'], m=16, name='clipparagraph_embedding_hnsw', opclasses=['vector_cosine_ops']),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:48
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+# The clip title lives in another table, which a generated column cannot
+# read, so triggers maintain the vector instead. The transcription weighs
+# most, then the clip title, then the speaker.
+PARAGRAPH_VECTOR = """
+    setweight(to_tsvector('english', coalesce({paragraph}.full_transcription, '')), 'A')
+    || setweight(to_tsvector('english', coalesce({title}, '')), 'B')
+    || setweight(to_tsvector('english', coalesce({paragraph}.speaker, '')), 'C')
+"""
+
+CREATE_TRIGGERS = f"""
+CREATE FUNCTION clips_clipparagraph_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {PARAGRAPH_VECTOR.format(
+        paragraph="NEW",
+        title="(SELECT title FROM clips_clip WHERE id = NEW.clip_id)",
+    )};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER clips_clipparagraph_search_vector
+    BEFORE INSERT OR UPDATE OF full_transcription, speaker, clip_id
+    ON clips_clipparagraph
+    FOR EACH ROW EXECUTE FUNCTION clips_clipparagraph_search_vector();
+
+CREATE FUNCTION clips_clip_search_vector() RETURNS trigger AS $$
+BEGIN
+    UPDATE clips_clipparagraph
+    SET search_vector = {PARAGRAPH_VECTOR.format(
+        paragraph="clips_clipparagraph",
+        title="NEW.title",
+    )}
+    WHERE clip_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER clips_clip_search_vector
+    AFTER UPDATE OF title ON clips_clip
+    FOR EACH ROW WHEN (OLD.title IS DISTINCT FROM NEW.title)
+    EXECUTE FUNCTION clips_clip_search_vector();
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER clips_clip_search_vector ON clips_clip;
+DROP FUNCTION clips_clip_search_vector();
+DROP TRIGGER clips_clipparagraph_search_vector ON clips_clipparagraph;
+DROP FUNCTION clips_clipparagraph_search_vector();
+"""
+
+BACKFILL = f"""
+UPDATE clips_clipparagraph
+SET search_vector = {PARAGRAPH_VECTOR.format(
+    paragraph="clips_clipparagraph",
+    title="clips_clip.title",
+)}
+FROM clips_clip
+WHERE clips_clip.id = clips_clipparagraph.clip_id;
+"""
+
+
+class Migration(migrations.Migration):
+    # The GIN index is built concurrently, which cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('clips', '0011_clipparagraph_embedding_hnsw'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clipparagraph',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+        AddIndexConcurrently(
+            model_name='clipparagraph',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='clipparagraph_search_vector'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import numpy as np
+
+
+# A copy of models.pack_words() as it was when this migration was written, so
+# later changes to the model do not change what this migration does
+def pack_words(words):
+    tokens = [(word.get("punctuated_word") or word["word"]).encode() for word in words]
+    offsets = np.zeros(len(tokens) + 1, dtype=np.uint32)
+    np.cumsum([len(token) for token in tokens], out=offsets[1:])
+    return {
+        "count": len(words),
+        "starts": np.array([w["start"] for w in words], dtype=np.float32).tobytes(),
+        "ends": np.array([w["end"] for w in words], dtype=np.float32).tobytes(),
+        "speakers": np.array(
+            [w.get("speaker", -1) for w in words],
+            dtype=np.int16,
+        ).tobytes(),
+        "offsets": offsets.tobytes(),
+        "tokens": b"".join(tokens),
+    }
+
+
+def pack_clip_words(apps, schema_editor):
+    Clip = apps.get_model("clips", "Clip")
+    ClipWords = apps.get_model("clips", "ClipWords")
+    # A few clips at a time, each word list can be megabytes of JSON
+    clips = Clip.objects.filter(words__isnull=False).only("id", "words")
+    for clip in clips.iterator(chunk_size=20):
+        ClipWords.objects.create(clip_id=clip.id, **pack_words(clip.words))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clips', '0012_clipparagraph_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClipWords',
+            fields=[
+                ('clip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='clips.clip')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('starts', models.BinaryField()),
+                ('ends', models.BinaryField()),
+                ('speakers', models.BinaryField()),
+                ('offsets', models.BinaryField()),
+                ('tokens', models.BinaryField()),
+            ],
+        ),
+        # Clip.words is kept, with the confidences and raw words that are not
+        # packed, until every clip has a transcript archive. Going back only
+        # drops the packed copy.
+        migrations.RunPython(pack_clip_words, migrations.RunPython.noop),
+    ]
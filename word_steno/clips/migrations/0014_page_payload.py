@@ -0,0 +1,42 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:56
+
+import markdown
+from django.db import migrations, models
+
+
+# A copy of models.render_summary() as it was when this migration was written
+def render_summary(summary):
+    return markdown.markdown(
+        summary,
+        extensions=["extra", "nl2br", "sane_lists", "smarty"],
+    )
+
+
+def render_chapter_summaries(apps, schema_editor):
+    Chapter = apps.get_model("clips", "Chapter")
+    chapters = list(Chapter.objects.exclude(summary="").only("id", "summary"))
+    for chapter in chapters:
+        chapter.summary_html = render_summary(chapter.summary)
+    Chapter.objects.bulk_update(chapters, ["summary_html"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clips', '0013_clipwords'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='summary_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='clip',
+            name='page_payload',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        # Page payloads are built when each clip is first viewed
+        migrations.RunPython(render_chapter_summaries, migrations.RunPython.noop),
+    ]
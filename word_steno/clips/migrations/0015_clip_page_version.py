@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clips', '0014_page_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clip',
+            name='page_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
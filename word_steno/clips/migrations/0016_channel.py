@@ -0,0 +1,64 @@
+# Generated by Django 4.2.10 on 2026-10-18 12:01
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+import django.db.models.deletion
+
+
+def link_clips_to_channels(apps, schema_editor):
+    Channel = apps.get_model("clips", "Channel")
+    Clip = apps.get_model("clips", "Clip")
+    titles = list(
+        Clip.objects.exclude(channel_title="")
+        .values_list("channel_title", flat=True)
+        .distinct(),
+    )
+    for title in titles:
+        channel = Channel.objects.create(title=title)
+        Clip.objects.filter(channel_title=title).update(channel=channel)
+
+    stats = (
+        Clip.objects.filter(channel__isnull=False)
+        .values("channel")
+        .annotate(
+            clip_count=Count("id"),
+            total_length=Sum("length"),
+            latest_published_at=Max("published_at"),
+        )
+    )
+    for row in stats:
+        Channel.objects.filter(id=row["channel"]).update(
+            clip_count=row["clip_count"],
+            total_length=row["total_length"] or 0,
+            latest_published_at=row["latest_published_at"],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clips', '0015_clip_page_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Channel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255, unique=True)),
+                ('clip_count', models.PositiveIntegerField(default=0)),
+                ('total_length', models.PositiveIntegerField(default=0)),
+                ('latest_published_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='clip',
+            name='channel',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='clips.channel'),
+        ),
+        migrations.RunPython(link_clips_to_channels, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='clip',
+            index=models.Index(fields=['channel', '-published_at', '-id'], name='clip_channel_published'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.10 on 2026-10-18 12:03
+
+from django.db import migrations
+import word_steno.clips.models
+
+# One bit per dimension, set where the value is positive, in dimension order.
+# Matches binary_quantize() in models.py, which quantizes search queries.
+EMBEDDING_BITS = """
+    (
+        SELECT string_agg(CASE WHEN value > 0 THEN '1' ELSE '0' END, '' ORDER BY position)
+        FROM unnest({embedding}::real[]) WITH ORDINALITY AS dimensions(value, position)
+    )::bit(1024)
+"""
+
+CREATE_TRIGGER = f"""
+CREATE FUNCTION clips_clipparagraph_embedding_bits() RETURNS trigger AS $$
+BEGIN
+    NEW.embedding_bits := {EMBEDDING_BITS.format(embedding="NEW.embedding")};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER clips_clipparagraph_embedding_bits
+    BEFORE INSERT OR UPDATE OF embedding
+    ON clips_clipparagraph
+    FOR EACH ROW EXECUTE FUNCTION clips_clipparagraph_embedding_bits();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER clips_clipparagraph_embedding_bits ON clips_clipparagraph;
+DROP FUNCTION clips_clipparagraph_embedding_bits();
+"""
+
+BACKFILL = f"""
+UPDATE clips_clipparagraph
+SET embedding_bits = {EMBEDDING_BITS.format(embedding="embedding")}
+WHERE embedding IS NOT NULL AND id >= %s AND id < %s;
+"""
+BACKFILL_BATCH_SIZE = 10000
+
+
+def backfill_embedding_bits(apps, schema_editor):
+    # The migration is not atomic, so each batch commits on its own and no
+    # transaction holds the whole table's row locks and dead tuples
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT coalesce(max(id), 0) FROM clips_clipparagraph")
+        (max_id,) = cursor.fetchone()
+        for start in range(0, max_id + 1, BACKFILL_BATCH_SIZE):
+            cursor.execute(BACKFILL, [start, start + BACKFILL_BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+    # The backfill commits batch by batch
+    atomic = False
+
+    dependencies = [
+        ('clips', '0016_channel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clipparagraph',
+            name='embedding_bits',
+            field=word_steno.clips.models.BitStringField(editable=False, length=1024, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.RunPython(backfill_embedding_bits, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.10 on 2026-10-18 12:15
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    IngestJob = apps.get_model("clips", "IngestJob")
+    active = IngestJob.objects.filter(status__in=["pending", "running"])
+    # Keep the newest active job of each video, as enqueue() returned it
+    seen = set()
+    for job in active.order_by("video_id", "-created_at").only("id", "video_id"):
+        if job.video_id in seen:
+            IngestJob.objects.filter(id=job.id).update(
+                status="failed",
+                error="Superseded by a newer job for the same video.",
+                finished_at=timezone.now(),
+            )
+        seen.add(job.video_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clips', '0017_clipparagraph_embedding_bits'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingestjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('video_id',), name='ingestjob_one_active_per_video'),
+        ),
+    ]
@@ -1,8 +1,149 @@
+import gzip
+import hashlib
+import json
+from datetime import datetime
+
+import markdown
+import numpy as np
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import Max
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import Subquery
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.timesince import timesince
+from pgvector.django import HnswIndex
 from pgvector.django import VectorField
 
+SUMMARY_MARKDOWN_EXTENSIONS = ["extra", "nl2br", "sane_lists", "smarty"]
+
+
+def render_summary(summary):
+    return markdown.markdown(summary, extensions=SUMMARY_MARKDOWN_EXTENSIONS)
+
+
+class ClipQuerySet(models.QuerySet):
+    def light(self):
+        """Leaves out the columns that hold a whole transcription."""
+        return self.defer(*Clip.HEAVY_FIELDS)
+
+    def for_listing(self, *fields):
+        """Only what a clip's card or page header shows, and ``fields``."""
+        return self.only("title", "video_id", "length", "published_at", *fields)
+
+    def ingested(self):
+        return self.filter(paragraphs__isnull=False)
+
+    def bump_page_versions(self, **changes):
+        """Retires the cached pages of these clips, also applying ``changes``."""
+        return self.update(page_version=F("page_version") + 1, **changes)
+
+
+class ClipParagraphQuerySet(models.QuerySet):
+    # What a search result shows of a paragraph and of its clip
+    RESULT_FIELDS = (
+        "start",
+        "end",
+        "speaker",
+        "full_transcription",
+        "clip",
+        "clip__url",
+        "clip__title",
+        "clip__channel_title",
+        "clip__length",
+        "clip__summary",
+        "clip__video_id",
+    )
+
+    def for_results(self, *fields):
+        """Paragraphs with their clips, leaving out the embedding and the JSON.
+
+        ``fields`` are loaded on top of :attr:`RESULT_FIELDS`.
+        """
+        return self.select_related("clip").only(*self.RESULT_FIELDS, *fields)
+
+
+def encode_published_cursor(published_at, clip_id):
+    published = published_at.isoformat() if published_at else ""
+    return f"{published}_{clip_id}"
+
+
+def decode_published_cursor(cursor):
+    """Returns ``(published_at, clip_id)``, or ``None`` for a bad cursor."""
+    try:
+        published, clip_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(published) if published else None, int(clip_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+class Channel(models.Model):
+    title = models.CharField(max_length=255, unique=True)
+    # Recomputed by refresh_stats() whenever a clip is saved or deleted, see
+    # signals
+    clip_count = models.PositiveIntegerField(default=0)
+    total_length = models.PositiveIntegerField(default=0)
+    latest_published_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return self.title
+
+    @classmethod
+    def refresh_stats(cls, channel_ids):
+        """Recomputes the stats of these channels from their clips, in one query."""
+        clips = Clip.objects.filter(channel=OuterRef("pk")).order_by().values("channel")
+
+        def aggregate(function):
+            return Subquery(clips.annotate(value=function).values("value"))
+
+        cls.objects.filter(id__in=channel_ids).update(
+            clip_count=Coalesce(aggregate(Count("id")), 0),
+            total_length=Coalesce(aggregate(Sum("length")), 0),
+            latest_published_at=aggregate(Max("published_at")),
+        )
+
+    def clips_page(self, after=None, per_page=None):
+        """Returns a page of the channel's clips, newest first, and the next cursor.
+
+        Pages follow a ``(published_at, id)`` cursor down the
+        ``clip_channel_published`` index, so the last page of a big channel
+        costs no more than the first. Unpublished clips come first, the way
+        Postgres sorts nulls in descending order.
+        """
+        per_page = per_page or settings.CLIPS_CHANNEL_CLIPS_PER_PAGE
+        clips = (
+            Clip.objects.for_listing()
+            .filter(channel=self)
+            .order_by("-published_at", "-id")
+        )
+        if (cursor := decode_published_cursor(after)) is not None:
+            published_at, clip_id = cursor
+            if published_at is None:
+                clips = clips.filter(
+                    Q(published_at__isnull=True, id__lt=clip_id)
+                    | Q(published_at__isnull=False),
+                )
+            else:
+                # The first condition bounds the index scan, the second
+                # only breaks ties between clips published at the same time
+                clips = clips.filter(
+                    Q(published_at__lte=published_at)
+                    & (Q(published_at__lt=published_at) | Q(id__lt=clip_id)),
+                )
+        clips = list(clips[: per_page + 1])
+        next_cursor = None
+        if len(clips) > per_page:
+            clips = clips[:per_page]
+            next_cursor = encode_published_cursor(clips[-1].published_at, clips[-1].id)
+        return clips, next_cursor
+
 
 # Create your models here.
 class Clip(models.Model):
@@ -11,21 +152,65 @@ class Clip(models.Model):
     storage_path = models.CharField(max_length=255, blank=True, default="")
     length = models.IntegerField(blank=True, null=True)
     title = models.CharField(max_length=255, blank=True, default="")
+    # As YouTube reported it at ingest; clips are grouped by channel
     channel_title = models.CharField(max_length=255, blank=True, default="")
+    channel = models.ForeignKey(
+        Channel,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
     description = models.TextField(blank=True, default="")
 
     full_transcription = models.TextField(blank=True, default="")
     summary = models.TextField(blank=True, default="")
     paragraphs = models.JSONField(blank=True, null=True)
+    # The Deepgram word list, no longer written now that ClipWords holds the
+    # timings. Kept for its confidences until every clip has a transcript
+    # archive to rebuild them from.
     words = models.JSONField(blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     published_at = models.DateTimeField(blank=True, null=True)
+    # The clip page's paragraphs as JSON, rebuilt by save_page_payload()
+    # whenever they change
+    page_payload = models.TextField(blank=True, default="", editable=False)
+    # Incremented by every write that changes the clip page, which retires
+    # its cached fragments, see page_cache
+    page_version = models.PositiveIntegerField(default=0, editable=False)
+
+    # The raw Deepgram output, megabytes for a long podcast; views that only
+    # list or link clips leave these out and read them with load()
+    HEAVY_FIELDS = ("full_transcription", "paragraphs", "words", "page_payload")
+
+    objects = ClipQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Channel pages, newest first, see Channel.clips_page()
+            models.Index(
+                name="clip_channel_published",
+                fields=["channel", "-published_at", "-id"],
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    def load(self, field):
+        """Returns one of :attr:`HEAVY_FIELDS`, reading it if it was deferred.
+
+        Unlike touching a deferred attribute, the value is not kept on the
+        instance, so keep the result rather than calling this twice.
+        """
+        if field not in self.HEAVY_FIELDS:
+            msg = f"{field} is not a heavy field of Clip."
+            raise ValueError(msg)
+        if field not in self.get_deferred_fields():
+            return getattr(self, field)
+        return type(self).objects.filter(pk=self.pk).values_list(field, flat=True).get()
+
     @property
     def published_ago(self):
         """Returns a human-readable string representing how long ago the clip was published."""
@@ -35,6 +220,32 @@ class Clip(models.Model):
         return "Not published yet"
 
 
+class BitStringField(models.Field):
+    """A Postgres ``bit(length)`` column, read and written as strings of 0s and 1s."""
+
+    description = "Fixed-length bit string"
+
+    def __init__(self, *args, length, **kwargs):
+        self.length = length
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["length"] = self.length
+        return name, path, args, kwargs
+
+    def db_type(self, connection):
+        return f"bit({self.length})"
+
+
+def binary_quantize(embedding):
+    """Returns the sign bits of ``embedding`` as a string, 1 for positive values.
+
+    The same bits the database triggers store in ``embedding_bits``.
+    """
+    return "".join(np.where(np.asarray(embedding) > 0, "1", "0"))
+
+
 class ClipParagraph(models.Model):
     clip = models.ForeignKey(Clip, on_delete=models.CASCADE)
     end = models.FloatField(blank=True, null=True)
@@ -47,10 +258,48 @@ class ClipParagraph(models.Model):
         blank=True,
         null=True,
     )  # For storing the sentence embedding
+    # Kept up to date by database triggers from the transcription, the
+    # speaker and the clip's title, see migration 0012
+    search_vector = SearchVectorField(null=True, editable=False)
+    # The sign of each embedding dimension, 128 bytes against the vector's
+    # 4 KB, for a coarse Hamming distance pass. Kept up to date by a database
+    # trigger, see migration 0017
+    embedding_bits = BitStringField(length=1024, null=True, editable=False)
+
+    objects = ClipParagraphQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(
+                name="clipparagraph_search_vector",
+                fields=["search_vector"],
+            ),
+            # Embeddings are normalized, so cosine distance ranks like inner
+            # product; search with CosineDistance so this index is used
+            HnswIndex(
+                name="clipparagraph_embedding_hnsw",
+                fields=["embedding"],
+                m=16,
+                ef_construction=64,
+                opclasses=["vector_cosine_ops"],
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    # Saving or deleting one paragraph, as the admin does, clears the clip
+    # page's paragraphs so the next view rebuilds them. Bulk writes go
+    # through persistence.save_page_payload() instead.
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Clip.objects.filter(id=self.clip_id).bump_page_versions(page_payload="")
+
+    def delete(self, *args, **kwargs):
+        deleted = super().delete(*args, **kwargs)
+        Clip.objects.filter(id=self.clip_id).bump_page_versions(page_payload="")
+        return deleted
+
 
 class Chapter(models.Model):
     clip = models.ForeignKey(Clip, on_delete=models.CASCADE)
@@ -60,6 +309,281 @@ class Chapter(models.Model):
     chapter_transcription = models.TextField(blank=True, default="")
     prompt = models.TextField(blank=True, default="")
     summary = models.TextField(blank=True, default="")
+    # Why the summary is missing, if summarizing the chapter failed
+    summary_error = models.TextField(blank=True, default="")
+    # The summary rendered from markdown when the chapter is saved
+    summary_html = models.TextField(blank=True, default="", editable=False)
 
     def __str__(self):
         return self.title
+
+    def save(self, *args, **kwargs):
+        self.render_summary()
+        super().save(*args, **kwargs)
+        Clip.objects.filter(id=self.clip_id).bump_page_versions()
+
+    def delete(self, *args, **kwargs):
+        deleted = super().delete(*args, **kwargs)
+        Clip.objects.filter(id=self.clip_id).bump_page_versions()
+        return deleted
+
+    def render_summary(self):
+        """Sets :attr:`summary_html`; ``bulk_create`` callers must call this."""
+        self.summary_html = render_summary(self.summary)
+
+
+def pack_words(words):
+    """Returns the :class:`ClipWords` columns for a Deepgram word list."""
+    tokens = [(word.get("punctuated_word") or word["word"]).encode() for word in words]
+    offsets = np.zeros(len(tokens) + 1, dtype=np.uint32)
+    np.cumsum([len(token) for token in tokens], out=offsets[1:])
+    return {
+        "count": len(words),
+        "starts": np.array([w["start"] for w in words], dtype=np.float32).tobytes(),
+        "ends": np.array([w["end"] for w in words], dtype=np.float32).tobytes(),
+        "speakers": np.array(
+            [w.get("speaker", -1) for w in words],
+            dtype=np.int16,
+        ).tobytes(),
+        "offsets": offsets.tobytes(),
+        "tokens": b"".join(tokens),
+    }
+
+
+class ClipWords(models.Model):
+    """A clip's word timings, one packed array per attribute.
+
+    Word ``i`` runs from ``starts[i]`` to ``ends[i]``, was said by
+    ``speakers[i]`` (-1 without diarization) and reads
+    ``tokens[offsets[i]:offsets[i + 1]]``. That is 14 bytes a word plus its
+    text, where the JSON it replaces repeated every key for every word.
+    Confidences are not kept; the transcript archive still has them.
+    """
+
+    clip = models.OneToOneField(Clip, on_delete=models.CASCADE, primary_key=True)
+    count = models.PositiveIntegerField(default=0)
+    starts = models.BinaryField()  # float32
+    ends = models.BinaryField()  # float32
+    speakers = models.BinaryField()  # int16
+    offsets = models.BinaryField()  # uint32, count + 1 of them
+    tokens = models.BinaryField()  # UTF-8
+
+    def __str__(self):
+        return f"{self.count} words of clip {self.clip_id}"
+
+    @classmethod
+    def store(cls, clip, words):
+        clip_words, _ = cls.objects.update_or_create(
+            clip=clip,
+            defaults=pack_words(words),
+        )
+        return clip_words
+
+    def _array(self, field, dtype):
+        # Views on the fetched bytes, nothing is copied or decoded
+        return np.frombuffer(getattr(self, field), dtype=dtype)
+
+    def between(self, start, end):
+        """Returns the words starting in ``[start, end)`` seconds, in order.
+
+        Only those words are decoded, found by bisecting the start times.
+        """
+        starts = self._array("starts", np.float32)
+        first, last = np.searchsorted(starts, [start, end])
+        return self._words(first, last)
+
+    def words(self):
+        return self._words(0, self.count)
+
+    def _words(self, first, last):
+        starts = self._array("starts", np.float32)
+        ends = self._array("ends", np.float32)
+        speakers = self._array("speakers", np.int16)
+        offsets = self._array("offsets", np.uint32)
+        tokens = memoryview(self.tokens)
+        return [
+            {
+                "word": str(tokens[offsets[index] : offsets[index + 1]], "utf-8"),
+                "start": float(starts[index]),
+                "end": float(ends[index]),
+                "speaker": int(speakers[index]),
+            }
+            for index in range(first, last)
+        ]
+
+
+class TranscriptArchive(models.Model):
+    """The raw Deepgram response for a video, gzip-compressed.
+
+    Everything derived from a transcription can be rebuilt from here, so
+    changing how paragraphs or chapters are built never means paying for the
+    audio to be transcribed again.
+    """
+
+    video_id = models.CharField(max_length=255)
+    # sha256 of the transcription options, see options_key_for()
+    options_key = models.CharField(max_length=64)
+    options = models.JSONField()
+    payload = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["video_id", "options_key"],
+                name="unique_transcript_per_video_and_options",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.video_id} ({self.options_key[:8]})"
+
+    @staticmethod
+    def options_key_for(options):
+        canonical = json.dumps(options, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    @classmethod
+    def store(cls, video_id, options, response_json):
+        archive, _ = cls.objects.update_or_create(
+            video_id=video_id,
+            options_key=cls.options_key_for(options),
+            defaults={
+                "options": options,
+                "payload": gzip.compress(response_json.encode()),
+            },
+        )
+        return archive
+
+    def load(self):
+        return json.loads(gzip.decompress(self.payload))
+
+
+class SummaryCache(models.Model):
+    """A completion kept so that an identical prompt is never paid for twice.
+
+    Entries are evicted by age and count with ``manage.py summary_cache prune``.
+    """
+
+    # sha256 of the model and prompt, see key_for()
+    key = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=255)
+    summary = models.TextField()
+    # Estimated prompt and completion tokens, and how long the request took
+    tokens = models.IntegerField(default=0)
+    latency = models.FloatField(default=0)
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["last_used_at"])]
+
+    def __str__(self):
+        return f"{self.model} {self.key[:8]}"
+
+    @staticmethod
+    def key_for(model, prompt):
+        return hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()
+
+    @classmethod
+    def lookup(cls, model, prompt):
+        """Returns the cached summary and counts the hit, or ``None``."""
+        key = cls.key_for(model, prompt)
+        summary = cls.objects.filter(key=key).values_list("summary", flat=True).first()
+        if summary is not None:
+            cls.objects.filter(key=key).update(
+                hit_count=models.F("hit_count") + 1,
+                last_used_at=timezone.now(),
+            )
+        return summary
+
+    @classmethod
+    def store(cls, model, prompt, summary, tokens, latency):  # noqa: PLR0913
+        entry, _ = cls.objects.update_or_create(
+            key=cls.key_for(model, prompt),
+            defaults={
+                "model": model,
+                "summary": summary,
+                "tokens": tokens,
+                "latency": latency,
+                "last_used_at": timezone.now(),
+            },
+        )
+        return entry
+
+    @classmethod
+    def prune(cls, max_entries, max_age):
+        """Deletes entries unused for ``max_age`` and all but the ``max_entries``
+        most recently used ones, returning how many were deleted.
+        """
+        deleted, _ = cls.objects.filter(
+            last_used_at__lt=timezone.now() - max_age,
+        ).delete()
+        keep = cls.objects.order_by("-last_used_at").values("id")[:max_entries]
+        evicted, _ = cls.objects.exclude(id__in=keep).delete()
+        return deleted + evicted
+
+
+class IngestJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        RUNNING = "running", "Running"
+        SUCCEEDED = "succeeded", "Succeeded"
+        FAILED = "failed", "Failed"
+
+    class Stage(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        METADATA = "metadata", "Fetching video details"
+        DOWNLOAD = "download", "Downloading audio"
+        TRANSCRIBE = "transcribe", "Transcribing audio"
+        PARAGRAPHS = "paragraphs", "Saving paragraphs"
+        CHAPTERS = "chapters", "Summarizing chapters"
+        DONE = "done", "Done"
+
+    video_url = models.URLField()
+    video_id = models.CharField(max_length=255, db_index=True)
+    clip = models.ForeignKey(Clip, on_delete=models.SET_NULL, blank=True, null=True)
+    status = models.CharField(
+        max_length=16,
+        choices=Status.choices,
+        default=Status.PENDING,
+    )
+    stage = models.CharField(max_length=16, choices=Stage.choices, default=Stage.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    # A failed attempt is retried no sooner than this
+    run_after = models.DateTimeField(blank=True, null=True)
+
+    ACTIVE_STATUSES = (Status.PENDING, Status.RUNNING)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+        constraints = [
+            # Two requests for the same video share one job, see enqueue()
+            models.UniqueConstraint(
+                name="ingestjob_one_active_per_video",
+                fields=["video_id"],
+                condition=Q(status__in=["pending", "running"]),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.video_id} ({self.status})"
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+    @property
+    def progress(self):
+        """Returns how far through the pipeline the job is, as a percentage."""
+        stages = list(self.Stage)
+        return round(100 * stages.index(self.stage) / (len(stages) - 1))
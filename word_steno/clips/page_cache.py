@@ -0,0 +1,67 @@
+"""Rendered fragments of clip pages, cached until the clip changes.
+
+Fragments are keyed on the clip and its ``page_version``, which every write
+that changes what the page shows increments. A hit is therefore never stale,
+and fragments of old versions are left to expire. The CSRF token differs per
+visitor, so fragments are rendered with a placeholder that is swapped for the
+visitor's token as they are served.
+"""
+
+import functools
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.middleware.csrf import get_token
+from django.utils.safestring import mark_safe
+
+from .metrics import CacheStats
+
+KEY_PREFIX = "clip-page"
+CSRF_PLACEHOLDER = "__clip_page_csrf_token__"
+
+
+class ClipPageCache:
+    def __init__(self, timeout=None, cache_alias="default", clock=time.perf_counter):
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        self.clock = clock
+        self.stats = CacheStats("render")
+
+    def key(self, clip_id, version):
+        return f"{KEY_PREFIX}:{clip_id}:{version}"
+
+    def get(self, clip_id, version, render):
+        """Returns the fragments of a clip page, calling ``render`` on a miss.
+
+        ``render`` returns a dict of HTML fragments, rendered with
+        ``csrf_token`` set to :data:`CSRF_PLACEHOLDER`.
+        """
+        key = self.key(clip_id, version)
+        fragments = caches[self.cache_alias].get(key)
+        if fragments is not None:
+            self.stats.hit()
+            return fragments
+
+        started = self.clock()
+        fragments = render()
+        self.stats.miss(self.clock() - started)
+        caches[self.cache_alias].set(key, fragments, self.timeout)
+        return fragments
+
+    def metrics(self):
+        """Returns this process's hit ratio and the rendering time its hits saved."""
+        return self.stats.summary()
+
+
+def with_csrf_token(fragments, request):
+    token = get_token(request)
+    return {
+        name: mark_safe(html.replace(CSRF_PLACEHOLDER, token))  # noqa: S308
+        for name, html in fragments.items()
+    }
+
+
+@functools.cache
+def get_page_cache():
+    return ClipPageCache(timeout=settings.CLIPS_PAGE_CACHE_TTL)
@@ -0,0 +1,165 @@
+"""Writes the rows derived from a transcription.
+
+Rows are built in memory and written in as few statements as possible, so a
+long podcast costs a handful of round trips instead of one per paragraph.
+"""
+
+import json
+import math
+
+from django.db import connection
+from django.db import transaction
+from psycopg import sql
+from psycopg.types.json import Jsonb
+
+from .models import Chapter
+from .models import Clip
+from .models import ClipParagraph
+
+BULK_BATCH_SIZE = 500
+# Above this many paragraphs, COPY beats even a batched INSERT
+COPY_THRESHOLD = 2000
+PAGE_PARAGRAPH_FIELDS = [
+    "id",
+    "sentences",
+    "full_transcription",
+    "start",
+    "end",
+    "speaker",
+]
+PARAGRAPH_COPY_COLUMNS = [
+    "clip_id",
+    "start",
+    "end",
+    "speaker",
+    "sentences",
+    "full_transcription",
+    "embedding",
+]
+
+
+def paragraph_text(paragraph):
+    sentences = paragraph.get("sentences") or []
+    return "".join(f"{sentence.get('text')} " for sentence in sentences)
+
+
+def build_paragraphs(paragraphs_data, clip):
+    """Returns unsaved :class:`ClipParagraph` rows for a Deepgram paragraph list."""
+    return [
+        ClipParagraph(
+            clip=clip,
+            end=paragraph.get("end"),
+            start=paragraph.get("start"),
+            speaker=paragraph.get("speaker"),
+            sentences=paragraph.get("sentences"),
+            full_transcription=paragraph_text(paragraph),
+        )
+        for paragraph in paragraphs_data or []
+    ]
+
+
+def kept_paragraph_fields(clip):
+    """Returns what was added to the clip's paragraphs since they were built.
+
+    Speaker renames and embeddings, keyed on each paragraph's start, end and
+    text, so :func:`restore_paragraph_fields` can carry them over to rebuilt
+    paragraphs that come out the same.
+    """
+    rows = ClipParagraph.objects.filter(clip=clip).values_list(
+        "start",
+        "end",
+        "full_transcription",
+        "speaker",
+        "embedding",
+    )
+    return {
+        (start, end, text): {"speaker": speaker, "embedding": embedding}
+        for start, end, text, speaker, embedding in rows
+    }
+
+
+def restore_paragraph_fields(paragraphs, kept):
+    for paragraph in paragraphs:
+        key = (paragraph.start, paragraph.end, paragraph.full_transcription)
+        if (fields := kept.get(key)) is not None:
+            paragraph.speaker = fields["speaker"]
+            paragraph.embedding = fields["embedding"]
+    return paragraphs
+
+
+def copy_paragraphs(paragraphs):
+    """Streams rows into the paragraph table with ``COPY ... FROM STDIN``.
+
+    Unlike ``bulk_create`` this does not set the primary keys on ``paragraphs``.
+    """
+    statement = sql.SQL("COPY {table} ({columns}) FROM STDIN").format(
+        table=sql.Identifier(ClipParagraph._meta.db_table),  # noqa: SLF001
+        columns=sql.SQL(", ").join(map(sql.Identifier, PARAGRAPH_COPY_COLUMNS)),
+    )
+    embedding_field = ClipParagraph._meta.get_field("embedding")  # noqa: SLF001
+    with connection.cursor() as cursor, cursor.cursor.copy(statement) as copy:
+        for paragraph in paragraphs:
+            copy.write_row(
+                (
+                    paragraph.clip_id,
+                    paragraph.start,
+                    paragraph.end,
+                    paragraph.speaker,
+                    None if paragraph.sentences is None else Jsonb(paragraph.sentences),
+                    paragraph.full_transcription,
+                    # The vector's text form, which COPY parses like a literal
+                    embedding_field.get_db_prep_value(paragraph.embedding, connection),
+                ),
+            )
+
+
+def save_paragraphs(paragraphs, copy_threshold=COPY_THRESHOLD):
+    with transaction.atomic():
+        if len(paragraphs) >= copy_threshold:
+            copy_paragraphs(paragraphs)
+        else:
+            ClipParagraph.objects.bulk_create(paragraphs, batch_size=BULK_BATCH_SIZE)
+    return paragraphs
+
+
+def save_chapters(chapters):
+    for chapter in chapters:
+        chapter.render_summary()
+    with transaction.atomic():
+        chapters = Chapter.objects.bulk_create(chapters, batch_size=BULK_BATCH_SIZE)
+        bump_page_versions({chapter.clip_id for chapter in chapters})
+    return chapters
+
+
+def bump_page_versions(clip_ids):
+    """Retires the cached pages of these clips."""
+    Clip.objects.filter(id__in=clip_ids).bump_page_versions()
+
+
+def save_page_payload(clip_id):
+    """Rebuilds and returns the paragraphs the clip page shows, as JSON.
+
+    Call it after anything that changes a clip's paragraphs, so the page can
+    serve them without querying and serializing them again.
+    """
+    with transaction.atomic():
+        # Concurrent speaker edits rebuild one at a time, each seeing the
+        # edits committed before it
+        Clip.objects.select_for_update().filter(id=clip_id).values("id").first()
+        paragraphs = (
+            ClipParagraph.objects.filter(clip_id=clip_id)
+            .order_by("start")
+            .values(*PAGE_PARAGRAPH_FIELDS)
+        )
+        payload = json.dumps(
+            [
+                {
+                    **paragraph,
+                    "start": math.floor(paragraph["start"]),
+                    "end": math.ceil(paragraph["end"]),
+                }
+                for paragraph in paragraphs
+            ],
+        )
+        Clip.objects.filter(id=clip_id).bump_page_versions(page_payload=payload)
+    return payload
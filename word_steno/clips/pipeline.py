@@ -0,0 +1,138 @@
+import logging
+import queue
+import statistics
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    """One step of a :func:`run_pipeline` run.
+
+    ``func`` receives the previous stage's output. Returning ``None`` drops the
+    item, and so does raising, after the error has been recorded.
+    """
+
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+
+
+@dataclass
+class StageStats:
+    name: str
+    durations: list[float] = field(default_factory=list)
+    failures: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, seconds, *, failed=False):
+        with self.lock:
+            self.durations.append(seconds)
+            if failed:
+                self.failures += 1
+
+    def summary(self):
+        if not self.durations:
+            return f"{self.name}: no items"
+        durations = sorted(self.durations)
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        return (
+            f"{self.name}: {len(durations)} items, {self.failures} failed, "
+            f"mean {statistics.fmean(durations):.2f}s, "
+            f"p50 {statistics.median(durations):.2f}s, "
+            f"p95 {p95:.2f}s, max {durations[-1]:.2f}s"
+        )
+
+
+def limited(semaphore, func):
+    """Wraps ``func`` so no more than the semaphore allows run at once."""
+
+    def wrapper(item):
+        with semaphore:
+            return func(item)
+
+    return wrapper
+
+
+def _report(on_error, stage, item, error):
+    try:
+        on_error(stage.name, item, error)
+    except Exception:
+        # A failing handler must not take the worker down with it
+        logger.exception("Exception: pipeline error handler for %s.", stage.name)
+
+
+def _work(stage, stats, inbox, emit, on_error):
+    item = None
+    try:
+        while (item := inbox.get()) is not _DONE:
+            started = time.monotonic()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                stats.add(time.monotonic() - started, failed=True)
+                logger.exception("Exception: pipeline stage %s.", stage.name)
+                if on_error:
+                    _report(on_error, stage, item, e)
+                continue
+            stats.add(time.monotonic() - started)
+            if result is not None:
+                emit(result)
+    finally:
+        # Each thread gets its own database connection from Django
+        connection.close()
+        # Should the worker die anyway, keep taking items until the end of the
+        # stream, so the stage before it never blocks on a full queue
+        while item is not _DONE:
+            item = inbox.get()
+
+
+def run_pipeline(items, stages, queue_size=4, on_error=None):
+    """Streams ``items`` through ``stages``, each running on its own threads.
+
+    Stages are connected by queues of ``queue_size``, so a fast stage can only
+    run that far ahead of a slow one. Returns ``(outputs, stats)``: what came
+    out of the last stage and a :class:`StageStats` per stage.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stats = [StageStats(stage.name) for stage in stages]
+    outputs = []
+    emitters = [q.put for q in queues[1:]] + [outputs.append]
+
+    threads = [
+        [
+            threading.Thread(
+                target=_work,
+                args=(stage, stats[index], queues[index], emitters[index], on_error),
+                daemon=True,
+            )
+            for _ in range(stage.workers)
+        ]
+        for index, stage in enumerate(stages)
+    ]
+    for stage_threads in threads:
+        for thread in stage_threads:
+            thread.start()
+
+    for item in items:
+        queues[0].put(item)
+
+    # Drain the stages in order: once every worker of a stage has exited,
+    # nothing more can reach the next one.
+    for index, stage_threads in enumerate(threads):
+        for _ in stage_threads:
+            queues[index].put(_DONE)
+        for thread in stage_threads:
+            thread.join()
+
+    return outputs, stats
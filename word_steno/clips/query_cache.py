@@ -0,0 +1,91 @@
+"""Search query embeddings, cached so popular queries are only encoded once.
+
+The first tier is an LRU in each process; the second is the Django cache,
+Redis in production, shared by every worker. Both hold float16 bytes, half
+the size of the float32 vectors, which is well within the precision that
+ranking by distance needs.
+"""
+
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from django.core.cache import caches
+
+from .metrics import CacheStats
+
+KEY_PREFIX = "query-embedding"
+
+
+def normalize_query(query):
+    """Folds queries that differ only in whitespace or Unicode form together."""
+    return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+class QueryEmbeddingCache:
+    """Query vectors keyed on the model and the normalized query text."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        encode,
+        model_id,
+        max_entries=1024,
+        timeout=None,
+        cache_alias="default",
+        clock=time.perf_counter,
+    ):
+        self.encode = encode
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        self.clock = clock
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = CacheStats("encode", hits=("local_hits", "shared_hits"))
+
+    def key(self, text):
+        digest = hashlib.sha256(f"{self.model_id}\0{text}".encode()).hexdigest()
+        return f"{KEY_PREFIX}:{digest}"
+
+    def _remember(self, key, data):
+        with self.lock:
+            self.local[key] = data
+            self.local.move_to_end(key)
+            while len(self.local) > self.max_entries:
+                self.local.popitem(last=False)
+
+    def get(self, query):
+        """Returns the float32 embedding of ``query``, encoding it only on a miss."""
+        text = normalize_query(query)
+        key = self.key(text)
+
+        with self.lock:
+            data = self.local.get(key)
+            if data is not None:
+                self.local.move_to_end(key)
+        if data is not None:
+            self.stats.hit("local_hits")
+        else:
+            data = caches[self.cache_alias].get(key)
+            if data is not None:
+                self.stats.hit("shared_hits")
+                self._remember(key, data)
+        if data is None:
+            started = self.clock()
+            vector = np.asarray(self.encode([text])[0], dtype=np.float32)
+            self.stats.miss(self.clock() - started)
+            data = vector.astype(np.float16).tobytes()
+            caches[self.cache_alias].set(key, data, self.timeout)
+            self._remember(key, data)
+
+        return np.frombuffer(data, dtype=np.float16).astype(np.float32)
+
+    def metrics(self):
+        """Returns this process's hit ratio and the encode time its hits saved."""
+        with self.lock:
+            entries = len(self.local)
+        return {**self.stats.summary(), "local_entries": entries}
@@ -0,0 +1,215 @@
+"""Hybrid search: full-text and vector search fused by reciprocal rank.
+
+Each side returns at most a fixed number of candidate paragraph ids, so the
+cost of a search does not grow with the corpus beyond what the indexes do.
+The two run concurrently, vector search on a shared pool thread that keeps
+its database connection, and their rankings are fused with weighted
+reciprocal rank fusion, which needs no score calibration between them.
+"""
+
+import functools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
+from django.contrib.postgres.search import SearchRank
+from django.db import close_old_connections
+from django.db.models import F
+from django.db.models import FloatField
+from django.db.models import Q
+from django.db.models import Window
+from django.db.models.functions import Cast
+from django.db.models.functions import RowNumber
+
+from .embeddings import get_query_cache
+from .embeddings import search_vectors
+from .models import ClipParagraph
+
+
+def encode_cursor(best_rank, clip_id):
+    return f"{best_rank!r}_{clip_id}"
+
+
+def decode_cursor(cursor):
+    """Returns ``(best_rank, clip_id)``, or ``None`` for a missing or bad cursor."""
+    try:
+        best_rank, clip_id = cursor.split("_")
+        return float(best_rank), int(clip_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def fulltext_page(
+    query,
+    after=None,
+    clips_per_page=None,
+    paragraphs_per_clip=None,
+    candidates=None,
+):
+    """Returns one page of full-text matches grouped by clip, and the next cursor.
+
+    Clips are ordered by their best paragraph's rank, then id, and the page is
+    the ``clips_per_page`` clips after the ``after`` cursor. Only the
+    ``candidates`` best paragraphs after the cursor are sorted and grouped, so
+    a later page costs no more than the first; a page is cut short when they
+    hold fewer clips than that, and the next carries on from where it ends.
+    Each group holds the clip's ``paragraphs_per_clip`` best paragraphs, best
+    first, picked by Postgres.
+    """
+    if clips_per_page is None:
+        clips_per_page = settings.CLIPS_SEARCH_CLIPS_PER_PAGE
+    if paragraphs_per_clip is None:
+        paragraphs_per_clip = settings.CLIPS_SEARCH_PARAGRAPHS_PER_CLIP
+    if candidates is None:
+        candidates = settings.CLIPS_SEARCH_PAGE_CANDIDATES
+    search_query = SearchQuery(query, config="english")
+    matches = ClipParagraph.objects.filter(search_vector=search_query)
+    rank = SearchRank(F("search_vector"), search_query)
+
+    # ts_rank returns real; as double precision the rank survives the round
+    # trip through the cursor, so the keyset comparison is exact
+    ranked = matches.annotate(paragraph_rank=Cast(rank, FloatField()))
+    if (cursor := decode_cursor(after)) is not None:
+        best_rank, clip_id = cursor
+        after_cursor = Q(paragraph_rank__lt=best_rank) | Q(
+            paragraph_rank=best_rank,
+            clip_id__lt=clip_id,
+        )
+        # A clip with any paragraph before the cursor was on an earlier page
+        ranked = ranked.filter(after_cursor).exclude(
+            clip_id__in=ranked.exclude(after_cursor).values("clip_id"),
+        )
+    rows = list(
+        ranked.order_by("-paragraph_rank", "-clip_id").values_list(
+            "clip_id",
+            "paragraph_rank",
+        )[:candidates],
+    )
+
+    # Rows come best first, so a clip's first row holds its best rank, and
+    # clips come in page order
+    best_ranks = {}
+    for row_clip_id, paragraph_rank in rows:
+        best_ranks.setdefault(row_clip_id, paragraph_rank)
+    clips = list(best_ranks.items())
+    next_cursor = None
+    if len(clips) > clips_per_page or (len(rows) == candidates and clips):
+        clips = clips[:clips_per_page]
+        next_cursor = encode_cursor(clips[-1][1], clips[-1][0])
+
+    paragraphs = (
+        matches.filter(clip_id__in=[clip_id for clip_id, _ in clips])
+        .annotate(
+            rank=rank,
+            position=Window(
+                RowNumber(),
+                partition_by=[F("clip_id")],
+                order_by=[rank.desc(), F("id")],
+            ),
+        )
+        .filter(position__lte=paragraphs_per_clip)
+        .for_results()
+        .order_by("clip_id", "position")
+    )
+    groups = {clip_id: [] for clip_id, _ in clips}
+    for paragraph in paragraphs:
+        groups[paragraph.clip_id].append(paragraph)
+    return list(groups.values()), next_cursor
+
+
+def fulltext_candidates(query, limit):
+    search_query = SearchQuery(query, config="english")
+    return list(
+        ClipParagraph.objects.annotate(
+            rank=SearchRank(F("search_vector"), search_query),
+        )
+        .filter(search_vector=search_query)
+        .order_by("-rank")
+        .values_list("id", flat=True)[:limit],
+    )
+
+
+def vector_candidates(query, limit):
+    embedding = get_query_cache().get(query)
+    return [
+        paragraph.id
+        for paragraph in search_vectors(
+            ClipParagraph.objects.only("id"),
+            embedding,
+            limit,
+            # An HNSW scan returns at most ef_search rows
+            ef_search=max(settings.CLIPS_HNSW_EF_SEARCH, limit),
+        )
+    ]
+
+
+def reciprocal_rank_fusion(rankings, weights, k=60):
+    """Returns ``(id, score)`` pairs, best first.
+
+    An id scores ``weight / (k + rank)`` in each ranking it appears in, with
+    ranks starting at 1. ``k`` damps the advantage of the very top ranks.
+    """
+    scores = defaultdict(float)
+    for ranking, weight in zip(rankings, weights, strict=True):
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += weight / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+
+@functools.cache
+def get_executor():
+    # Shared by every search, so its threads and their connections outlive
+    # each request
+    return ThreadPoolExecutor(
+        max_workers=settings.CLIPS_SEARCH_THREADS,
+        thread_name_prefix="search",
+    )
+
+
+def _in_thread(func, *args):
+    # Drop the thread's connection if it has failed or is older than
+    # CONN_MAX_AGE, the way Django does around each request
+    close_old_connections()
+    return func(*args)
+
+
+def hybrid_search(query, limit=None, fulltext_weight=None, vector_weight=None):
+    """Returns up to ``limit`` paragraphs, each with its fused score as ``rank``.
+
+    Weights default to ``CLIPS_SEARCH_FULLTEXT_WEIGHT`` and
+    ``CLIPS_SEARCH_VECTOR_WEIGHT``; a weight of 0 leaves that side out.
+    """
+    limit = limit or settings.CLIPS_SEARCH_CANDIDATES
+    if fulltext_weight is None:
+        fulltext_weight = settings.CLIPS_SEARCH_FULLTEXT_WEIGHT
+    if vector_weight is None:
+        vector_weight = settings.CLIPS_SEARCH_VECTOR_WEIGHT
+    weights = [fulltext_weight, vector_weight]
+
+    # Vector search runs on a pool thread while full-text search runs here
+    vector_future = None
+    if vector_weight:
+        vector_future = get_executor().submit(
+            _in_thread,
+            vector_candidates,
+            query,
+            limit,
+        )
+    rankings = [
+        fulltext_candidates(query, limit) if fulltext_weight else [],
+        vector_future.result() if vector_future else [],
+    ]
+
+    fused = reciprocal_rank_fusion(rankings, weights, k=settings.CLIPS_SEARCH_RRF_K)
+    fused = fused[:limit]
+    paragraphs = ClipParagraph.objects.for_results().in_bulk(
+        [paragraph_id for paragraph_id, _ in fused],
+    )
+    results = []
+    for paragraph_id, score in fused:
+        # Skip paragraphs deleted since the candidates were found
+        if (paragraph := paragraphs.get(paragraph_id)) is not None:
+            paragraph.rank = score
+            results.append(paragraph)
+    return results
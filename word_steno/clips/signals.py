@@ -0,0 +1,47 @@
+"""Keeps each channel's precomputed stats in step with its clips.
+
+Receivers rather than overrides of ``Clip.save()`` and ``Clip.delete()``, so
+clips deleted in bulk, as the admin and the delete view do, are counted too.
+"""
+
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from .models import Channel
+from .models import Clip
+
+# The fields of a clip that its channel's stats are computed from
+STATS_FIELDS = {"channel", "channel_id", "length", "published_at"}
+
+
+def changes_stats(update_fields):
+    return update_fields is None or bool(STATS_FIELDS & set(update_fields))
+
+
+@receiver(pre_save, sender=Clip)
+def remember_stored_channel(sender, instance, update_fields=None, **kwargs):
+    # A clip moved to another channel changes the stats of both
+    instance._stored_channel_id = None  # noqa: SLF001
+    if instance.pk is not None and changes_stats(update_fields):
+        instance._stored_channel_id = (  # noqa: SLF001
+            Clip.objects.filter(pk=instance.pk)
+            .values_list("channel_id", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Clip)
+def refresh_channel_stats_on_save(sender, instance, update_fields=None, **kwargs):
+    if not changes_stats(update_fields):
+        return
+    channel_ids = {instance._stored_channel_id, instance.channel_id} - {None}  # noqa: SLF001
+    if channel_ids:
+        Channel.refresh_stats(channel_ids)
+
+
+@receiver(post_delete, sender=Clip)
+def refresh_channel_stats_on_delete(sender, instance, **kwargs):
+    if instance.channel_id is not None:
+        Channel.refresh_stats([instance.channel_id])
@@ -0,0 +1,254 @@
+"""Where clip audio is stored.
+
+:func:`get_storage` returns one backend per process. The S3 backend keeps a
+single thread-safe client, so credentials are resolved and connections pooled
+once instead of on every upload or presigned URL. Set
+``CLIPS_STORAGE_BACKEND = "local"`` to keep everything on disk, or point
+``DJANGO_AWS_S3_ENDPOINT_URL`` at MinIO, to run the pipeline without AWS.
+"""
+
+import functools
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+# S3 rejects multipart parts smaller than 5 MB, except for the last one
+S3_PART_SIZE = 8 * 1024 * 1024
+S3_MAX_PARTS_IN_FLIGHT = 4
+
+
+class S3Storage:
+    def __init__(  # noqa: PLR0913
+        self,
+        bucket_name,
+        region_name=None,
+        endpoint_url=None,
+        access_key_id=None,
+        secret_access_key=None,
+        max_pool_connections=10,
+        client=None,
+    ):
+        self.bucket_name = bucket_name
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        # boto3 clients are thread-safe, sessions are not, so the client gets a
+        # session of its own
+        self.client = client or boto3.session.Session().client(
+            "s3",
+            region_name=region_name,
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            config=Config(max_pool_connections=max_pool_connections),
+        )
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.AWS_STORAGE_BUCKET_NAME,
+            region_name=settings.AWS_S3_REGION_NAME,
+            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+            access_key_id=settings.AWS_ACCESS_KEY_ID,
+            secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS,
+        )
+
+    def url(self, key):
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket_name}/{key}"
+        return f"https://{self.bucket_name}.s3.{self.region_name}.amazonaws.com/{key}"
+
+    def upload(self, fileobj, key):
+        self.client.upload_fileobj(fileobj, self.bucket_name, key)
+        return key
+
+    def stream_upload(
+        self,
+        chunks,
+        key,
+        part_size=S3_PART_SIZE,
+        max_parts_in_flight=S3_MAX_PARTS_IN_FLIGHT,
+    ):
+        """Uploads an iterable of byte chunks while it is still being produced.
+
+        Chunks are gathered into ``part_size`` parts and each part is uploaded
+        on a background thread as soon as it is full. At most
+        ``max_parts_in_flight`` parts wait for S3 at once, so memory stays
+        around ``(max_parts_in_flight + 1) * part_size`` however long the audio
+        is.
+        """
+        upload = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=key)
+        slots = threading.BoundedSemaphore(max_parts_in_flight)
+
+        def upload_part(part_number, body):
+            try:
+                response = self.client.upload_part(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    UploadId=upload["UploadId"],
+                    PartNumber=part_number,
+                    Body=body,
+                )
+            finally:
+                slots.release()
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+        def submit(executor, futures, body):
+            slots.acquire()
+            futures.append(executor.submit(upload_part, len(futures) + 1, body))
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_parts_in_flight) as executor:
+                futures = []
+                part = bytearray()
+                for chunk in chunks:
+                    part += chunk
+                    while len(part) >= part_size:
+                        submit(executor, futures, bytes(part[:part_size]))
+                        del part[:part_size]
+                # The last part is the only one allowed to be smaller than part_size
+                if part or not futures:
+                    submit(executor, futures, bytes(part))
+                parts = [future.result() for future in futures]
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload["UploadId"],
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload["UploadId"],
+            )
+            raise
+        return key
+
+    def presign(self, key, expiration=3600):
+        """Returns a URL granting read access to ``key`` for ``expiration`` seconds."""
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket_name, "Key": key},
+            ExpiresIn=expiration,
+        )
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def read(self, key):
+        """Returns the object's bytes, or ``None`` if there is no such object."""
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response["Body"].read()
+
+    def write(self, key, data):
+        self.client.put_object(Bucket=self.bucket_name, Key=key, Body=data)
+        return key
+
+    def move(self, source_key, key):
+        # The managed copy switches to a multipart copy for objects over 5 GB
+        self.client.copy(
+            {"Bucket": self.bucket_name, "Key": source_key},
+            self.bucket_name,
+            key,
+        )
+        self.delete(source_key)
+        return key
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket_name, Key=key)
+
+
+class LocalStorage:
+    """Stores objects as files under ``root`` and serves them from ``base_url``."""
+
+    def __init__(self, root, base_url):
+        self.root = Path(root)
+        self.base_url = base_url
+
+    @classmethod
+    def from_settings(cls):
+        return cls(settings.CLIPS_STORAGE_LOCAL_ROOT, settings.CLIPS_STORAGE_LOCAL_URL)
+
+    def path(self, key):
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            msg = f"{key} is outside of the storage root."
+            raise ValueError(msg)
+        return path
+
+    def url(self, key):
+        return urljoin(self.base_url, key)
+
+    def upload(self, fileobj, key):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as file:
+            shutil.copyfileobj(fileobj, file)
+        return key
+
+    def stream_upload(self, chunks, key, **kwargs):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+        return key
+
+    def presign(self, key, expiration=3600):
+        return self.url(key)
+
+    def exists(self, key):
+        return self.path(key).exists()
+
+    def read(self, key):
+        try:
+            return self.path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key, data):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return key
+
+    def move(self, source_key, key):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path(source_key).replace(path)
+        return key
+
+    def delete(self, key):
+        self.path(key).unlink(missing_ok=True)
+
+
+BACKENDS = {
+    "s3": S3Storage,
+    "local": LocalStorage,
+}
+
+
+@functools.cache
+def get_storage():
+    """Returns the storage backend shared by every thread in this process."""
+    return BACKENDS[settings.CLIPS_STORAGE_BACKEND].from_settings()
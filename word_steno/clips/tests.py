@@ -1 +1,946 @@
-# Create your tests here.
+import hashlib
+import json
+import threading
+import time
+from datetime import UTC
+from datetime import datetime
+from datetime import timedelta
+from http import HTTPStatus
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.db import connection
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Cast
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from word_steno.clips.embedding_service import EmbeddingClient
+from word_steno.clips.embedding_service import EmbeddingServer
+from word_steno.clips.embedding_service import MicroBatcher
+from word_steno.clips.embeddings import HammingDistance
+from word_steno.clips.embeddings import build_summary_prompt
+from word_steno.clips.embeddings import encode_batched
+from word_steno.clips.embeddings import nearest
+from word_steno.clips.ingest import MAX_ATTEMPTS
+from word_steno.clips.ingest import STALE_JOB_TIMEOUT
+from word_steno.clips.ingest import IngestError
+from word_steno.clips.ingest import claim_next_job
+from word_steno.clips.ingest import enqueue
+from word_steno.clips.ingest import heartbeat
+from word_steno.clips.ingest import reprocess_clip
+from word_steno.clips.ingest import reuse_summaries
+from word_steno.clips.ingest import run_job
+from word_steno.clips.ingest import save_transcription
+from word_steno.clips.llm import RateLimiter
+from word_steno.clips.llm import complete
+from word_steno.clips.models import BitStringField
+from word_steno.clips.models import Channel
+from word_steno.clips.models import Chapter
+from word_steno.clips.models import Clip
+from word_steno.clips.models import ClipParagraph
+from word_steno.clips.models import ClipWords
+from word_steno.clips.models import IngestJob
+from word_steno.clips.models import SummaryCache
+from word_steno.clips.models import TranscriptArchive
+from word_steno.clips.models import binary_quantize
+from word_steno.clips.models import decode_published_cursor
+from word_steno.clips.models import encode_published_cursor
+from word_steno.clips.models import pack_words
+from word_steno.clips.page_cache import CSRF_PLACEHOLDER
+from word_steno.clips.page_cache import ClipPageCache
+from word_steno.clips.page_cache import with_csrf_token
+from word_steno.clips.persistence import build_paragraphs
+from word_steno.clips.pipeline import Stage
+from word_steno.clips.pipeline import limited
+from word_steno.clips.pipeline import run_pipeline
+from word_steno.clips.query_cache import QueryEmbeddingCache
+from word_steno.clips.search import decode_cursor
+from word_steno.clips.search import encode_cursor
+from word_steno.clips.search import fulltext_page
+from word_steno.clips.search import reciprocal_rank_fusion
+from word_steno.clips.storage import LocalStorage
+from word_steno.clips.storage import S3Storage
+from word_steno.clips.utils import assign_paragraphs
+from word_steno.clips.utils import buffer_audio
+from word_steno.clips.utils import download_audio
+from word_steno.clips.utils import extract_chapters
+from word_steno.clips.youtube import VideoUnavailableError
+from word_steno.clips.youtube import get_video_metadata
+from word_steno.clips.youtube import parse_player_response
+
+
+def test_run_pipeline_passes_items_through_every_stage():
+    stages = [
+        Stage("double", lambda n: n * 2, workers=3),
+        Stage("increment", lambda n: n + 1, workers=2),
+    ]
+
+    outputs, stats = run_pipeline(range(10), stages, queue_size=1)
+
+    assert sorted(outputs) == [n * 2 + 1 for n in range(10)]
+    assert [len(s.durations) for s in stats] == [10, 10]
+
+
+def test_run_pipeline_drops_skipped_and_failed_items():
+    errors = []
+    failing = 3
+
+    def check(n):
+        if n == failing:
+            msg = "boom"
+            raise ValueError(msg)
+        return n if n % 2 else None
+
+    outputs, stats = run_pipeline(
+        range(6),
+        [Stage("check", check), Stage("noop", lambda n: n)],
+        on_error=lambda stage, item, error: errors.append((stage, item)),
+    )
+
+    assert sorted(outputs) == [1, 5]
+    assert errors == [("check", failing)]
+    assert stats[0].failures == 1
+
+
+def test_run_pipeline_survives_a_failing_error_handler():
+    def on_error(stage, item, error):
+        msg = "handler failed"
+        raise RuntimeError(msg)
+
+    def fail(n):
+        msg = "boom"
+        raise ValueError(msg)
+
+    # With one slot per queue, a dead worker would leave the feed blocked
+    outputs, stats = run_pipeline(
+        range(10),
+        [Stage("fail", fail), Stage("noop", lambda n: n)],
+        queue_size=1,
+        on_error=on_error,
+    )
+
+    assert outputs == []
+    assert stats[0].failures == 10  # noqa: PLR2004
+
+
+def test_limited_caps_concurrency():
+    concurrency = 2
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def track(n):
+        with lock:
+            running.append(n)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(n)
+        return n
+
+    run_pipeline(
+        range(20),
+        [
+            Stage(
+                "track",
+                limited(threading.BoundedSemaphore(concurrency), track),
+                workers=8,
+            ),
+        ],
+    )
+
+    assert max(peak) <= concurrency
+
+
+PLAYER_RESPONSE_LENGTH = 3725
+AUDIO_ITAG = 140
+PLAYER_RESPONSE = {
+    "playabilityStatus": {"status": "OK"},
+    "videoDetails": {
+        "videoId": "abc123",
+        "title": "An episode",
+        "lengthSeconds": "3725",
+        "author": "A channel",
+        "shortDescription": "Intro\n0:00 Welcome\n(12:30) Guests\n1:01:05 - Wrap up",
+    },
+    "microformat": {"playerMicroformatRenderer": {"publishDate": "2024-02-01"}},
+    "streamingData": {
+        "adaptiveFormats": [
+            {"itag": 137, "mimeType": "video/mp4", "url": "https://v"},
+            {
+                "itag": 140,
+                "mimeType": 'audio/mp4; codecs="mp4a.40.2"',
+                "bitrate": 130000,
+                "contentLength": "1000",
+                "url": "https://a?expire=4102444800",
+            },
+            {"itag": 251, "mimeType": "audio/webm", "signatureCipher": "s=..."},
+        ],
+    },
+}
+
+
+def test_get_video_metadata_parses_the_watch_page_once(settings, tmp_path):
+    settings.YOUTUBE_METADATA_CACHE_DIR = str(tmp_path)
+    watch_html = f"<script>var ytInitialPlayerResponse = {json.dumps(PLAYER_RESPONSE)};"
+    calls = []
+
+    def fetch(video_id):
+        calls.append(video_id)
+        return watch_html
+
+    with patch("word_steno.clips.youtube.fetch_watch_html", fetch):
+        metadata = get_video_metadata("abc123")
+        cached = get_video_metadata("abc123")
+
+    assert calls == ["abc123"]
+    assert cached == metadata
+    assert metadata.length == PLAYER_RESPONSE_LENGTH
+    assert metadata.channel_title == "A channel"
+    assert metadata.publish_date.isoformat() == "2024-02-01T00:00:00+00:00"
+    assert metadata.chapters == [
+        {"start": 0, "title": "Welcome"},
+        {"start": 750, "title": "Guests"},
+        {"start": 3665, "title": "Wrap up"},
+    ]
+    assert [s.itag for s in metadata.audio_streams] == [140, 251]
+    assert metadata.audio_stream.itag == AUDIO_ITAG
+
+
+def test_get_video_metadata_raises_for_unplayable_videos(settings, tmp_path):
+    settings.YOUTUBE_METADATA_CACHE_DIR = str(tmp_path)
+    player_response = {"playabilityStatus": {"status": "ERROR", "reason": "Gone"}}
+
+    watch_html = f"ytInitialPlayerResponse = {json.dumps(player_response)};"
+
+    with (
+        patch("word_steno.clips.youtube.fetch_watch_html", return_value=watch_html),
+        pytest.raises(VideoUnavailableError, match="Gone"),
+    ):
+        get_video_metadata("abc123")
+
+
+class FakeS3:
+    def __init__(self, fail_on_part=None):
+        self.fail_on_part = fail_on_part
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+
+    def create_multipart_upload(self, **kwargs):
+        return {"UploadId": "upload"}
+
+    def upload_part(self, PartNumber, Body, **kwargs):  # noqa: N803
+        if PartNumber == self.fail_on_part:
+            msg = "part failed"
+            raise OSError(msg)
+        self.parts[PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, MultipartUpload, **kwargs):  # noqa: N803
+        self.completed = MultipartUpload["Parts"]
+
+    def abort_multipart_upload(self, **kwargs):
+        self.aborted = True
+
+
+def test_s3_stream_upload_uploads_fixed_size_parts_in_order():
+    s3 = FakeS3()
+    chunks = [b"a" * 3, b"b" * 4, b"c" * 5]
+
+    S3Storage("bucket", client=s3).stream_upload(chunks, "key", part_size=5)
+
+    assert [s3.parts[n] for n in sorted(s3.parts)] == [b"aaabb", b"bbccc", b"cc"]
+    assert s3.completed == [
+        {"PartNumber": n, "ETag": f"etag-{n}"} for n in sorted(s3.parts)
+    ]
+
+
+def test_s3_stream_upload_aborts_when_a_part_fails():
+    s3 = FakeS3(fail_on_part=2)
+
+    with pytest.raises(OSError, match="part failed"):
+        S3Storage("bucket", client=s3).stream_upload([b"x" * 12], "key", part_size=5)
+
+    assert s3.aborted
+    assert s3.completed is None
+
+
+def test_local_storage_round_trip(tmp_path):
+    storage = LocalStorage(tmp_path, "/media/")
+
+    key = storage.stream_upload([b"abc", b"def"], "clips/episode.mp3")
+
+    assert (tmp_path / "clips" / "episode.mp3").read_bytes() == b"abcdef"
+    assert storage.presign(key) == "/media/clips/episode.mp3"
+    storage.delete(key)
+    assert not (tmp_path / "clips" / "episode.mp3").exists()
+    with pytest.raises(ValueError, match="outside"):
+        storage.path("../escape.mp3")
+
+
+def test_download_audio_stores_identical_audio_once(tmp_path):
+    storage = LocalStorage(tmp_path, "/media/")
+    metadata = parse_player_response("abc123", PLAYER_RESPONSE)
+    downloads = []
+
+    def iter_audio_chunks(metadata):
+        downloads.append(metadata.video_id)
+        yield b"a" * 600
+        yield b"b" * 400
+
+    with (
+        patch("word_steno.clips.utils.get_storage", return_value=storage),
+        patch("word_steno.clips.utils.iter_audio_chunks", iter_audio_chunks),
+    ):
+        first = download_audio(metadata)
+        second = download_audio(metadata)
+
+    sha256 = hashlib.sha256(b"a" * 600 + b"b" * 400).hexdigest()
+    assert first["object_name"] == f"clips/abc123/{sha256}.mp3"
+    assert second == first
+    assert downloads == ["abc123"]
+    assert sorted(p.name for p in (tmp_path / "clips" / "abc123").iterdir()) == [
+        f"{sha256}.mp3",
+        "manifest.json",
+    ]
+
+
+def test_download_audio_uploads_buffered_audio(tmp_path):
+    storage = LocalStorage(tmp_path, "/media/")
+    metadata = parse_player_response("abc123", PLAYER_RESPONSE)
+    audio_chunks = [b"a" * 600, b"b" * 400]
+
+    with patch(
+        "word_steno.clips.utils.iter_audio_chunks",
+        return_value=iter(audio_chunks),
+    ) as iter_audio_chunks:
+        audio = buffer_audio(metadata)
+    with (
+        audio,
+        patch("word_steno.clips.utils.get_storage", return_value=storage),
+    ):
+        details = download_audio(metadata, audio)
+
+    assert iter_audio_chunks.call_count == 1
+    assert storage.read(details["object_name"]) == b"".join(audio_chunks)
+
+
+def test_transcript_archive_options_key_ignores_key_order():
+    assert TranscriptArchive.options_key_for(
+        {"model": "nova-2", "paragraphs": True},
+    ) == TranscriptArchive.options_key_for({"paragraphs": True, "model": "nova-2"})
+
+
+def test_reuse_summaries_only_reuses_unchanged_chapters():
+    prompt = build_summary_prompt("Hello there.", ["0"], "Intro")
+    chapter = Chapter(
+        title="Intro",
+        chapter_transcription="Hello there.",
+        prompt=prompt,
+        summary="A greeting.",
+    )
+    summarize = reuse_summaries([chapter])
+
+    assert summarize("Hello there.", ["0"], "Intro") == {
+        "summary": "A greeting.",
+        "prompt": prompt,
+    }
+    # Renaming a speaker changes the prompt but not what the chapter says
+    assert summarize("Hello there.", ["Alice"], "Intro")["summary"] == "A greeting."
+    changed = summarize("Something else.", ["0"], "Intro")
+    assert changed["summary"] == ""
+    assert "--summarize-missing" in changed["error"]
+
+
+def test_build_paragraphs_joins_sentences():
+    clip = Clip(id=1)
+    paragraphs = build_paragraphs(
+        [
+            {
+                "start": 0.0,
+                "end": 4.0,
+                "speaker": 0,
+                "sentences": [{"text": "Hello."}, {"text": "How are you?"}],
+            },
+            {"start": 4.0, "end": 5.0, "speaker": 1, "sentences": None},
+        ],
+        clip,
+    )
+
+    assert [p.full_transcription for p in paragraphs] == ["Hello. How are you? ", ""]
+    assert all(p.pk is None and p.clip_id == 1 for p in paragraphs)
+
+
+def test_rate_limiter_waits_for_the_bucket_to_refill():
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    limiter = RateLimiter(60, 1000, clock=lambda: now[0], sleep=sleep)
+    limiter.acquire(600)
+    assert now[0] == 0
+    # 200 more tokens than are left refill at 1000 per minute
+    limiter.acquire(600)
+    assert now[0] == pytest.approx(12)
+
+
+def test_extract_chapters_records_failed_summaries(settings):
+    settings.CLIPS_SUMMARY_CONCURRENCY = 4
+    clip = Clip(id=1, length=120, description="0:00 Intro\n1:00 Main topic")
+    paragraphs = [
+        {"start": 0.0, "speaker": 0, "full_transcription": "Welcome. "},
+        {"start": 70.0, "speaker": 1, "full_transcription": "Let us begin. "},
+    ]
+
+    def summarize(aggregated_text, speakers, topic):
+        if topic == "Intro":
+            msg = "rate limited"
+            raise RuntimeError(msg)
+        return {"summary": f"About {topic}", "prompt": aggregated_text}
+
+    with patch("word_steno.clips.utils.save_chapters", side_effect=lambda rows: rows):
+        intro, main = extract_chapters(paragraphs, clip, summarize=summarize)
+
+    assert (intro.summary, intro.summary_error) == ("", "rate limited")
+    assert "Welcome." in intro.prompt
+    assert (main.summary, main.summary_error) == ("About Main topic", "")
+
+
+def test_complete_reads_the_summary_cache_first():
+    with (
+        patch.object(SummaryCache, "lookup", return_value="Cached.") as lookup,
+        patch("word_steno.clips.llm.request_completion") as request_completion,
+    ):
+        assert complete("Summarize this.") == "Cached."
+    lookup.assert_called_once()
+    request_completion.assert_not_called()
+
+    with (
+        patch.object(SummaryCache, "lookup", return_value=None),
+        patch.object(SummaryCache, "store") as store,
+        patch("word_steno.clips.llm.request_completion", return_value="Fresh."),
+    ):
+        assert complete("Summarize this.") == "Fresh."
+    assert store.call_args.args[1:3] == ("Summarize this.", "Fresh.")
+
+
+def test_summary_cache_key_depends_on_model_and_prompt():
+    key = SummaryCache.key_for("gpt-3.5-turbo-0125", "Summarize this.")
+    assert key == SummaryCache.key_for("gpt-3.5-turbo-0125", "Summarize this.")
+    assert key != SummaryCache.key_for("gpt-4", "Summarize this.")
+    assert key != SummaryCache.key_for("gpt-3.5-turbo-0125", "Summarize that.")
+
+
+def test_assign_paragraphs_uses_half_open_chapter_ranges():
+    paragraphs = [
+        {"start": start, "speaker": 0, "full_transcription": str(start)}
+        for start in (70.0, 5.0, 0.0, 60.0, 130.0)
+    ]
+    chapters = [{"start": 10}, {"start": 60}, {"start": 100}]
+
+    assign_paragraphs(paragraphs, chapters, 120)
+
+    assert [[p["start"] for p in c["paragraphs"]] for c in chapters] == [
+        [],
+        [60.0, 70.0],
+        [],
+    ]
+    assert chapters[1]["chapter_transcription"] == (
+        "Speaker: 0\n60.0\n\nSpeaker: 0\n70.0"
+    )
+    assert chapters[1]["speakers"] == "'0'"
+
+
+def test_encode_batched_groups_similar_lengths_and_keeps_order():
+    batches = []
+
+    class FakeModel:
+        def encode(self, texts, **kwargs):
+            batches.append(texts)
+            return [len(text) for text in texts]
+
+    texts = ["a" * 5, "a", "a" * 9, "a" * 2]
+    with patch("word_steno.clips.embeddings.get_model", return_value=FakeModel()):
+        assert encode_batched(texts, batch_size=2) == [5, 1, 9, 2]
+    assert batches == [["a", "aa"], ["a" * 5, "a" * 9]]
+
+
+def test_embedding_server_batches_concurrent_requests():
+    def encode(texts):
+        return [[float(len(text)), 1.0] for text in texts]
+
+    batcher = MicroBatcher(encode, max_batch_size=64, max_wait=0.2)
+    server = EmbeddingServer(("127.0.0.1", 0), batcher)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = EmbeddingClient(
+        f"http://127.0.0.1:{server.server_address[1]}",
+        timeout=5,
+        fallback=None,
+    )
+    count = 4
+    try:
+        results = {}
+        threads = [
+            threading.Thread(
+                target=lambda n=n: results.update({n: client.encode(["a" * n])}),
+            )
+            for n in range(1, count + 1)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert {n: results[n].tolist() for n in results} == {
+        n: [[float(n), 1.0]] for n in range(1, count + 1)
+    }
+    assert batcher.stats["requests"] == count
+    assert batcher.stats["batches"] < count
+
+
+def test_embedding_client_falls_back_when_the_server_is_down():
+    client = EmbeddingClient(
+        "http://127.0.0.1:9",
+        timeout=1,
+        fallback=lambda texts: ["local"] * len(texts),
+    )
+    assert client.encode(["query"]) == ["local"]
+
+
+def test_query_embedding_cache_tiers(settings):
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+    encoded = []
+
+    def encode(texts):
+        encoded.extend(texts)
+        return [[0.5, -0.25]]
+
+    cache = QueryEmbeddingCache(encode, "model-a", max_entries=1)
+    assert cache.get("  mental   models ").tolist() == [0.5, -0.25]
+    assert cache.get("mental models").dtype == np.float32
+    # Evict the first query from the in-process tier; the shared one has it
+    cache.get("other query")
+    cache.get("mental models")
+    # The same text under another model must be encoded again
+    QueryEmbeddingCache(encode, "model-b").get("mental models")
+
+    assert encoded == ["mental models", "other query", "mental models"]
+    metrics = cache.metrics()
+    assert (metrics["local_hits"], metrics["shared_hits"], metrics["misses"]) == (
+        1,
+        1,
+        2,
+    )
+    assert metrics["hit_ratio"] == pytest.approx(0.5)
+
+
+def test_nearest_searches_at_least_top_n_candidates(settings):
+    settings.CLIPS_HNSW_EF_SEARCH = 40
+    top_n = 100
+    queryset = MagicMock()
+
+    with (
+        patch("word_steno.clips.embeddings.transaction"),
+        patch("word_steno.clips.embeddings.connection") as connection,
+    ):
+        nearest(queryset, [0.5, -0.5], top_n)
+        nearest(queryset, [0.5, -0.5], 10, ef_search=200)
+
+    cursor = connection.cursor.return_value.__enter__.return_value
+    ef_searches = [call.args[1][0] for call in cursor.execute.call_args_list]
+    assert ef_searches == [str(top_n), "200"]
+
+
+def test_reciprocal_rank_fusion_rewards_agreement_and_weights():
+    fulltext = [1, 2, 3]
+    vector = [3, 4, 1]
+
+    fused = [item for item, _ in reciprocal_rank_fusion([fulltext, vector], [1, 1])]
+    assert fused[:2] == [1, 3]
+    assert set(fused) == {1, 2, 3, 4}
+
+    vector_only = reciprocal_rank_fusion([fulltext, vector], [0, 1])
+    assert [item for item, score in vector_only if score] == [3, 4, 1]
+
+
+def test_search_cursor_round_trips_and_rejects_garbage():
+    best_rank = 0.0607927
+    clip_id = 42
+
+    assert decode_cursor(encode_cursor(best_rank, clip_id)) == (best_rank, clip_id)
+    assert decode_cursor(None) is None
+    assert decode_cursor("not-a-cursor") is None
+
+
+def test_binary_quantize_keeps_the_sign_of_each_dimension():
+    embedding = np.array([0.25, -0.5, 0.0, 1e-6], dtype=np.float32)
+    bits = binary_quantize(embedding)
+    assert bits == "1001"
+
+    query = ClipParagraph.objects.order_by(
+        HammingDistance(
+            "embedding_bits",
+            Cast(Value(bits), BitStringField(length=len(bits))),
+        ),
+    ).query
+    assert 'bit_count("clips_clipparagraph"."embedding_bits" # ' in str(query)
+    assert "::bit(4)" in str(query)
+
+
+def test_clip_load_only_reads_heavy_fields():
+    paragraphs = [{"start": 0.0, "end": 9.5, "sentences": []}]
+    clip = Clip(title="A clip", paragraphs=paragraphs)
+
+    # Loaded fields come straight off the instance, without a query
+    assert clip.load("paragraphs") == paragraphs
+    with pytest.raises(ValueError, match="title"):
+        clip.load("title")
+
+
+def test_clip_words_packs_and_slices_by_time():
+    words = [
+        {"word": "hello", "punctuated_word": "Hello", "start": 0.0, "end": 0.4},
+        {"word": "grüße", "start": 0.5, "end": 1.0, "speaker": 1},
+        {"word": "again", "punctuated_word": "again.", "start": 1.25, "end": 1.5},
+    ]
+    clip_words = ClipWords(**pack_words(words))
+
+    assert clip_words.count == len(words)
+    assert [word["word"] for word in clip_words.words()] == ["Hello", "grüße", "again."]
+    # Words are picked by when they start, from the start up to the end
+    middle = clip_words.between(0.5, 1.25)
+    assert middle == [{"word": "grüße", "start": 0.5, "end": 1.0, "speaker": 1}]
+    assert clip_words.between(5, 10) == []
+    assert clip_words.words()[0]["speaker"] == -1
+
+
+def test_chapter_renders_summary_markdown():
+    chapter = Chapter(summary="**On Topic: Sleep:**\n\n- **Speaker 1:** Naps work")
+
+    chapter.render_summary()
+
+    assert "<p><strong>On Topic: Sleep:</strong></p>" in chapter.summary_html
+    assert "<li><strong>Speaker 1:</strong> Naps work</li>" in chapter.summary_html
+
+
+def test_clip_page_cache_is_keyed_on_the_version():
+    renders = []
+
+    def render():
+        renders.append(1)
+        return {"transcript": f'<input value="{CSRF_PLACEHOLDER}">'}
+
+    versions = 2
+    cache = ClipPageCache()
+    cache.get(1, 0, render)
+    cache.get(1, 0, render)
+    # An edit bumps the version, so the next view renders afresh
+    fragments = cache.get(1, 1, render)
+
+    assert len(renders) == versions
+    assert cache.metrics()["hit_ratio"] == pytest.approx(1 / 3)
+    request = RequestFactory().get("/")
+    html = with_csrf_token(fragments, request)["transcript"]
+    assert CSRF_PLACEHOLDER not in html
+
+
+def test_channel_cursor_round_trips_with_and_without_a_date():
+    published_at = datetime(2024, 3, 1, 12, 30, tzinfo=UTC)
+    clip_id = 7
+
+    cursor = encode_published_cursor(published_at, clip_id)
+    assert decode_published_cursor(cursor) == (published_at, clip_id)
+    assert decode_published_cursor(encode_published_cursor(None, clip_id)) == (
+        None,
+        clip_id,
+    )
+    assert decode_published_cursor("yesterday_7") is None
+
+
+@pytest.mark.django_db()
+@pytest.mark.parametrize("candidates", [1000, 2])
+def test_fulltext_pages_visit_every_clip_once(candidates):
+    # Pairs of clips tie on rank, and none of the ranks is a short decimal
+    texts = [
+        "sleep",
+        "sleep",
+        "sleep and naps",
+        "sleep and naps",
+        "sleep, sleep and more sleep",
+        "naps before sleep in the afternoon",
+    ]
+    clip_ids = []
+    for index, text in enumerate(texts):
+        clip = Clip.objects.create(title=f"Clip {index}", video_id=f"video{index}")
+        ClipParagraph.objects.create(clip=clip, full_transcription=text)
+        clip_ids.append(clip.id)
+    # A weaker paragraph of an early clip must not bring it back later
+    ClipParagraph.objects.create(
+        clip_id=clip_ids[4],
+        full_transcription="a long paragraph that mentions sleep only once",
+    )
+
+    seen = []
+    cursor = None
+    while True:
+        groups, cursor = fulltext_page(
+            "sleep",
+            after=cursor,
+            clips_per_page=1,
+            candidates=candidates,
+        )
+        seen.extend(group[0].clip_id for group in groups)
+        if cursor is None:
+            break
+    assert sorted(seen) == sorted(clip_ids)
+
+
+@pytest.mark.django_db()
+def test_embed_paragraphs_also_embeds_paragraphs_below_the_checkpoint(tmp_path):
+    clip = Clip.objects.create(title="Clip")
+    below, above = (
+        ClipParagraph.objects.create(clip=clip, full_transcription=text)
+        for text in ("missed", "new")
+    )
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({"last_id": below.id}))
+    embedded = []
+
+    def embed_transcriptions(chunk, batch_size):
+        embedded.extend(paragraph.id for paragraph in chunk)
+        return len(chunk)
+
+    command = "word_steno.clips.management.commands.embed_paragraphs"
+    with (
+        patch(f"{command}.preload_model"),
+        patch(f"{command}.embed_transcriptions", embed_transcriptions),
+    ):
+        call_command("embed_paragraphs", checkpoint=checkpoint)
+
+    assert embedded == [above.id, below.id]
+    assert json.loads(checkpoint.read_text()) == {"last_id": above.id}
+
+
+@pytest.mark.django_db()
+def test_fulltext_later_pages_sort_a_bounded_candidate_set():
+    candidates = 2
+    for index in range(4):
+        clip = Clip.objects.create(title=f"Clip {index}", video_id=f"video{index}")
+        ClipParagraph.objects.create(clip=clip, full_transcription="sleep " * index)
+    _, cursor = fulltext_page("sleep", clips_per_page=1)
+
+    with CaptureQueriesContext(connection) as queries:
+        groups, _ = fulltext_page(
+            "sleep",
+            after=cursor,
+            clips_per_page=1,
+            candidates=candidates,
+        )
+    assert len(groups) == 1
+    # One query for the page's clips and one for their paragraphs
+    page_clips, _ = (query["sql"] for query in queries)
+    assert f"LIMIT {candidates}" in page_clips
+    assert "GROUP BY" not in page_clips
+
+
+@pytest.mark.django_db()
+def test_edited_chapter_shows_on_the_next_clip_page(client):
+    clip = Clip.objects.create(title="A clip", video_id="video")
+    chapter = Chapter.objects.create(clip=clip, title="Naps", start=0.0)
+    url = reverse("clips:clip", args=[clip.id])
+    assert "Naps" in client.get(url).content.decode()
+
+    chapter.title = "Afternoon naps"
+    chapter.save()
+    assert "Afternoon naps" in client.get(url).content.decode()
+
+
+@pytest.mark.django_db()
+def test_channel_stats_follow_a_reassigned_clip():
+    length = 600
+    old_channel = Channel.objects.create(title="Old channel")
+    new_channel = Channel.objects.create(title="New channel")
+    clip = Clip.objects.create(title="A clip", channel=old_channel, length=length)
+
+    clip.channel = new_channel
+    clip.save()
+    old_channel.refresh_from_db()
+    new_channel.refresh_from_db()
+    assert (old_channel.clip_count, old_channel.total_length) == (0, 0)
+    assert (new_channel.clip_count, new_channel.total_length) == (1, length)
+
+    clip.delete()
+    new_channel.refresh_from_db()
+    assert (new_channel.clip_count, new_channel.total_length) == (0, 0)
+
+
+@pytest.mark.django_db()
+def test_claim_next_job_takes_pending_and_stale_jobs():
+    url = "https://www.youtube.com/watch?v="
+    IngestJob.objects.create(video_url=url, video_id="fresh", status="running")
+    stale = IngestJob.objects.create(video_url=url, video_id="stale", status="running")
+    IngestJob.objects.filter(id=stale.id).update(
+        updated_at=timezone.now() - STALE_JOB_TIMEOUT - timedelta(minutes=1),
+    )
+    pending = IngestJob.objects.create(video_url=url, video_id="pending")
+
+    claimed = [claim_next_job(), claim_next_job()]
+    assert [job.id for job in claimed] == [stale.id, pending.id]
+    assert all(job.status == IngestJob.Status.RUNNING for job in claimed)
+    assert [job.attempts for job in claimed] == [1, 1]
+    # A running job with a recent heartbeat belongs to a live worker
+    assert claim_next_job() is None
+
+
+@pytest.mark.django_db()
+def test_run_job_retries_until_max_attempts():
+    IngestJob.objects.create(video_url="https://youtu.be/abc", video_id="abc")
+
+    with patch("word_steno.clips.ingest.ingest_video", side_effect=RuntimeError):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            job = claim_next_job()
+            assert job.attempts == attempt
+            job = run_job(job)
+            if attempt < MAX_ATTEMPTS:
+                # Retries back off rather than running again straight away
+                assert job.run_after > timezone.now()
+                assert claim_next_job() is None
+                IngestJob.objects.filter(id=job.id).update(run_after=timezone.now())
+    assert job.status == IngestJob.Status.FAILED
+    assert job.finished_at is not None
+    assert claim_next_job() is None
+
+
+@pytest.mark.django_db()
+def test_claim_next_job_fails_stale_jobs_out_of_attempts():
+    job = IngestJob.objects.create(
+        video_url="https://youtu.be/abc",
+        video_id="abc",
+        status="running",
+        attempts=MAX_ATTEMPTS,
+    )
+    IngestJob.objects.filter(id=job.id).update(
+        updated_at=timezone.now() - STALE_JOB_TIMEOUT - timedelta(minutes=1),
+    )
+
+    assert claim_next_job() is None
+    job.refresh_from_db()
+    assert job.status == IngestJob.Status.FAILED
+    assert job.finished_at is not None
+
+
+@pytest.mark.django_db()
+def test_run_job_does_not_retry_ingest_errors():
+    IngestJob.objects.create(video_url="https://youtu.be/abc", video_id="abc")
+    message = "Youtube Video is greater than 2 hours."
+
+    with patch(
+        "word_steno.clips.ingest.ingest_video",
+        side_effect=IngestError(message),
+    ):
+        job = run_job(claim_next_job())
+    assert (job.status, job.error, job.attempts) == (
+        IngestJob.Status.FAILED,
+        message,
+        1,
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_heartbeat_keeps_a_running_job_fresh():
+    job = IngestJob.objects.create(
+        video_url="https://youtu.be/abc",
+        video_id="abc",
+        status="running",
+    )
+    stale_at = timezone.now() - STALE_JOB_TIMEOUT - timedelta(minutes=1)
+    IngestJob.objects.filter(id=job.id).update(updated_at=stale_at)
+
+    with heartbeat(job, interval=timedelta(milliseconds=10)):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            job.refresh_from_db()
+            if job.updated_at > stale_at:
+                break
+            time.sleep(0.01)
+    assert job.updated_at > stale_at
+    assert claim_next_job() is None
+
+
+@pytest.mark.django_db()
+def test_download_queues_one_job_per_video(admin_client):
+    url = reverse("clips:download")
+    video_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+    responses = [admin_client.post(url, {"youtube_url": video_url}) for _ in range(2)]
+    assert [response.status_code for response in responses] == [
+        HTTPStatus.ACCEPTED,
+        HTTPStatus.ACCEPTED,
+    ]
+    job = IngestJob.objects.get()
+    assert enqueue(video_url) == job
+    # The database refuses a second active job for the video outright
+    with pytest.raises(IntegrityError), transaction.atomic():
+        IngestJob.objects.create(video_url=video_url, video_id=job.video_id)
+
+
+@pytest.mark.django_db()
+def test_reprocessing_keeps_speaker_names_and_embeddings():
+    sentence = {"text": "Hello there.", "start": 0.0, "end": 1.0}
+    response = {
+        "results": {
+            "summary": {"short": "A greeting."},
+            "channels": [
+                {
+                    "alternatives": [
+                        {
+                            "paragraphs": {
+                                "transcript": "Hello there.",
+                                "paragraphs": [
+                                    {
+                                        "start": 0.0,
+                                        "end": 1.0,
+                                        "speaker": 0,
+                                        "sentences": [sentence],
+                                    },
+                                ],
+                            },
+                            "words": [
+                                {"word": "hello", "start": 0.0, "end": 0.4},
+                                {"word": "there", "start": 0.5, "end": 1.0},
+                            ],
+                        },
+                    ],
+                },
+            ],
+        },
+    }
+    clip = Clip.objects.create(title="A clip", video_id="video")
+    TranscriptArchive.store(clip.video_id, {}, json.dumps(response))
+    save_transcription(clip, response)
+    embedding = np.where(np.arange(1024) % 3 == 0, 0.5, -0.25)
+    ClipParagraph.objects.filter(clip=clip).update(
+        speaker="Alice",
+        embedding=embedding,
+    )
+
+    assert reprocess_clip(clip.id)
+    paragraph = ClipParagraph.objects.get(clip=clip)
+    assert paragraph.speaker == "Alice"
+    assert np.allclose(paragraph.embedding, embedding)
+    assert paragraph.embedding_bits == binary_quantize(embedding)
@@ -12,6 +12,13 @@ urlpatterns = [
     path("update_speaker/<int:clip_id>", views.update_speaker, name="update_speaker"),
     path("channels", views.channels, name="channels"),
     path("download", views.download, name="download"),
+    path("download/<int:job_id>", views.ingest_status, name="ingest_status"),
+    path(
+        "search/metrics",
+        views.query_embedding_metrics,
+        name="query_embedding_metrics",
+    ),
+    path("clip/metrics", views.page_cache_metrics, name="page_cache_metrics"),
     # path("delete/<str:clip_id>/", views.delete, name="delete"),
     # path("paragraph/<str:clip_id>/", views.paragraph, name="paragraph"),
     # path("embedding", views.embedding, name="embedding"),
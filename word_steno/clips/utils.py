@@ -1,39 +1,43 @@
+import bisect
+import hashlib
+import json
 import logging
-import os
+import math
 import re
-from io import BytesIO
-from json import loads
+import tempfile
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-from botocore.exceptions import ClientError
 from deepgram import DeepgramClient
 from deepgram import PrerecordedOptions
+from django.conf import settings
+from django.db import connection
 from pytube import YouTube
+from pytube import request as pytube_request
 
+from .embeddings import build_summary_prompt
 from .embeddings import generate_summary_with_prompt
 from .models import Chapter
-from .models import ClipParagraph
+from .persistence import build_paragraphs
+from .persistence import restore_paragraph_fields
+from .persistence import save_chapters
+from .persistence import save_paragraphs
+from .storage import get_storage
 
 TWO_HOURS = 2 * 60 * 60
 FORMAT_HOURS = 3
 FORMAT_MINUTES = 2
-
-
-def get_description(video_url) -> str:
-    video = YouTube(video_url)
-    i: int = video.watch_html.find('"shortDescription":"')
-    desc: str = '"'
-    i += 20  # excluding the `"shortDescription":"`
-    while True:
-        letter = video.watch_html[i]
-        desc += letter  # letter can be added in any case
-        i += 1
-        if letter == "\\":
-            desc += video.watch_html[i]
-            i += 1
-        elif letter == '"':
-            break
-    return loads(desc)
+AUDIO_CHUNK_SIZE = 1024 * 1024
+# Seconds the audio download may wait to connect or for each chunk
+AUDIO_STREAM_TIMEOUT = 30
+AUDIO_MANIFEST = "manifest.json"
+DEEPGRAM_OPTIONS = {
+    "model": "nova-2",
+    "smart_format": True,
+    "diarize": True,
+    "summarize": "v2",
+}
 
 
 def timestamp_to_seconds(timestamp):
@@ -48,7 +52,7 @@ def timestamp_to_seconds(timestamp):
     return 0  # Return 0 seconds if the format is unexpected
 
 
-def extract_chapters(paragraphs_data, clip):
+def parse_description_chapters(description):
     """Extracts chapters and their timestamps (in seconds) from a video description."""
 
     # Needs to check all "dash" characters (hyphen-minus, en dash, em dash) in but RUF001 doesn't allow it
@@ -58,7 +62,7 @@ def extract_chapters(paragraphs_data, clip):
     )
 
     chapters = []
-    for line in clip.description.split("\n"):
+    for line in description.split("\n"):
         match = chapter_regex.match(line.strip())
         if match:
             # Choose the first matching group if it captured the timestamp, otherwise use the second
@@ -66,107 +70,234 @@ def extract_chapters(paragraphs_data, clip):
             timestamp_seconds = timestamp_to_seconds(timestamp_str)
             title = match.group(3)
             chapters.append({"start": timestamp_seconds, "title": title})
+    return chapters
 
-    if len(chapters) == 0:
-        return
 
-    for i, chapter in enumerate(chapters):
-        # Set the next chapter's start time to the end of the video
-        next_chapter_start = clip.length
+def assign_paragraphs(paragraphs_data, chapters, end):
+    """Sets each chapter's paragraphs, transcription and speakers in one sweep.
 
-        if i + 1 < len(chapters):
-            next_chapter_start = chapters[i + 1]["start"]
+    A chapter gets the paragraphs starting in ``[start, next chapter's start)``,
+    the last one those before ``end``, if given. Paragraph starts are sorted
+    once and each chapter's range is found by bisection, instead of scanning
+    every paragraph for every chapter.
+    """
+    paragraphs = sorted(paragraphs_data, key=lambda p: p["start"])
+    starts = [p["start"] for p in paragraphs]
+    boundaries = [chapter["start"] for chapter in chapters[1:]]
+    boundaries.append(math.inf if end is None else end)
 
-        # Filter paragraphs that fall into the current chapter's time range
-        chapter_paragraphs = [
-            p
-            for p in paragraphs_data
-            if chapter["start"] <= p["start"] < next_chapter_start
-        ]
+    for chapter, next_chapter_start in zip(chapters, boundaries, strict=True):
+        low = bisect.bisect_left(starts, chapter["start"])
+        high = max(low, bisect.bisect_left(starts, next_chapter_start))
+        chapter["paragraphs"] = paragraphs[low:high]
 
         # Generate aggregated text for the chapter
-        chapter_transcription = "\n\n".join(
+        chapter["chapter_transcription"] = "\n\n".join(
             [
                 f"Speaker: {p['speaker']}\n{p['full_transcription']}"
-                for p in chapter_paragraphs
+                for p in chapter["paragraphs"]
             ],
         )
 
         # Generate Speakers
-        unique_speakers = {p["speaker"] for p in chapter_paragraphs}
-        speakers = ", ".join([f"'{speaker}'" for speaker in unique_speakers])
+        unique_speakers = {p["speaker"] for p in chapter["paragraphs"]}
+        chapter["speakers"] = ", ".join(
+            [f"'{speaker}'" for speaker in unique_speakers],
+        )
+    return chapters
 
-        # Generate Summary for the chapter
-        summarizer = generate_summary_with_prompt(
-            chapter_transcription,
-            speakers,
+
+def summarize_chapter(summarize, chapter):
+    """Returns ``(summary, prompt, error)``; a failed summary does not raise."""
+    try:
+        summarizer = summarize(
+            chapter["chapter_transcription"],
+            chapter["speakers"],
             chapter["title"],
         )
+    except Exception as e:
+        logging.exception("Exception: summarizing chapter %s.", chapter["title"])
+        prompt = build_summary_prompt(
+            chapter["chapter_transcription"],
+            chapter["speakers"],
+            chapter["title"],
+        )
+        return "", prompt, str(e) or e.__class__.__name__
+    finally:
+        # Runs on a pool thread, which gets its own connection for the cache
+        connection.close()
+    return summarizer["summary"], summarizer["prompt"], summarizer.get("error", "")
+
+
+def extract_chapters(paragraphs_data, clip, summarize=generate_summary_with_prompt):
+    """Saves a summarized chapter for each chapter in the clip's description.
+
+    ``summarize`` takes the chapter's transcription, speakers and title and
+    returns its ``summary`` and ``prompt``, with an ``error`` if it gave no
+    summary. Chapters are summarized concurrently, and a chapter whose summary
+    fails is saved with its ``summary_error`` instead.
+    """
+    chapters = parse_description_chapters(clip.description)
+
+    if len(chapters) == 0:
+        return []
 
-        Chapter.objects.create(
+    assign_paragraphs(paragraphs_data, chapters, clip.length)
+
+    # Generate Summaries for the chapters
+    with ThreadPoolExecutor(max_workers=settings.CLIPS_SUMMARY_CONCURRENCY) as executor:
+        summaries = list(
+            executor.map(
+                lambda chapter: summarize_chapter(summarize, chapter),
+                chapters,
+            ),
+        )
+
+    rows = [
+        Chapter(
             clip=clip,
             title=chapter["title"],
             start=chapter["start"],
-            paragraphs=chapter_paragraphs,
-            chapter_transcription=chapter_transcription,
-            prompt=summarizer["prompt"],
-            summary=summarizer["summary"],
+            paragraphs=chapter["paragraphs"],
+            chapter_transcription=chapter["chapter_transcription"],
+            prompt=prompt,
+            summary=summary,
+            summary_error=error,
         )
+        for chapter, (summary, prompt, error) in zip(chapters, summaries, strict=True)
+    ]
 
+    # Summaries are slow, so write the chapters only once all of them are ready
+    return save_chapters(rows)
 
-def download_audio(yt):
-    video_title = yt.title
-    # Replace problematic characters in the title to make it a valid filename
-    # You might need to expand this list based on your requirements
-    filename = "".join([c for c in video_title if c.isalpha() or c.isdigit()]).rstrip()
 
-    audio_stream = yt.streams.filter(only_audio=True).first()
-    buffer = BytesIO()
-    audio_stream.stream_to_buffer(buffer)
-    buffer.seek(0)  # Rewind the buffer to the beginning
+def iter_audio_chunks(metadata, chunk_size=AUDIO_CHUNK_SIZE):
+    """Yields the video's audio as it downloads, never holding more than a chunk.
+
+    A stream that stalls for ``AUDIO_STREAM_TIMEOUT`` seconds raises rather
+    than hanging the worker with its job and upload open.
+    """
+    if metadata.audio_stream is not None:
+        with urllib.request.urlopen(  # noqa: S310
+            metadata.audio_stream.url,
+            timeout=AUDIO_STREAM_TIMEOUT,
+        ) as response:
+            while chunk := response.read(chunk_size):
+                yield chunk
+    else:
+        # The cached stream URLs have expired or need deciphering
+        audio_stream = YouTube(metadata.url).streams.filter(only_audio=True).first()
+        yield from pytube_request.stream(
+            audio_stream.url,
+            timeout=AUDIO_STREAM_TIMEOUT,
+        )
+
+
+def buffer_audio(metadata):
+    """Downloads the video's audio into a temporary file, rewound for reading.
+
+    The download from YouTube then finishes before the upload to S3 starts, so
+    a slow upload does not keep a YouTube connection open.
+    """
+    file = tempfile.TemporaryFile()
+    try:
+        for chunk in iter_audio_chunks(metadata):
+            file.write(chunk)
+    except BaseException:
+        file.close()
+        raise
+    file.seek(0)
+    return file
+
+
+def iter_file_chunks(file, chunk_size=AUDIO_CHUNK_SIZE):
+    while chunk := file.read(chunk_size):
+        yield chunk
 
-    object_name = upload_to_s3(
-        buffer,
-        filename,
-        os.environ.get("DJANGO_AWS_STORAGE_BUCKET_NAME"),
-    )
+
+class ChunkDigest:
+    """Hashes and counts chunks as they pass through :meth:`wrap`."""
+
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def wrap(self, chunks):
+        for chunk in chunks:
+            self.sha256.update(chunk)
+            self.size += len(chunk)
+            yield chunk
+
+
+def find_stored_audio(storage, metadata):
+    """Returns the key of audio already stored for this video, if it still matches.
+
+    The manifest written after each upload records which object holds the
+    video's audio, so reprocessing and backfills can skip both the download and
+    the upload with a couple of small requests.
+    """
+    manifest = storage.read(f"clips/{metadata.video_id}/{AUDIO_MANIFEST}")
+    if manifest is None:
+        return None
+    manifest = json.loads(manifest)
+
+    stream = metadata.audio_stream
+    if stream is not None and stream.filesize not in (None, manifest["size"]):
+        return None
+    if not storage.exists(manifest["key"]):
+        return None
+    return manifest["key"]
+
+
+def download_audio(metadata, audio=None):
+    """Stores the video's audio under a key derived from its video_id and content.
+
+    Keys look like ``clips/<video_id>/<sha256>.mp3``, so two videos can never
+    overwrite each other and identical audio is only ever stored once. The
+    audio streams from YouTube unless ``audio``, a file from
+    :func:`buffer_audio`, already holds it.
+    """
+    storage = get_storage()
+    object_name = find_stored_audio(storage, metadata)
+
+    if object_name is None:
+        # The hash is only known once the last chunk has gone up, so upload
+        # under a temporary key and move the object into place afterwards
+        digest = ChunkDigest()
+        staging_key = f"clips/{metadata.video_id}/upload-{uuid.uuid4().hex}.mp3"
+        chunks = (
+            iter_audio_chunks(metadata) if audio is None else iter_file_chunks(audio)
+        )
+        storage.stream_upload(digest.wrap(chunks), staging_key)
+
+        sha256 = digest.sha256.hexdigest()
+        object_name = f"clips/{metadata.video_id}/{sha256}.mp3"
+        if storage.exists(object_name):
+            storage.delete(staging_key)
+        else:
+            storage.move(staging_key, object_name)
+
+        manifest = {"key": object_name, "sha256": sha256, "size": digest.size}
+        storage.write(
+            f"clips/{metadata.video_id}/{AUDIO_MANIFEST}",
+            json.dumps(manifest).encode(),
+        )
 
     return {
-        "storage_path": f"https://{os.environ.get('DJANGO_AWS_STORAGE_BUCKET_NAME')}.s3.{os.environ.get('DJANGO_AWS_S3_REGION_NAME')}.amazonaws.com/{object_name}",
+        "storage_path": storage.url(object_name),
         "object_name": object_name,
     }
 
 
-def upload_to_s3(buffer, filename, bucket_name):
-    s3 = boto3.client(
-        "s3",
-        aws_access_key_id=os.environ.get("DJANGO_AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.environ.get("DJANGO_AWS_SECRET_ACCESS_KEY"),
-    )
-    s3.upload_fileobj(buffer, bucket_name, f"clips/{filename}.mp3")
-    return f"clips/{filename}.mp3"
-
-
 def transcribe_audio(file_path):
     # Initialize the Deepgram SDK
     dg_client = DeepgramClient()
 
     # Create a presigned url for the audio file in S3
-    url = create_presigned_url(
-        os.environ.get("DJANGO_AWS_STORAGE_BUCKET_NAME"),
-        file_path,
-    )
-
-    if url is not None:
-        audio_data = {"url": url}
+    audio_data = {"url": get_storage().presign(file_path)}
 
     # Prepare the transcription request options
-    options = PrerecordedOptions(
-        model="nova-2",
-        smart_format=True,
-        diarize=True,
-        summarize="v2",
-    )
+    options = PrerecordedOptions(**DEEPGRAM_OPTIONS)
 
     try:
         # Perform transcription and return result
@@ -181,65 +312,23 @@ def transcribe_audio(file_path):
         return None
 
 
-def create_presigned_url(bucket_name, object_name, expiration=3600):
-    """Generate a presigned URL to share an S3 object
-
-    :param bucket_name: string
-    :param object_name: string
-    :param expiration: Time in seconds for the presigned URL to remain valid
-    :return: Presigned URL as string. If error, returns None.
-    """
-
-    # Generate a presigned URL for the S3 object
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=os.environ.get("DJANGO_AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.environ.get("DJANGO_AWS_SECRET_ACCESS_KEY"),
-    )
-    try:
-        response = s3_client.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": bucket_name, "Key": object_name},
-            ExpiresIn=expiration,
-        )
-    except ClientError as e:
-        return e
-
-    # The response contains the presigned URL
-    return response
-
-
-def extract_paragraphs(paragraphs_data, clip):
-    if paragraphs_data:
-        outputparagraphs = []
-        for paragraph in paragraphs_data:
-            # Create Full Transcription for the paragraph
-            full_transcription = ""
-            sentences = paragraph.get("sentences")
-            if sentences:
-                for sentence in sentences:
-                    full_transcription += sentence.get("text") + " "
-
-            outputparagraphs.append(
-                {
-                    "clip": clip.id,
-                    "end": paragraph.get("end"),
-                    "start": paragraph.get("start"),
-                    "speaker": paragraph.get("speaker"),
-                    "sentences": paragraph.get("sentences"),
-                    "full_transcription": full_transcription,
-                },
-            )
-
-            ClipParagraph.objects.create(
-                clip=clip,
-                end=paragraph.get("end"),
-                start=paragraph.get("start"),
-                speaker=paragraph.get("speaker"),
-                sentences=paragraph.get("sentences"),
-                full_transcription=full_transcription,
-            )
-    return outputparagraphs
+def extract_paragraphs(paragraphs_data, clip, kept=None):
+    """Saves the clip's paragraphs, with the ``kept`` fields of unchanged ones."""
+    paragraphs = build_paragraphs(paragraphs_data, clip)
+    if kept:
+        restore_paragraph_fields(paragraphs, kept)
+    paragraphs = save_paragraphs(paragraphs)
+    return [
+        {
+            "clip": clip.id,
+            "end": paragraph.end,
+            "start": paragraph.start,
+            "speaker": paragraph.speaker,
+            "sentences": paragraph.sentences,
+            "full_transcription": paragraph.full_transcription,
+        }
+        for paragraph in paragraphs
+    ]
 
 
 def extract_youtube_video_id(url):
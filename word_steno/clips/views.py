@@ -1,119 +1,145 @@
 import json
 import logging
 import math
+import os
 
-import markdown
+from django.conf import settings
 from django.contrib.auth.decorators import user_passes_test
-from django.contrib.postgres.search import SearchQuery
-from django.contrib.postgres.search import SearchRank
-from django.contrib.postgres.search import SearchVector
-from django.db.models import F
 from django.http import HttpResponse
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
 from django.shortcuts import render
+from django.template.loader import render_to_string
 from django.urls import reverse
-from pytube import YouTube
 
+from .embeddings import get_query_cache
 from .embeddings import search_embeddings
+from .ingest import enqueue
+from .models import Channel
 from .models import Chapter
 from .models import Clip
 from .models import ClipParagraph
-from .utils import download_audio
-from .utils import extract_chapters
-from .utils import extract_paragraphs
+from .models import IngestJob
+from .page_cache import CSRF_PLACEHOLDER
+from .page_cache import get_page_cache
+from .page_cache import with_csrf_token
+from .persistence import build_paragraphs
+from .persistence import save_page_payload
+from .persistence import save_paragraphs
+from .search import fulltext_page
+from .search import hybrid_search
 from .utils import extract_youtube_video_id
-from .utils import get_description
-from .utils import transcribe_audio
-
-# Static
-TWO_HOURS = 2 * 60 * 60
 
 logger = logging.getLogger(__name__)
 
+SEARCH_MODES = [
+    ("fulltext", "Exact words"),
+    ("semantic", "Meaning"),
+    ("hybrid", "Both"),
+]
+
+
+def search_result(paragraphs):
+    """Builds a search result for one clip from its paragraphs, best first."""
+    cp = paragraphs[0]
+    return {
+        "clip_paragraph_id": cp.id,
+        "clip_id": cp.clip.id,
+        "clip_url": f"{cp.clip.url}&t={int(cp.start-3)}",
+        "clip_title": cp.clip.title,
+        # Sort the full_transcription list by the 'start' value
+        "full_transcription": sorted(
+            [
+                {
+                    "text": p.full_transcription,
+                    "start": math.floor(p.start),
+                    "end": math.ceil(p.end),
+                }
+                for p in paragraphs
+            ],
+            key=lambda x: x["start"],
+        ),
+        "rank": cp.rank,
+        "start": math.floor(
+            cp.start,
+        ),
+        "end": math.ceil(cp.end),
+        "speaker": cp.speaker,
+        "channel_title": cp.clip.channel_title,
+        "video_length": cp.clip.length,
+        "video_summary": cp.clip.summary,
+        "video_id": cp.clip.video_id,
+        "embed_url": (
+            f"https://www.youtube.com/embed/{extract_youtube_video_id(cp.clip.url)}"
+            f"?start={math.floor(cp.start)}"
+            f"&end={math.ceil(cp.end)}"
+        ),
+    }
+
 
 # Create your views here.
 def index(request):
     search_term = request.GET.get("query", "")
     if not search_term:
-        return render(request, "clips/search.html")
-
-    # Define the search query
-    search_query = SearchQuery(search_term, config="english")
-
-    # Annotate each ClipParagraph with a search vector and rank based on the 'text'
-    # key of the sentences JSONB field
-    clip_paragraphs = (
-        ClipParagraph.objects.annotate(
-            search_vector=SearchVector(
-                "full_transcription",
-                config="english",
-                weight="A",
-            ),
-        )
-        .annotate(
-            rank=SearchRank(F("search_vector"), search_query),
-        )
-        .filter(search_vector=search_query)
-        .order_by("-rank")
-        .select_related("clip")
-    )
-
-    grouped_results = {}
-    for cp in clip_paragraphs:
-        clip_id = cp.clip.id
-        if clip_id not in grouped_results:
-            grouped_results[clip_id] = {
-                "clip_paragraph_id": cp.id,
-                "clip_id": cp.clip.id,
-                "clip_url": f"{cp.clip.url}&t={int(cp.start-3)}",
-                "clip_title": cp.clip.title,
-                "sentences": cp.sentences,
-                "full_transcription": [],
-                "rank": cp.rank,
-                "start": math.floor(
-                    cp.start,
-                ),
-                "end": math.ceil(cp.end),
-                "speaker": cp.speaker,
-                "channel_title": cp.clip.channel_title,
-                "video_length": cp.clip.length,
-                "video_transcription": cp.clip.full_transcription,
-                "video_summary": cp.clip.summary,
-                "video_id": cp.clip.video_id,
-                "embed_url": (
-                    f"https://www.youtube.com/embed/{extract_youtube_video_id(cp.clip.url)}"
-                    f"?start={math.floor(cp.start)}"
-                    f"&end={math.ceil(cp.end)}"
-                ),
-            }
-        # Now append the full_transcription and any other necessary details
-        grouped_results[clip_id]["full_transcription"].append(
-            {
-                "text": cp.full_transcription,
-                "start": math.floor(cp.start),
-                "end": math.ceil(cp.end),
-            },
-        )
-        # Repeat for other fields as necessary
-
-    # After appending all full_transcription entries to grouped_results
-    for group in grouped_results.values():
-        # Sort the full_transcription list for each group by the 'start' value
-        group["full_transcription"] = sorted(
-            group["full_transcription"],
-            key=lambda x: x["start"],
+        return render(request, "clips/search.html", {"search_modes": SEARCH_MODES})
+
+    mode = request.GET.get("mode", "fulltext")
+    next_cursor = None
+    if mode in ("hybrid", "semantic"):
+        fulltext_weight = 0 if mode == "semantic" else None
+        # Already bounded by CLIPS_SEARCH_CANDIDATES, so group them here
+        groups = {}
+        for cp in hybrid_search(search_term, fulltext_weight=fulltext_weight):
+            groups.setdefault(cp.clip_id, []).append(cp)
+        groups = [
+            paragraphs[: settings.CLIPS_SEARCH_PARAGRAPHS_PER_CLIP]
+            for paragraphs in groups.values()
+        ]
+    else:
+        mode = "fulltext"
+        groups, next_cursor = fulltext_page(
+            search_term,
+            after=request.GET.get("after"),
         )
 
-    # Convert grouped_results to a list format as per your requirement
-    results = [value for key, value in grouped_results.items()]
+    results = [search_result(paragraphs) for paragraphs in groups]
 
     return render(
         request,
         "clips/search.html",
-        {"results": results, "search_term": search_term},
+        {
+            "results": results,
+            "search_term": search_term,
+            "mode": mode,
+            "search_modes": SEARCH_MODES,
+            "next_cursor": next_cursor,
+        },
     )
 
 
+def render_clip_fragments(clip):
+    """Renders the parts of a clip page that only change when the clip does."""
+    # Clips saved before payloads existed get theirs on the first view
+    serialized_paragraphs = clip.load("page_payload") or save_page_payload(clip.id)
+    clip_paragraphs = json.loads(serialized_paragraphs)
+    context = {
+        "clip_id": clip.id,
+        "clip_paragraphs": clip_paragraphs,
+        "serialized_paragraphs": serialized_paragraphs,
+        "speakers": sorted({cp["speaker"] for cp in clip_paragraphs}),
+        # Summaries are rendered to HTML when the chapters are saved
+        "chapters": Chapter.objects.filter(clip_id=clip.id)
+        .order_by("start")
+        .values("title", "start", "summary_html"),
+        "csrf_token": CSRF_PLACEHOLDER,
+    }
+    return {
+        "speakers": render_to_string("clips/clip_speakers.html", context),
+        "transcript": render_to_string("clips/clip_transcript.html", context),
+    }
+
+
 def clip(request, clip_id, start=0):
     try:
         if request.method == "POST":
@@ -127,59 +153,26 @@ def clip(request, clip_id, start=0):
                     clip_id=clip_id,
                     speaker=old_speaker,
                 ).update(speaker=updated_speaker)
+                save_page_payload(clip_id)
                 return redirect(
                     reverse("clips:clip", args=[clip_id]),
                 )
 
         # fetch clip data
-        clip = Clip.objects.get(id=clip_id)
-        paragraph_set = ClipParagraph.objects.filter(clip_id=clip_id).order_by("start")
-        speakers = (
-            ClipParagraph.objects.filter(clip_id=clip_id)
-            .values_list("speaker", flat=True)
-            .distinct()
-            .order_by("speaker")
+        clip = Clip.objects.for_listing("page_version").get(id=clip_id)
+        fragments = get_page_cache().get(
+            clip.id,
+            clip.page_version,
+            lambda: render_clip_fragments(clip),
         )
 
-        clip_paragraphs = [
-            {
-                "id": cp.id,
-                "sentences": cp.sentences,
-                "full_transcription": cp.full_transcription,
-                "start": math.floor(cp.start),
-                "end": math.ceil(cp.end),
-                "speaker": cp.speaker,
-            }
-            for cp in paragraph_set
-        ]
-
-        # Get chapters
-        chapters = Chapter.objects.filter(clip_id=clip_id).order_by("start").values()
-
-        # Format chapter summaries
-        formatted_summaries = []
-
-        for chapter in chapters:
-            chapter_data = {
-                **chapter,
-                "summary_markdown": markdown.markdown(
-                    chapter["summary"],
-                    extensions=["extra", "nl2br", "sane_lists", "smarty"],
-                ),
-            }
-
-            formatted_summaries.append(chapter_data)
-
         return render(
             request,
             "clips/clip.html",
             {
                 "clip": clip,
-                "clip_paragraphs": clip_paragraphs,
-                "serialized_paragraphs": json.dumps(clip_paragraphs),
-                "speakers": speakers,
+                "fragments": with_csrf_token(fragments, request),
                 "start": start,
-                "chapters": formatted_summaries,
             },
         )
     except Clip.DoesNotExist:
@@ -196,6 +189,7 @@ def update_speaker(request, clip_id):
         ClipParagraph.objects.filter(clip_id=clip_id, id=paragraph_id).update(
             speaker=updated_speaker,
         )
+        save_page_payload(clip_id)
         # Redirect to a new URL to prevent form resubmission
         return redirect(
             reverse("clips:clip", args=[clip_id]),
@@ -206,25 +200,29 @@ def update_speaker(request, clip_id):
 
 def channels(request):
     try:
-        # Fetch distinct channels
-        channel_titles = Clip.objects.values_list("channel_title", flat=True).distinct()
+        channels = Channel.objects.order_by("title")
 
-        selected_channel = request.GET.get("channel", None)
+        channel_id = request.GET.get("channel", "")
+        selected_channel = None
+        if channel_id.isdigit():
+            selected_channel = Channel.objects.filter(id=channel_id).first()
         clips = None
+        next_cursor = None
 
         if selected_channel:
             # Fetch clips for the selected channel
-            clips = Clip.objects.filter(channel_title=selected_channel).order_by(
-                "-published_at",
+            clips, next_cursor = selected_channel.clips_page(
+                after=request.GET.get("after"),
             )
 
         return render(
             request,
             "clips/channels.html",
             {
-                "channel_titles": channel_titles,
+                "channels": channels,
                 "clips": clips,
                 "selected_channel": selected_channel,
+                "next_cursor": next_cursor,
             },
         )
 
@@ -235,113 +233,81 @@ def channels(request):
 @user_passes_test(lambda u: u.is_superuser)
 def download(request):
     if request.method == "POST":
-        try:
-            video_url = request.POST.get("youtube_url")
-
-            if not video_url:
-                return HttpResponse("No URL provided", status=400)
-
-            # Initialize video url
-            yt = YouTube(video_url)
-            if yt.length > TWO_HOURS:
-                return HttpResponse(
-                    (
-                        "Youtube Video is greater than 2 hours. "
-                        "Please use a shorter video."
-                    ),
-                    status=400,
-                )
+        video_url = request.POST.get("youtube_url")
 
-            # Check if the Clip with this video_id already exists
-            video_id = extract_youtube_video_id(video_url)
-            clip, created = Clip.objects.get_or_create(
-                video_id=video_id,
-                defaults={
-                    "url": video_url,
-                    "title": yt.title,
-                    "length": yt.length,
-                    "channel_title": yt.author,
-                    "description": get_description(video_url),
-                    "published_at": yt.publish_date,
-                },
-            )
+        if not video_url:
+            return HttpResponse("No URL provided", status=400)
 
-            if not created:
-                return redirect(reverse("clips:clip", args=[clip.id]))
+        video_id = extract_youtube_video_id(video_url)
+        if not video_id:
+            return HttpResponse("Not a YouTube video URL", status=400)
 
-            # Download & Upload Audio to S3
-            video_details = download_audio(yt)
+        # Check if the Clip with this video_id already exists
+        clip_id = (
+            Clip.objects.ingested()
+            .filter(video_id=video_id)
+            .values_list("id", flat=True)
+            .first()
+        )
+        if clip_id is not None:
+            return redirect(reverse("clips:clip", args=[clip_id]))
 
-            # Transcribe audio file from S3
-            transcribed_audio = transcribe_audio(video_details["object_name"])
+        # The ingest_worker command downloads, transcribes and saves the clip
+        job = enqueue(video_url)
+        return render(request, "clips/ingest_status.html", {"job": job}, status=202)
 
-            # modify transcribed data to json format
-            data = transcribed_audio.to_json()
-            data = json.loads(data)
-            deepgram_object = data["results"]["channels"][0]["alternatives"][0]
-            paragraphs_data = deepgram_object["paragraphs"]["paragraphs"]
+    return render(request, "clips/download_form.html")
 
-            # Save transcribed data to clip model
-            clip.storage_path = video_details["storage_path"]
-            clip.full_transcription = deepgram_object["paragraphs"]["transcript"]
-            clip.summary = data["results"]["summary"]["short"]
-            clip.paragraphs = paragraphs_data
-            clip.words = deepgram_object["words"]
 
-            clip.save()
+@user_passes_test(lambda u: u.is_superuser)
+def ingest_status(request, job_id):
+    job = get_object_or_404(IngestJob, id=job_id)
+    return JsonResponse(
+        {
+            "id": job.id,
+            "video_id": job.video_id,
+            "status": job.status,
+            "stage": job.stage,
+            "stage_label": job.get_stage_display(),
+            "progress": job.progress,
+            "error": job.error,
+            "clip_url": (
+                reverse("clips:clip", args=[job.clip_id])
+                if job.status == IngestJob.Status.SUCCEEDED
+                else None
+            ),
+        },
+    )
 
-            # Save Paragraphs in ClipParagraph model
-            extracted_paragraphs = extract_paragraphs(paragraphs_data, clip)
 
-            # Save Chapters in Chapters model
-            extract_chapters(extracted_paragraphs, clip)
+@user_passes_test(lambda u: u.is_superuser)
+def query_embedding_metrics(request):
+    # Each worker process has its own in-process tier and counters
+    return JsonResponse({"pid": os.getpid(), **get_query_cache().metrics()})
 
-            # Redirect to results page
-            return redirect(reverse("clips:clip", args=[clip.id]))
-        except Exception as e:
-            logging.exception(
-                "Exception: download POST: downloading, transcribing and saving the clip.",
-            )
-            return HttpResponse(f"An error occurred: {e}", status=500)
-    else:
-        return render(request, "clips/download_form.html")
 
+@user_passes_test(lambda u: u.is_superuser)
+def page_cache_metrics(request):
+    # Counters are per worker process, like the query embedding cache's
+    return JsonResponse({"pid": os.getpid(), **get_page_cache().metrics()})
 
-def delete(request, clip_id):
-    try:
-        # fetch clip data
-        clip = Clip.objects.get(id=clip_id)
-        clip.delete()
 
-        return HttpResponse(f"Clip with ID {clip_id} is deleted", status=200)
-    except Clip.DoesNotExist:
+def delete(request, clip_id):
+    # Deleting loads only what the channel stats signal needs of the clip.
+    # Its cached page goes unused, as there is no version left to look it up by
+    deleted, _ = Clip.objects.filter(id=clip_id).only("id", "channel").delete()
+    if not deleted:
         return HttpResponse(f"Clip with ID {clip_id} does not exist.", status=500)
+    return HttpResponse(f"Clip with ID {clip_id} is deleted", status=200)
 
 
 # transfer paragraphs to a new model
 def paragraph(request, clip_id):
     try:
         # fetch clip data
-        clip = Clip.objects.get(id=clip_id)
-        paragraphs_data = clip.paragraphs
-
-        if paragraphs_data:
-            for paragraph in paragraphs_data:
-                # Create Full Transcription for the paragraph
-                full_transcription = ""
-                sentences = paragraph.get("sentences")
-                if sentences:
-                    for sentence in sentences:
-                        full_transcription += sentence.get("text") + " "
-
-                ClipParagraph.objects.create(
-                    clip=clip,
-                    end=paragraph.get("end"),
-                    start=paragraph.get("start"),
-                    speaker=paragraph.get("speaker"),
-                    sentences=paragraph.get("sentences"),
-                    full_transcription=full_transcription,
-                )
+        clip = Clip.objects.light().get(id=clip_id)
+        save_paragraphs(build_paragraphs(clip.load("paragraphs"), clip))
+        save_page_payload(clip_id)
         return HttpResponse("Paragraphs transferred successfully.", status=200)
     except Clip.DoesNotExist:
         return HttpResponse("Clip not found.", status=404)
@@ -349,9 +315,9 @@ def paragraph(request, clip_id):
 
 def embedding_save(request):
     try:
-        for clip in Clip.objects.all():
+        for clip in Clip.objects.only("url"):
             clip.video_id = extract_youtube_video_id(clip.url)
-            clip.save()
+            clip.save(update_fields=["video_id", "updated_at"])
 
         return HttpResponse("Embedding successfully.", status=200)
 
@@ -370,7 +336,6 @@ def embedding(request):
                 "clip_id": cp.clip.id,
                 "clip_url": f"{cp.clip.url}&t={int(cp.start-3)}",
                 "clip_title": cp.clip.title,
-                "sentences": cp.sentences,
                 "full_transcription": cp.full_transcription,
                 "start": cp.start,
                 "end": cp.end,
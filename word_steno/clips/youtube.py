@@ -0,0 +1,210 @@
+import json
+import logging
+import tempfile
+import time
+import urllib.request
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import UTC
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+from .utils import parse_description_chapters
+
+logger = logging.getLogger(__name__)
+
+WATCH_URL = "https://www.youtube.com/watch?v={video_id}"
+PLAYER_RESPONSE_MARKER = "ytInitialPlayerResponse = "
+REQUEST_TIMEOUT = 30
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+    ),
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+
+class VideoUnavailableError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class AudioStream:
+    itag: int
+    mime_type: str
+    bitrate: int
+    filesize: int | None
+    # Streams that YouTube only serves with a signature cipher have no url
+    url: str | None
+
+    @property
+    def expires_at(self):
+        if not self.url:
+            return None
+        expire = parse_qs(urlparse(self.url).query).get("expire")
+        return int(expire[0]) if expire else None
+
+    @property
+    def is_usable(self):
+        return bool(self.url) and (self.expires_at or 0) > time.time()
+
+
+@dataclass(frozen=True)
+class VideoMetadata:
+    video_id: str
+    title: str
+    description: str
+    length: int
+    channel_title: str
+    published_at: str | None
+    chapters: list[dict] = field(default_factory=list)
+    audio_streams: list[AudioStream] = field(default_factory=list)
+
+    @property
+    def url(self):
+        return WATCH_URL.format(video_id=self.video_id)
+
+    @property
+    def publish_date(self):
+        if not self.published_at:
+            return None
+        published = datetime.fromisoformat(self.published_at)
+        if published.tzinfo is None:
+            published = published.replace(tzinfo=UTC)
+        return published
+
+    @property
+    def audio_stream(self):
+        """The first directly downloadable audio stream, like pytube picks."""
+        return next((s for s in self.audio_streams if s.is_usable), None)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        streams = [AudioStream(**stream) for stream in data.pop("audio_streams")]
+        return cls(**data, audio_streams=streams)
+
+
+def extract_player_response(watch_html):
+    """Decodes the player JSON embedded in a watch page in one pass."""
+    start = watch_html.find(PLAYER_RESPONSE_MARKER)
+    if start == -1:
+        msg = "The watch page has no player response."
+        raise VideoUnavailableError(msg)
+    player_response, _ = json.JSONDecoder().raw_decode(
+        watch_html,
+        start + len(PLAYER_RESPONSE_MARKER),
+    )
+    return player_response
+
+
+def parse_player_response(video_id, player_response):
+    playability = player_response.get("playabilityStatus", {})
+    if playability.get("status") != "OK":
+        msg = playability.get("reason") or f"Video {video_id} is unavailable."
+        raise VideoUnavailableError(msg)
+
+    details = player_response["videoDetails"]
+    microformat = player_response.get("microformat", {}).get(
+        "playerMicroformatRenderer",
+        {},
+    )
+    description = details.get("shortDescription", "")
+    audio_streams = [
+        AudioStream(
+            itag=stream["itag"],
+            mime_type=stream["mimeType"],
+            bitrate=stream.get("bitrate", 0),
+            filesize=int(stream["contentLength"])
+            if "contentLength" in stream
+            else None,
+            url=stream.get("url"),
+        )
+        for stream in player_response.get("streamingData", {}).get(
+            "adaptiveFormats",
+            [],
+        )
+        if stream.get("mimeType", "").startswith("audio/")
+    ]
+    return VideoMetadata(
+        video_id=video_id,
+        title=details.get("title", ""),
+        description=description,
+        length=int(details.get("lengthSeconds", 0)),
+        channel_title=details.get("author") or microformat.get("ownerChannelName", ""),
+        published_at=microformat.get("publishDate"),
+        chapters=parse_description_chapters(description),
+        audio_streams=audio_streams,
+    )
+
+
+def _cache_path(video_id):
+    return Path(settings.YOUTUBE_METADATA_CACHE_DIR) / f"{video_id}.json"
+
+
+def _read_cache(video_id):
+    path = _cache_path(video_id)
+    try:
+        if time.time() - path.stat().st_mtime > settings.YOUTUBE_METADATA_CACHE_TTL:
+            return None
+        return VideoMetadata.from_dict(json.loads(path.read_text()))
+    except FileNotFoundError:
+        return None
+    except (ValueError, TypeError, KeyError):
+        logger.warning("Ignoring unreadable metadata cache entry %s", path)
+        return None
+
+
+def _write_cache(metadata):
+    path = _cache_path(metadata.video_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename so concurrent readers never see a partial file
+    with tempfile.NamedTemporaryFile(
+        "w",
+        dir=path.parent,
+        suffix=".tmp",
+        delete=False,
+    ) as file:
+        tmp_path = Path(file.name)
+        try:
+            json.dump(metadata.to_dict(), file)
+        except Exception:
+            tmp_path.unlink()
+            raise
+    tmp_path.replace(path)
+
+
+def fetch_watch_html(video_id):
+    request = urllib.request.Request(  # noqa: S310
+        WATCH_URL.format(video_id=video_id),
+        headers=HEADERS,
+    )
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:  # noqa: S310
+        return response.read().decode("utf-8")
+
+
+def get_video_metadata(video_id, *, use_cache=True):
+    """Returns everything ingestion needs about a video from one page request.
+
+    Results are cached on disk for ``YOUTUBE_METADATA_CACHE_TTL`` seconds, so
+    retries and re-runs do not go back to YouTube.
+    """
+    if use_cache and (metadata := _read_cache(video_id)) is not None:
+        return metadata
+
+    player_response = extract_player_response(fetch_watch_html(video_id))
+    metadata = parse_player_response(video_id, player_response)
+    if use_cache:
+        try:
+            _write_cache(metadata)
+        except OSError:
+            logger.warning("Could not cache metadata for %s", video_id, exc_info=True)
+    return metadata
@@ -1,14 +1,35 @@
 import pytest
 
+from word_steno.clips import embeddings
+from word_steno.clips import llm
+from word_steno.clips import page_cache
+from word_steno.clips import storage
 from word_steno.users.models import User
 from word_steno.users.tests.factories import UserFactory
 
+# Process-wide instances built from settings, which tests may change
+SINGLETONS = [
+    embeddings.get_client,
+    embeddings.get_query_cache,
+    llm.get_client,
+    llm.get_rate_limiter,
+    page_cache.get_page_cache,
+    storage.get_storage,
+]
+
 
 @pytest.fixture(autouse=True)
 def _media_storage(settings, tmpdir) -> None:
     settings.MEDIA_ROOT = tmpdir.strpath
 
 
+@pytest.fixture(autouse=True)
+def _clear_singletons():
+    yield
+    for get_instance in SINGLETONS:
+        get_instance.cache_clear()
+
+
 @pytest.fixture()
 def user(db) -> User:
     return UserFactory()